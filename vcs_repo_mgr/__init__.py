@@ -78,36 +78,41 @@ Python API (`vcs-repo-mgr`)         Bazaar             Git                    Me
 """
 
 # Standard library modules.
+import binascii
+import errno
 import functools
+import hashlib
 import logging
 import operator
 import os
 import re
+import shlex
+import shutil
+import subprocess
 import sys
 import tempfile
+import threading
 import time
 
-# External dependencies.
-from executor import ExternalCommandFailed, execute, quote
-from humanfriendly import Timer, coerce_boolean, format_path, parse_path
+# External dependencies (modules that are only needed by specific code paths
+# are imported where they're used to keep the startup time of vcs-tool low).
+from executor import ExternalCommand, ExternalCommandFailed, execute, quote
+from humanfriendly import Timer, coerce_boolean, format_path, parse_path, parse_size, parse_timespan
 from humanfriendly.text import compact, concatenate, format, pluralize, split
-from humanfriendly.prompts import prompt_for_confirmation
 from humanfriendly.terminal import connected_to_terminal
-from natsort import natsort, natsort_key
 from property_manager import PropertyManager, lazy_property, required_property, writable_property
-from six import string_types
-from six.moves import configparser
-from six.moves import urllib_parse as urlparse
+from six import reraise, string_types
 
 # Modules included in our package.
+from vcs_repo_mgr.caching import LRUCache
 from vcs_repo_mgr.exceptions import (
     AmbiguousRepositoryNameError,
     MergeConflictError,
-    NoMatchingReleasesError,
     NoSuchRepositoryError,
     UnknownRepositoryTypeError,
     WorkingTreeNotCleanError,
 )
+from vcs_repo_mgr.statistics import command_statistics, instrument
 
 # Semi-standard module versioning.
 __version__ = '0.34'
@@ -118,23 +123,67 @@ USER_CONFIG_FILE = os.path.expanduser('~/.vcs-repo-mgr.ini')
 SYSTEM_CONFIG_FILE = '/etc/vcs-repo-mgr.ini'
 """The absolute pathname of the system wide configuration file (a string)."""
 
+SYSTEM_CONFIG_DIRECTORY = '/etc/vcs-repo-mgr.d'
+"""The absolute pathname of the directory with system wide ``*.ini`` configuration files (a string)."""
+
 UPDATE_VARIABLE = 'VCS_REPO_MGR_UPDATE_LIMIT'
 """The name of the environment variable that's used to rate limit repository updates (a string)."""
 
+EXPORT_MARKER = '.vcs-repo-mgr-export'
+"""The filename of the marker that ties an incremental export to its record (a string)."""
+
 KNOWN_RELEASE_SCHEMES = ('branches', 'tags')
 """The names of valid release schemes (a tuple of strings)."""
 
+KNOWN_RELEASE_ORDERINGS = ('natural', 'pep440', 'semver')
+"""
+The names of valid release orderings (a tuple of strings).
+
+This must match the keys of :data:`vcs_repo_mgr.ordering.RELEASE_ORDERINGS`,
+which remains the single source of truth (the test suite checks that they're
+equal). The names are repeated here so that validating
+:attr:`~Repository.release_ordering` doesn't require importing
+:mod:`vcs_repo_mgr.ordering` (and its dependencies) at startup.
+"""
+
+ARCHIVE_FORMATS = (('.tar', 'tar'), ('.tar.gz', 'tar.gz'), ('.tgz', 'tar.gz'),
+                   ('.tar.xz', 'tar.xz'), ('.txz', 'tar.xz'), ('.zip', 'zip'))
+"""The archive formats supported by :func:`Repository.export_archive()` (a tuple of (extension, format) tuples)."""
+
+DEFAULT_CONCURRENCY = 8
+"""
+The default maximum number of concurrent repository operations (an integer).
+
+Most of the time spent in repository operations is spent waiting for external
+commands (and the network) so this is the number of threads used by
+:func:`map_concurrently()` rather than the number of available CPU cores.
+"""
+
+FULL_GIT_REVISION_ID = re.compile('^[0-9a-f]{40}$')
+"""A compiled regular expression that matches complete git revision ids."""
+
 REPOSITORY_TYPES = set()
 """Available :class:`Repository` subclasses (a :class:`set` of :class:`type` objects)."""
 
 # Initialize a logger.
 logger = logging.getLogger(__name__)
 
-# Inject our logger into all execute() calls.
-execute = functools.partial(execute, logger=logger)
+# Inject our logger into all execute() calls and record statistics about them.
+execute = instrument(functools.partial(execute, logger=logger))
+
+loaded_repositories = LRUCache()
+"""
+Previously constructed :class:`Repository` objects (a :class:`~vcs_repo_mgr.caching.LRUCache` object).
+
+The size of the cache can be changed by setting the
+:attr:`~vcs_repo_mgr.caching.LRUCache.capacity` attribute and weak references
+can be enabled by setting the :attr:`~vcs_repo_mgr.caching.LRUCache.weak`
+attribute. The :attr:`~vcs_repo_mgr.caching.LRUCache.stats` property reports
+the number of cache hits, misses and evictions.
+"""
 
-# Dictionary of previously constructed Repository objects.
-loaded_repositories = {}
+# Dictionary with the most recently loaded configuration (see load_configuration()).
+loaded_configuration = {}
 
 
 def coerce_feature_branch(value):
@@ -245,10 +294,11 @@ def find_configured_repository(name):
     The following configuration files are supported:
 
     1. ``/etc/vcs-repo-mgr.ini``
-    2. ``~/.vcs-repo-mgr.ini``
+    2. ``/etc/vcs-repo-mgr.d/*.ini`` (in alphabetical order)
+    3. ``~/.vcs-repo-mgr.ini``
 
-    Repositories defined in the second file override repositories defined in
-    the first. Here is an example of a repository definition:
+    Repositories defined in later files override repositories defined in
+    earlier files. Here is an example of a repository definition:
 
     .. code-block:: ini
 
@@ -259,16 +309,24 @@ def find_configured_repository(name):
        bare = true
        release-scheme = tags
        release-filter = .*
+       release-ordering = natural
+       coprocess = false
+       native-refs = true
+       check-remote = false
+       max-age = 300
+       lock-timeout = 600
+       clone-strategy = full
+       shared-store = /var/cache/vcs-repo-mgr/shared.git
+       export-cache = /var/cache/vcs-repo-mgr/exports
+       export-cache-size = 10 GiB
+       export-cache-method = copy
+       incremental-export = false
 
     Three VCS types are currently supported: ``hg`` (``mercurial`` is also
     accepted), ``git`` and ``bzr`` (``bazaar`` is also accepted).
     """
-    parser = configparser.RawConfigParser()
-    for config_file in [SYSTEM_CONFIG_FILE, USER_CONFIG_FILE]:
-        if os.path.isfile(config_file):
-            logger.debug("Loading configuration file: %s", format_path(config_file))
-            parser.read(config_file)
-    matching_repos = [r for r in parser.sections() if normalize_name(name) == normalize_name(r)]
+    configuration = load_configuration()
+    matching_repos = configuration.index.get(normalize_name(name), [])
     if not matching_repos:
         msg = "No repositories found matching the name %r!"
         raise NoSuchRepositoryError(msg % name)
@@ -276,25 +334,136 @@ def find_configured_repository(name):
         msg = "Multiple repositories found matching the name %r! (%s)"
         raise AmbiguousRepositoryNameError(msg % (name, concatenate(map(repr, matching_repos))))
     else:
-        options = dict(parser.items(matching_repos[0]))
-        vcs_type = options.get('type', '').lower()
-        local_path = options.get('local')
-        if local_path:
-            # Expand a leading tilde and/or environment variables.
-            local_path = parse_path(local_path)
-        bare = options.get('bare', None)
-        if bare is not None:
-            # Default to bare=None but enable configuration file(s)
-            # to enforce bare=True or bare=False.
-            bare = coerce_boolean(bare)
-        return repository_factory(
-            vcs_type,
-            local=local_path,
-            remote=options.get('remote'),
-            bare=bare,
-            release_scheme=options.get('release-scheme'),
-            release_filter=options.get('release-filter'),
-        )
+        return configured_repository_factory(configuration.sections[matching_repos[0]])
+
+
+def find_configured_repositories():
+    """
+    Find all version control repositories defined by the user in configuration files.
+
+    :returns: A dictionary with repository names (strings) as keys and
+              :class:`Repository` objects as values.
+    :raises: :exc:`~vcs_repo_mgr.exceptions.UnknownRepositoryTypeError` when
+             a repository definition with an unknown type is encountered.
+
+    Refer to :func:`find_configured_repository()` for details about the
+    supported configuration files.
+    """
+    configuration = load_configuration()
+    return dict((name, configured_repository_factory(options)) for name, options in configuration.sections.items())
+
+
+def find_configuration_files():
+    """
+    Find the configuration files that define version control repositories.
+
+    :returns: A list with the pathnames of existing configuration files (strings).
+
+    Refer to :func:`find_configured_repository()` for details about the
+    supported configuration files.
+    """
+    candidates = [SYSTEM_CONFIG_FILE]
+    if os.path.isdir(SYSTEM_CONFIG_DIRECTORY):
+        candidates.extend(sorted(os.path.join(SYSTEM_CONFIG_DIRECTORY, fn)
+                                 for fn in os.listdir(SYSTEM_CONFIG_DIRECTORY)
+                                 if fn.endswith('.ini')))
+    candidates.append(USER_CONFIG_FILE)
+    return [fn for fn in candidates if os.path.isfile(fn)]
+
+
+def load_configuration():
+    """
+    Load the configuration files that define version control repositories.
+
+    :returns: A :class:`Configuration` object.
+
+    The configuration files are only parsed again when the list of
+    configuration files changes or when the modification time, size or inode
+    number of one of the files changes, otherwise the previously loaded
+    :class:`Configuration` object is returned. Refer to
+    :func:`find_configured_repository()` for details about the supported
+    configuration files.
+    """
+    fingerprint = []
+    for config_file in find_configuration_files():
+        try:
+            metadata = os.stat(config_file)
+            fingerprint.append((config_file, metadata.st_mtime, metadata.st_size, metadata.st_ino))
+        except OSError:
+            pass
+    fingerprint = tuple(fingerprint)
+    configuration = loaded_configuration.get(fingerprint)
+    if configuration is None:
+        from six.moves import configparser
+        parser = configparser.RawConfigParser()
+        for config_file, _, _, _ in fingerprint:
+            logger.debug("Loading configuration file: %s", format_path(config_file))
+            parser.read(config_file)
+        configuration = Configuration(fingerprint, parser)
+        loaded_configuration.clear()
+        loaded_configuration[fingerprint] = configuration
+    return configuration
+
+
+def configured_repository_factory(options):
+    """
+    Instantiate a :class:`Repository` object based on a repository definition.
+
+    :param options: A dictionary with the options of a section in a
+                    configuration file (refer to
+                    :func:`find_configured_repository()` for details).
+    :returns: A :class:`Repository` object.
+    :raises: :exc:`~vcs_repo_mgr.exceptions.UnknownRepositoryTypeError` when
+             the repository definition has an unknown type.
+    """
+    vcs_type = options.get('type', '').lower()
+    local_path = options.get('local')
+    if local_path:
+        # Expand a leading tilde and/or environment variables.
+        local_path = parse_path(local_path)
+    bare = options.get('bare', None)
+    if bare is not None:
+        # Default to bare=None but enable configuration file(s)
+        # to enforce bare=True or bare=False.
+        bare = coerce_boolean(bare)
+    # Optional settings are only passed on when they are given, so
+    # that the defaults of the Repository subclass are respected.
+    optional_settings = {}
+    if options.get('coprocess'):
+        optional_settings['coprocess'] = coerce_boolean(options['coprocess'])
+    if options.get('native-refs'):
+        optional_settings['native_refs'] = coerce_boolean(options['native-refs'])
+    if options.get('release-ordering'):
+        optional_settings['release_ordering'] = options['release-ordering'].lower()
+    if options.get('check-remote'):
+        optional_settings['check_remote'] = coerce_boolean(options['check-remote'])
+    if options.get('max-age'):
+        optional_settings['max_age'] = parse_timespan(options['max-age'])
+    if options.get('lock-timeout'):
+        optional_settings['lock_timeout'] = parse_timespan(options['lock-timeout'])
+    if options.get('clone-strategy'):
+        optional_settings['clone_strategy'] = options['clone-strategy'].lower()
+    if options.get('clone-depth'):
+        optional_settings['clone_depth'] = int(options['clone-depth'])
+    if options.get('shared-store'):
+        optional_settings['shared_store'] = parse_path(options['shared-store'])
+    if options.get('export-cache'):
+        optional_settings['export_cache'] = parse_path(options['export-cache'])
+    if options.get('export-cache-size'):
+        optional_settings['export_cache_size'] = parse_size(options['export-cache-size'], binary=True)
+    if options.get('export-cache-method'):
+        optional_settings['export_cache_method'] = options['export-cache-method'].lower()
+    if options.get('incremental-export'):
+        optional_settings['incremental_export'] = coerce_boolean(options['incremental-export'])
+    return repository_factory(
+        vcs_type,
+        local=local_path,
+        remote=options.get('remote'),
+        bare=bare,
+        release_scheme=options.get('release-scheme'),
+        release_filter=options.get('release-filter'),
+        **optional_settings
+    )
 
 
 def repository_factory(vcs_type, **kw):
@@ -319,14 +488,73 @@ def repository_factory(vcs_type, **kw):
     if not (isinstance(vcs_type, type) and issubclass(vcs_type, Repository)):
         raise UnknownRepositoryTypeError("Unknown VCS repository type! (%r)" % vcs_type)
     # Generate a cache key that we will use to avoid constructing duplicates.
-    cache_key = tuple('%s=%s' % (k, v) for k, v in sorted(kw.items()))
+    cache_key = (vcs_type.__name__,) + tuple('%s=%s' % (k, v) for k, v in sorted(kw.items()))
     logger.debug("Generated repository cache key: %r", cache_key)
-    if cache_key in loaded_repositories:
-        logger.debug("Repository previously constructed, returning cached instance ..")
+    return loaded_repositories.get_or_create(cache_key, functools.partial(vcs_type, **kw))
+
+
+def compress_chunks(chunks, format):
+    """
+    Compress a tar archive that's generated in chunks.
+
+    :param chunks: An iterable of byte strings.
+    :param format: The format of the compressed archive (the string
+                   ``tar.gz`` or ``tar.xz``).
+    :returns: A generator of byte strings.
+    """
+    if format == 'tar.gz':
+        import zlib
+        # A window size of 16 + 15 bits selects the gzip container format.
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + 15)
     else:
-        logger.debug("Repository not yet constructed, creating new instance ..")
-        loaded_repositories[cache_key] = vcs_type(**kw)
-    return loaded_repositories[cache_key]
+        import lzma
+        compressor = lzma.LZMACompressor()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def find_archive_format(filename):
+    """
+    Find the archive format that matches the extension of a filename.
+
+    :param filename: The filename of an archive (a string).
+    :returns: One of the formats in :data:`ARCHIVE_FORMATS` (a string).
+    :raises: :exc:`~exceptions.ValueError` when the extension of the filename
+             doesn't match any of the formats in :data:`ARCHIVE_FORMATS`.
+    """
+    for extension, archive_format in ARCHIVE_FORMATS:
+        if filename.lower().endswith(extension):
+            return archive_format
+    msg = "Can't determine archive format of %r! (supported extensions are %s)"
+    raise ValueError(msg % (filename, concatenate(e for e, f in ARCHIVE_FORMATS)))
+
+
+def locked(exclusive=False, prepare=None):
+    """
+    Decorate a :class:`Repository` method so that it runs while holding a lock.
+
+    :param exclusive: :data:`True` for an exclusive lock, :data:`False` for a
+                      shared lock (refer to :func:`Repository.lock()`).
+    :param prepare: A function that is called with the arguments of the
+                    method before the lock is acquired (optional). This is
+                    used to change the local clone (under an exclusive lock)
+                    before a query takes its shared lock, because converting
+                    a shared lock to an exclusive lock temporarily releases
+                    the lock.
+    :returns: A decorator function.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kw):
+            if prepare is not None:
+                prepare(self, *args, **kw)
+            with self.lock(exclusive=exclusive):
+                return method(self, *args, **kw)
+        return wrapper
+    return decorator
 
 
 def find_cache_directory(remote):
@@ -335,6 +563,7 @@ def find_cache_directory(remote):
 
     :returns: The absolute pathname of a directory (a string).
     """
+    from six.moves import urllib_parse as urlparse
     return os.path.join('/var/cache/vcs-repo-mgr' if os.access('/var/cache', os.W_OK) else tempfile.gettempdir(),
                         urlparse.quote(remote, safe=''))
 
@@ -352,26 +581,89 @@ def normalize_name(name):
     return re.sub('[^a-z0-9]', '', name.lower())
 
 
-def sum_revision_numbers(arguments):
+def map_concurrently(function, arguments, concurrency=None):
+    """
+    Call a function for each of the given arguments using a bounded pool of threads.
+
+    :param function: The function to call (a callable that takes a single
+                     argument).
+    :param arguments: The arguments to call the function with (a list).
+    :param concurrency: The maximum number of threads (an integer, defaults
+                        to :data:`DEFAULT_CONCURRENCY`).
+    :returns: A list with the return values of the function (in the same
+              order as the given arguments).
+    :raises: The first exception raised by the function is re-raised after
+             the running calls have finished (arguments that haven't been
+             processed yet at that point are skipped).
+    """
+    arguments = list(arguments)
+    concurrency = min(concurrency or DEFAULT_CONCURRENCY, len(arguments))
+    if concurrency <= 1:
+        return [function(argument) for argument in arguments]
+    results = [None] * len(arguments)
+    pending = list(enumerate(arguments))
+    failures = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if failures or not pending:
+                    return
+                index, argument = pending.pop(0)
+            try:
+                results[index] = function(argument)
+            except Exception:
+                with lock:
+                    failures.append(sys.exc_info())
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        reraise(*failures[0])
+    return results
+
+
+def sum_revision_numbers(arguments, concurrency=None):
     """
     Sum revision numbers of multiple repository/revision pairs.
 
     :param arguments: A list of strings with repository names and revision
                       strings.
+    :param concurrency: The maximum number of repositories that are queried
+                        concurrently (an integer, defaults to
+                        :data:`DEFAULT_CONCURRENCY`).
     :returns: A single integer containing the summed revision numbers.
 
     This is useful when you're building a package based on revisions from
     multiple VCS repositories. By taking changes in all repositories into
     account when generating version numbers you can make sure that your version
     number is bumped with every single change.
+
+    The revisions are grouped by repository so that each repository is only
+    queried once and the repositories are queried concurrently using
+    :func:`map_concurrently()`.
     """
     if len(arguments) % 2 != 0:
         raise ValueError("Please provide an even number of arguments! (one or more repository/revision pairs)")
-    summed_revision_number = 0
-    while arguments:
-        repository = coerce_repository(arguments.pop(0))
-        summed_revision_number += repository.find_revision_number(arguments.pop(0))
-    return summed_revision_number
+    # Group the revisions by repository so that each repository can resolve
+    # all of its revisions in one go (see Repository.find_revision_numbers()).
+    repositories = []
+    revisions = {}
+    for i in range(0, len(arguments), 2):
+        repository = coerce_repository(arguments[i])
+        if id(repository) not in revisions:
+            repositories.append(repository)
+            revisions[id(repository)] = []
+        revisions[id(repository)].append(arguments[i + 1])
+    return sum(map_concurrently(
+        lambda repository: sum(repository.find_revision_numbers(revisions[id(repository)])),
+        repositories, concurrency=concurrency,
+    ))
 
 
 class limit_vcs_updates(object):
@@ -416,6 +708,18 @@ class Repository(PropertyManager):
     correct :class:`Repository` subclass.
     """
 
+    CLONE_STRATEGIES = ('full',)
+    """The clone strategies supported by the repository type (a tuple of strings, refer to :attr:`clone_strategy`)."""
+
+    ARCHIVE_TYPES = {}
+    """
+    The archive formats that :attr:`export_archive_command` can generate.
+
+    A dictionary with formats from :data:`ARCHIVE_FORMATS` as keys and the
+    corresponding names used by the version control system as values. Refer
+    to :func:`generate_archive()` for details.
+    """
+
     @staticmethod
     def get_vcs_directory(directory):
         """
@@ -501,6 +805,15 @@ class Repository(PropertyManager):
         if self.release_scheme not in KNOWN_RELEASE_SCHEMES:
             msg = "Release scheme %r is not supported! (valid options are %s)"
             raise ValueError(msg % (self.release_scheme, concatenate(map(repr, KNOWN_RELEASE_SCHEMES))))
+        # Make sure the release ordering was properly specified.
+        if self.release_ordering not in KNOWN_RELEASE_ORDERINGS:
+            msg = "Release ordering %r is not supported! (valid options are %s)"
+            raise ValueError(msg % (self.release_ordering, concatenate(map(repr, KNOWN_RELEASE_ORDERINGS))))
+        # Make sure the clone strategy is supported by the repository type.
+        if self.clone_strategy not in self.CLONE_STRATEGIES:
+            msg = "Clone strategy %r is not supported for %s repositories! (valid options are %s)"
+            raise ValueError(msg % (self.clone_strategy, self.friendly_name,
+                                    concatenate(map(repr, self.CLONE_STRATEGIES))))
         # At this point we should be dealing with a regular expression object:
         # Make sure the regular expression has zero or one capture group.
         if self.compiled_filter.groups > 1:
@@ -605,6 +918,29 @@ class Repository(PropertyManager):
         """
         return '.*'
 
+    @writable_property
+    def release_ordering(self):
+        """
+        The ordering of the repository's releases (a string, defaults to 'natural').
+
+        The value of :attr:`release_ordering` determines how
+        :attr:`ordered_releases` and :func:`select_release()` order release
+        identifiers. It should match one of the values in
+        :data:`KNOWN_RELEASE_ORDERINGS`:
+
+        ``natural``
+         A `natural order sort <https://pypi.python.org/pypi/naturalsort>`_.
+        ``pep440``
+         The ordering of Python version numbers defined by `PEP 440
+         <https://www.python.org/dev/peps/pep-0440/>`_.
+        ``semver``
+         The ordering defined by `semantic versioning <https://semver.org/>`_.
+
+        Releases whose identifiers aren't valid according to the ``pep440`` or
+        ``semver`` orderings are ignored.
+        """
+        return 'natural'
+
     @property
     def compiled_filter(self):
         """
@@ -618,6 +954,218 @@ class Repository(PropertyManager):
             pattern = re.compile(pattern)
         return pattern
 
+    @writable_property
+    def coprocess(self):
+        """
+        Whether queries are answered by long running processes (a boolean, defaults to :data:`False`).
+
+        When this is :data:`True` subclasses that support it answer queries
+        using a long running process (see :mod:`vcs_repo_mgr.coprocesses`)
+        instead of starting a new process for every query. Such processes
+        are started on demand and terminated by :func:`close()` or when they
+        haven't been used for a while. Refer to :class:`GitRepo` and
+        :class:`HgRepo` for details.
+        """
+        return False
+
+    @writable_property
+    def native_refs(self):
+        """
+        Whether branches and tags are read without running external commands (a boolean, defaults to :data:`True`).
+
+        When this is :data:`True` subclasses that support it find branches and
+        tags by reading the on-disk metadata of the repository directly (see
+        :mod:`vcs_repo_mgr.native`) whenever they understand the repository
+        format, falling back to external commands otherwise. Refer to
+        :class:`GitRepo` and :class:`HgRepo` for details.
+        """
+        return True
+
+    @writable_property
+    def check_remote(self):
+        """
+        Whether :func:`update()` checks for remote changes before pulling (a boolean, defaults to :data:`False`).
+
+        When this is :data:`True` :func:`update()` first compares the branches
+        and tags advertised by the remote repository with the local clone
+        (see :func:`has_remote_changes()`) and skips the pull when nothing
+        changed. This is cheap compared to a full pull which can save a lot of
+        time when many mirrored repositories are updated periodically.
+        """
+        return False
+
+    @writable_property
+    def max_age(self):
+        """
+        The number of seconds that the local clone is considered fresh after an update (a number or :data:`None`).
+
+        When this is set :func:`update()` doesn't pull changes when the last
+        successful update (see :attr:`last_updated`) was less than
+        :attr:`max_age` seconds ago. Because :attr:`last_updated` is stored in
+        the local clone this policy applies to all processes that use the
+        local clone. The default is :data:`None` which means :func:`update()`
+        always pulls (unless :class:`limit_vcs_updates` is used).
+        """
+
+    @writable_property
+    def lock_timeout(self):
+        """
+        The maximum number of seconds to wait for a lock on the local clone (a number or :data:`None`).
+
+        Refer to :func:`lock()` for details. The default is :data:`None` which
+        means operations wait as long as it takes for other processes to
+        release their locks.
+        """
+
+    @writable_property
+    def clone_strategy(self):
+        """
+        How :func:`create()` clones the remote repository (a string, defaults to 'full').
+
+        The value of :attr:`clone_strategy` should match one of the values in
+        :attr:`CLONE_STRATEGIES`:
+
+        ``full``
+         Clone the complete repository (supported by all repository types).
+        ``partial``
+         Clone the complete history but fetch file contents on demand (git
+         only, this uses ``git clone --filter=blob:none``).
+        ``shallow``
+         Clone only the most recent :attr:`clone_depth` commits of a single
+         branch (git only, this uses ``git clone --depth``).
+        ``single-branch``
+         Clone the complete history of a single branch (git only, this uses
+         ``git clone --single-branch``).
+        ``stream``
+         Clone the complete repository by streaming the repository's files
+         instead of negotiating changesets, which is a lot faster for large
+         repositories on fast networks (Mercurial only, this uses ``hg clone
+         --stream``).
+
+        Refer to :class:`GitRepo` for details about how :func:`update()`,
+        :func:`export()` and :func:`find_revision_number()` handle clones
+        that don't contain the complete repository.
+        """
+        return 'full'
+
+    @writable_property
+    def clone_depth(self):
+        """The number of commits cloned by the ``shallow`` :attr:`clone_strategy` (an integer, defaults to 1)."""
+        return 1
+
+    @writable_property
+    def shared_store(self):
+        """
+        The pathname of a repository that stores history shared by multiple clones (a string or :data:`None`).
+
+        This is an opt-in feature that is intended for many clones of related
+        remote repositories (for example forks of the same project). When
+        :attr:`shared_store` is set, :func:`create()` first pulls the remote
+        repository into the shared store (which is created on demand) and
+        then creates the local clone using the history in the shared store,
+        so that history shared by related remote repositories is only
+        fetched once. Refer to :class:`GitRepo` and :class:`HgRepo` for
+        details. Repository types that don't support this ignore
+        :attr:`shared_store`.
+        """
+
+    @writable_property
+    def export_cache(self):
+        """
+        The pathname of the directory where :func:`export()` caches exported trees (a string or :data:`None`).
+
+        When :attr:`export_cache` is set :func:`export()` keeps a pristine
+        export of each tree in the cache directory (identified by the tree id
+        reported by :func:`find_tree_id()`) and exports are created by copying
+        from the cache, so exporting a tree that was exported before doesn't
+        require running the export command again. The cache can be shared by
+        multiple repositories and processes. Refer to :attr:`export_cache_size`,
+        :attr:`export_cache_method` and :class:`~vcs_repo_mgr.exports.ExportCache`
+        for details.
+        """
+
+    @writable_property
+    def export_cache_size(self):
+        """
+        The size budget of :attr:`export_cache` in bytes (an integer, defaults to 1 GiB).
+
+        When the cache exceeds this size the least recently used trees are
+        evicted (see :func:`~vcs_repo_mgr.exports.ExportCache.evict()`).
+        """
+        return 1024 ** 3
+
+    @writable_property
+    def export_cache_method(self):
+        """
+        How trees are copied from :attr:`export_cache` (a string, defaults to 'copy').
+
+        The value should be one of the strings ``copy`` (use reflinks on file
+        systems that support them and copy files otherwise) or ``hardlink``
+        (hard link files, which means exported files must not be modified in
+        place). Refer to :func:`~vcs_repo_mgr.exports.ExportCache.materialize()`
+        for details.
+        """
+        return 'copy'
+
+    @writable_property
+    def incremental_export(self):
+        """
+        Whether :func:`export()` updates previous exports incrementally (a boolean, defaults to :data:`False`).
+
+        When this is :data:`True` :func:`export()` records which revision it
+        exported to a directory (see :func:`record_exported_revision()`, the
+        directory gets a small marker file named by :data:`EXPORT_MARKER`).
+        When a different revision is later exported to the same directory
+        only the files that changed between the two revisions are removed
+        and/or exported again (see :func:`update_export()`). Repository types
+        that don't define :attr:`export_files_command` ignore this option.
+        """
+        return False
+
+    @property
+    def export_records(self):
+        """
+        The pathname of the directory that records exported revisions (a string).
+
+        Used internally by :func:`find_exported_revision()` and
+        :func:`record_exported_revision()`.
+        """
+        return os.path.join(self.vcs_directory, 'vcs-repo-mgr-exports')
+
+    @property
+    def clone_options(self):
+        """
+        Additional command line arguments for :attr:`create_command` (a list of strings).
+
+        Subclasses that support multiple :attr:`CLONE_STRATEGIES` override
+        this property to translate :attr:`clone_strategy` to command line
+        arguments. The base implementation returns an empty list.
+        """
+        return []
+
+    @property
+    def update_options(self):
+        """
+        Additional command line arguments for :attr:`update_command` (a list of strings).
+
+        Subclasses that support multiple :attr:`CLONE_STRATEGIES` override
+        this property so that :func:`update()` respects
+        :attr:`clone_strategy`. The base implementation returns an empty list.
+        """
+        return []
+
+    def get_update_options(self, remote):
+        """
+        Get the command line arguments for :attr:`update_command`.
+
+        :param remote: The location of the remote repository (a string).
+        :returns: A list of strings (:attr:`update_options` by default).
+
+        Used by :func:`update()`. Subclasses can override this method when
+        the arguments depend on the remote repository.
+        """
+        return self.update_options
+
     @writable_property
     def author(self):
         """
@@ -679,6 +1227,68 @@ class Repository(PropertyManager):
         """:data:`True` if the local clone exists, :data:`False` otherwise."""
         return self.contains_repository(self.local)
 
+    @property
+    def ref_files(self):
+        """
+        The pathnames of the files and directories that store branches and tags (a list of strings).
+
+        The modification times, sizes and inode numbers of these pathnames are
+        combined into :attr:`ref_fingerprint`. The :attr:`ref_files` property
+        needs to be implemented by subclasses, the default value is an empty
+        list (which disables the caching of :attr:`ref_snapshot`).
+        """
+        return []
+
+    @property
+    def ref_fingerprint(self):
+        """
+        A cheap fingerprint of the branches and tags in the local clone (a tuple or :data:`None`).
+
+        The fingerprint is computed by calling :func:`os.stat()` on each of the
+        pathnames in :attr:`ref_files`, this doesn't require any external
+        commands. The value is :data:`None` when the local clone doesn't exist
+        yet or :attr:`ref_files` is empty.
+        """
+        pathnames = self.ref_files
+        if pathnames and self.exists:
+            fingerprint = []
+            for pathname in pathnames:
+                try:
+                    metadata = os.stat(pathname)
+                    fingerprint.append((pathname, metadata.st_mtime, metadata.st_size, metadata.st_ino))
+                except OSError:
+                    fingerprint.append((pathname, None))
+            return tuple(fingerprint)
+
+    @property
+    def ref_snapshot(self):
+        """
+        A snapshot of the branches and tags in the local clone (a :class:`RefSnapshot` object).
+
+        The snapshot is reused until :attr:`ref_fingerprint` changes or
+        :func:`invalidate_ref_snapshot()` is called, which means the external
+        commands used by :func:`find_branches()` and :func:`find_tags()` run
+        only once for any given state of the repository.
+        """
+        fingerprint = self.ref_fingerprint
+        snapshot = getattr(self, 'cached_ref_snapshot', None)
+        if snapshot is None or fingerprint is None or snapshot.fingerprint != fingerprint:
+            snapshot = RefSnapshot(repository=self, fingerprint=fingerprint)
+            if fingerprint is not None:
+                self.cached_ref_snapshot = snapshot
+        return snapshot
+
+    def invalidate_ref_snapshot(self):
+        """
+        Discard the cached :attr:`ref_snapshot`.
+
+        This is called automatically by the methods that change branches and
+        tags in the local clone (like :func:`update()` and :func:`commit()`)
+        because the resolution of :attr:`ref_fingerprint` isn't fine grained
+        enough to detect every change on every file system.
+        """
+        self.cached_ref_snapshot = None
+
     @property
     def last_updated_file(self):
         """
@@ -703,6 +1313,71 @@ class Repository(PropertyManager):
         except Exception:
             return 0
 
+    @property
+    def is_fresh(self):
+        """
+        :data:`True` if the local clone was updated less than :attr:`max_age` seconds ago, :data:`False` otherwise.
+
+        Always :data:`False` when :attr:`max_age` isn't set.
+        """
+        return bool(self.max_age and self.last_updated and time.time() - self.last_updated < self.max_age)
+
+    @property
+    def update_fingerprint(self):
+        """
+        A fingerprint of the file that marks the last successful update (a tuple or :data:`None`).
+
+        Used internally by :func:`update()` to detect updates performed by
+        other processes or threads. The value is :data:`None` when the file
+        doesn't exist.
+        """
+        try:
+            metadata = os.stat(self.last_updated_file)
+            return (metadata.st_mtime, metadata.st_size, metadata.st_ino)
+        except OSError:
+            return None
+
+    @property
+    def lock_file(self):
+        """
+        The pathname of the file used by :func:`lock()` (a string).
+
+        The file is stored in :attr:`vcs_directory` so it's shared by all
+        processes that use the local clone.
+        """
+        return os.path.join(self.vcs_directory, 'vcs-repo-mgr.rwlock')
+
+    @lazy_property
+    def lock_statistics(self):
+        """
+        Statistics about the time spent waiting for :func:`lock()`.
+
+        The value is a :class:`~vcs_repo_mgr.locking.LockStatistics` object.
+        Only locks acquired using this :class:`Repository` object are counted.
+        """
+        from vcs_repo_mgr.locking import LockStatistics
+        return LockStatistics()
+
+    @property
+    def update_lock_file(self):
+        """
+        The pathname of the file used to coordinate concurrent updates (a string).
+
+        Used internally by :func:`update()` (refer to
+        :class:`~vcs_repo_mgr.locking.FileLock` for details).
+        """
+        return os.path.join(self.vcs_directory, 'vcs-repo-mgr.lock')
+
+    @property
+    def revision_numbers(self):
+        """
+        The persistent index of revision numbers (a :class:`RevisionNumberIndex` object).
+
+        The index is stored in an SQLite database next to
+        :attr:`last_updated_file`.
+        """
+        return RevisionNumberIndex(filename=os.path.join(self.vcs_directory, 'vcs-repo-mgr.sqlite3'))
+
     def mark_updated(self):
         """
         Mark a successful update so that :attr:`last_updated` can report it.
@@ -712,6 +1387,44 @@ class Repository(PropertyManager):
         with open(self.last_updated_file, 'w') as handle:
             handle.write('%i\n' % time.time())
 
+    def close(self):
+        """
+        Terminate the long running processes used by the repository (if any).
+
+        Refer to :attr:`coprocess` for details. It's not an error to call
+        :func:`close()` when no long running processes are active and the
+        repository can still be used after :func:`close()` has been called.
+        """
+
+    def lock(self, exclusive=False):
+        """
+        Lock the local clone.
+
+        :param exclusive: :data:`True` for an exclusive lock, :data:`False`
+                          for a shared lock (the default).
+        :returns: A :class:`~vcs_repo_mgr.locking.ReadWriteLock` object (to
+                  be used as a context manager).
+        :raises: :exc:`~vcs_repo_mgr.exceptions.LockTimeoutError` (when the
+                 context is entered) if the lock can't be acquired within
+                 :attr:`lock_timeout` seconds.
+
+        Queries that only read from the local clone (like
+        :func:`find_revision_id()`, :attr:`branches` and :func:`export()`)
+        take a shared lock while operations that change the local clone
+        (like :func:`update()`, :func:`checkout()`, :func:`merge()`,
+        :func:`commit()` and :func:`push()`) take an exclusive lock. This
+        allows concurrent queries of the local clone by multiple processes
+        and threads, while operations that change the local clone wait for
+        the queries to finish (and vice versa). The locks are advisory (they
+        only coordinate processes that use `vcs-repo-mgr`) and re-entrant
+        within a thread. The time spent waiting for locks is recorded in
+        :attr:`lock_statistics`. Local clones that don't exist yet aren't
+        locked (refer to :func:`create()` instead).
+        """
+        from vcs_repo_mgr.locking import ReadWriteLock
+        return ReadWriteLock(self.lock_file if self.exists else None, exclusive=exclusive,
+                             timeout=self.lock_timeout, statistics=self.lock_statistics)
+
     def get_author(self, author=None):
         """
         Get the name and email address of the author for commits.
@@ -761,6 +1474,30 @@ class Repository(PropertyManager):
         quoted_arguments = dict((k, quote(v)) for k, v in kw.items())
         return command_template.format(**quoted_arguments)
 
+    def run_command(self, method_name, attribute_name, capture=False, **kw):
+        """
+        Run the command for a given VCS operation.
+
+        :param method_name: The name of the method that wants to execute the
+                            command (a string).
+        :param attribute_name: The name of the attribute that is expected to
+                               hold the VCS command (a string).
+        :param capture: :data:`True` to capture and return the output of the
+                        command, :data:`False` otherwise.
+        :param kw: Any keyword arguments are shell escaped and interpolated
+                   into the VCS command.
+        :returns: The output of the command (a string) if `capture` is
+                  :data:`True`.
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        The command is constructed using :func:`get_command()` and executed
+        using :func:`~executor.execute()` (the command is recorded in
+        :data:`~vcs_repo_mgr.statistics.command_statistics`). Subclasses can
+        override this method to change how VCS commands are executed.
+        """
+        command = self.get_command(method_name=method_name, attribute_name=attribute_name, **kw)
+        return execute(command, capture=capture) if capture else execute(command)
+
     def create(self, remote=None):
         """
         Create the local clone of the remote version control repository.
@@ -772,20 +1509,80 @@ class Repository(PropertyManager):
         :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
 
         It's not an error if the repository already exists.
+
+        The clone is created in a temporary directory next to :attr:`local`
+        (using :func:`create_clone()`) which is renamed to :attr:`local` when
+        the clone is complete (see :func:`install_clone()`). This means other
+        processes never see an incomplete clone and when multiple processes
+        create the same clone at the same time only one clone is kept.
         """
         if self.exists:
             return False
-        else:
-            remote = remote or self.remote
-            logger.info("Creating %s clone of %s at %s ..", self.friendly_name, remote, self.local)
-            execute(self.get_command(
-                method_name='create',
-                attribute_name='create_command' if self.bare else 'create_command_non_bare',
-                local=self.local,
-                remote=remote,
-            ))
-            self.mark_updated()
+        remote = remote or self.remote
+        logger.info("Creating %s clone of %s at %s ..", self.friendly_name, remote, self.local)
+        temporary_directory = self.create_staging_directory()
+        try:
+            staging_directory = os.path.join(temporary_directory, 'clone')
+            self.create_clone(remote, staging_directory)
+            if not self.install_clone(staging_directory):
+                return False
+        finally:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+        self.invalidate_ref_snapshot()
+        self.mark_updated()
+        return True
+
+    def create_clone(self, remote, directory):
+        """
+        Clone the remote repository into a staging directory.
+
+        :param remote: The location of the remote repository (a string).
+        :param directory: The pathname of the clone (a string, the directory
+                          doesn't exist yet).
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        Used internally by :func:`create()`.
+        """
+        self.run_command(
+            method_name='create',
+            attribute_name='create_command' if self.bare else 'create_command_non_bare',
+            local=directory,
+            remote=remote,
+            clone_options=self.clone_options,
+        )
+
+    def create_staging_directory(self):
+        """
+        Create a temporary directory next to :attr:`local`.
+
+        :returns: The pathname of the temporary directory (a string).
+
+        The temporary directory is on the same file system as :attr:`local`
+        so that :func:`install_clone()` can atomically rename a clone.
+        """
+        local = os.path.abspath(self.local)
+        parent = os.path.dirname(local)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        return tempfile.mkdtemp(dir=parent, prefix='.%s-' % os.path.basename(local))
+
+    def install_clone(self, directory):
+        """
+        Rename a clone created by :func:`create_clone()` to :attr:`local`.
+
+        :param directory: The pathname of the clone (a string).
+        :returns: :data:`True` if the clone was installed, :data:`False` if
+                  another process or thread created the local clone first.
+        """
+        try:
+            # Renaming a directory replaces an empty target directory.
+            os.rename(directory, self.local)
             return True
+        except OSError as e:
+            if e.errno in (errno.EEXIST, errno.ENOTEMPTY) and self.exists:
+                logger.info("Discarding clone of %s because a concurrent clone finished first.", self.local)
+                return False
+            raise
 
     def update(self, remote=None):
         """
@@ -796,10 +1593,23 @@ class Repository(PropertyManager):
         :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
 
         If used in combination with :class:`limit_vcs_updates` this won't
-        perform redundant updates.
+        perform redundant updates. When :attr:`max_age` is set updates are
+        skipped while the local clone is fresh (see :attr:`is_fresh`).
+
+        Concurrent updates of the same local clone (by multiple processes or
+        threads) are coalesced: Only one of them pulls changes while the
+        others wait for the pull to finish (using a
+        :class:`~vcs_repo_mgr.locking.FileLock` on :attr:`update_lock_file`)
+        and then skip their own pull. When the pull fails the next update in
+        line pulls changes itself. Updates hold an exclusive :func:`lock()` on
+        the local clone, which is acquired before the lock on
+        :attr:`update_lock_file` (the same order that's used by methods like
+        :func:`merge_up()` that call :func:`update()` while holding an
+        exclusive lock) to avoid deadlocks between concurrent processes.
 
         .. note:: Automatically creates the local repository on the first run.
         """
+        from vcs_repo_mgr.locking import FileLock
         remote = remote or self.remote
         update_limit = int(os.environ.get(UPDATE_VARIABLE, '0'))
         if not remote:
@@ -812,22 +1622,101 @@ class Repository(PropertyManager):
         elif update_limit and self.last_updated >= update_limit:
             # If an update limit has been enforced we also skip the update.
             logger.debug("Skipping update (pull) due to update limit.")
+        elif self.is_fresh:
+            # If the local clone was updated recently we also skip the update.
+            logger.debug("Skipping update (pull) because local repository is less than %i seconds old.", self.max_age)
         else:
-            logger.info("Pulling %s updates from %s into %s ..", self.friendly_name, remote, self.local)
-            execute(self.get_command(
-                method_name='update',
-                attribute_name='update_command',
-                local=self.local,
-                remote=remote,
-            ))
-            self.mark_updated()
+            fingerprint = self.update_fingerprint
+            with self.lock(exclusive=True):
+                with FileLock(self.update_lock_file, timeout=self.lock_timeout):
+                    if self.update_fingerprint != fingerprint:
+                        # If another process or thread updated the local clone
+                        # while we were waiting for the lock we skip the update.
+                        logger.info("Skipping update (pull) because a concurrent update of %s just finished.",
+                                    self.local)
+                        self.invalidate_ref_snapshot()
+                    elif self.check_remote and not self.has_remote_changes(remote=remote):
+                        # If the remote repository hasn't changed there's nothing to pull.
+                        logger.info("Skipping update (pull) because %s has no new changes.", remote)
+                        self.mark_updated()
+                    else:
+                        logger.info("Pulling %s updates from %s into %s ..", self.friendly_name, remote, self.local)
+                        self.run_command(
+                            method_name='update',
+                            attribute_name='update_command',
+                            local=self.local,
+                            remote=remote,
+                            update_options=self.get_update_options(remote),
+                        )
+                        self.invalidate_ref_snapshot()
+                        self.mark_updated()
 
-    def push(self, remote=None):
+    def has_remote_changes(self, remote=None):
         """
-        Push changes from the local repository to a remote repository.
+        Check whether the remote repository contains changes that haven't been pulled yet.
 
         :param remote: Overrides the value of :attr:`remote` for the duration
-                       of the call to :func:`push()`.
+                       of the call to :func:`has_remote_changes()`.
+        :returns: :data:`False` when the branches and tags advertised by the
+                  remote repository match those in the local clone,
+                  :data:`True` otherwise.
+
+        The remote repository is queried using :attr:`remote_refs_command`
+        (which should be a lot cheaper than a pull) and the result is
+        compared to :func:`find_local_refs()`. When the check isn't supported
+        or fails :data:`True` is returned so that callers fall back to a pull.
+        """
+        remote = remote or self.remote
+        if not (remote and self.exists and getattr(self, 'remote_refs_command', None)):
+            return True
+        try:
+            remote_refs = self.parse_remote_refs(self.run_command(
+                method_name='has_remote_changes',
+                attribute_name='remote_refs_command',
+                capture=True,
+                local=self.local,
+                remote=remote,
+            ))
+            local_refs = self.find_local_refs()
+        except ExternalCommandFailed as e:
+            logger.warning("Failed to check %s for changes, assuming there are changes! (%s)", remote, e)
+            return True
+        changed_refs = sorted(n for n, i in remote_refs.items() if local_refs.get(n) != i)
+        if changed_refs:
+            logger.debug("Remote repository has changes: %s", concatenate(changed_refs))
+        return bool(changed_refs)
+
+    def find_local_refs(self):
+        """
+        Find the references in the local clone that are compared by :func:`has_remote_changes()`.
+
+        :returns: A dictionary with reference names (strings) as keys and
+                  global revision ids (strings) as values.
+
+        This method needs to be implemented by subclasses that define
+        :attr:`remote_refs_command`.
+        """
+        raise NotImplementedError()
+
+    def parse_remote_refs(self, listing):
+        """
+        Parse the output of :attr:`remote_refs_command`.
+
+        :param listing: The output of :attr:`remote_refs_command` (a string).
+        :returns: A dictionary in the format of :func:`find_local_refs()`.
+
+        This method needs to be implemented by subclasses that define
+        :attr:`remote_refs_command`.
+        """
+        raise NotImplementedError()
+
+    @locked(exclusive=True)
+    def push(self, remote=None):
+        """
+        Push changes from the local repository to a remote repository.
+
+        :param remote: Overrides the value of :attr:`remote` for the duration
+                       of the call to :func:`push()`.
         :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
 
         .. warning:: Depending on the version control backend the push command
@@ -842,13 +1731,14 @@ class Repository(PropertyManager):
             logger.debug("Skipping push because there's no remote.")
         else:
             logger.info("Pushing %s updates from %s to %s ..", self.friendly_name, self.local, remote)
-            execute(self.get_command(
+            self.run_command(
                 method_name='push',
                 attribute_name='push_command',
                 local=self.local,
                 remote=remote,
-            ))
+            )
 
+    @locked(exclusive=True)
     def checkout(self, revision=None, clean=False):
         """
         Update the repository's local working tree to the specified revision.
@@ -864,13 +1754,14 @@ class Repository(PropertyManager):
         self.create()
         revision = revision or self.default_revision
         logger.info("Checking out revision %s in %s ..", revision, self.local)
-        execute(self.get_command(
+        self.run_command(
             method_name='checkout',
             attribute_name='checkout_command_clean' if clean else 'checkout_command',
             local=self.local,
             revision=revision,
-        ))
+        )
 
+    @locked(exclusive=True)
     def create_branch(self, branch_name):
         """
         Create a new branch based on the working tree's revision.
@@ -886,13 +1777,15 @@ class Repository(PropertyManager):
         """
         self.create()
         logger.info("Creating branch %s in %s ..", branch_name, self.local)
-        execute(self.get_command(
+        self.run_command(
             method_name='create_branch',
             attribute_name='create_branch_command',
             local=self.local,
             branch_name=branch_name,
-        ))
+        )
+        self.invalidate_ref_snapshot()
 
+    @locked(exclusive=True)
     def delete_branch(self, branch_name, message=None):
         """
         Delete (or close) a branch in the local repository clone.
@@ -908,15 +1801,17 @@ class Repository(PropertyManager):
         self.create()
         logger.info("Deleting branch %s in %s ..", branch_name, self.local)
         message = message or ("Closing branch %s" % branch_name)
-        execute(self.get_command(
+        self.run_command(
             method_name='delete_branch',
             attribute_name='delete_branch_command',
             local=self.local,
             branch_name=branch_name,
             message=message,
             **self.get_author()
-        ))
+        )
+        self.invalidate_ref_snapshot()
 
+    @locked(exclusive=True)
     def merge(self, revision=None):
         """
         Merge a revision into the current branch (without committing the result).
@@ -941,13 +1836,13 @@ class Repository(PropertyManager):
         revision = revision or self.default_revision
         logger.info("Merging revision %s in %s ..", revision, self.local)
         try:
-            execute(self.get_command(
+            self.run_command(
                 method_name='merge',
                 attribute_name='merge_command',
                 local=self.local,
                 revision=revision,
                 **self.get_author()
-            ))
+            )
         except ExternalCommandFailed as e:
             # Check for merge conflicts.
             conflicts = self.merge_conflicts
@@ -991,6 +1886,7 @@ class Repository(PropertyManager):
         merge error is propagated.
         """
         if connected_to_terminal(sys.stdin):
+            from humanfriendly.prompts import prompt_for_confirmation
             logger.info(compact("""
                 It seems that I'm connected to a terminal so I'll give you a
                 chance to interactively fix the merge conflict(s) in order to
@@ -1011,6 +1907,7 @@ class Repository(PropertyManager):
                     break
         return False
 
+    @locked(exclusive=True)
     def merge_up(self, target_branch=None, feature_branch=None, delete=True):
         """
         Merge a change into one or more release branches and the default branch.
@@ -1106,9 +2003,11 @@ class Repository(PropertyManager):
             )
             # Update the working tree to the default branch.
             self.checkout()
+        self.invalidate_ref_snapshot()
         logger.info("Done! Finished merging up in %s.", timer)
         return revision_to_merge
 
+    @locked(exclusive=True)
     def add_files(self, *pathnames, **kw):
         """
         Stage new files in the working tree to be included in the next commit.
@@ -1133,19 +2032,20 @@ class Repository(PropertyManager):
         if pathnames and add_all:
             raise ValueError("You can't add specific pathnames using all=True!")
         if add_all:
-            execute(self.get_command(
+            self.run_command(
                 method_name='add_files',
                 attribute_name='add_command_all',
                 local=self.local,
-            ))
+            )
         else:
-            execute(self.get_command(
+            self.run_command(
                 method_name='add_files',
                 attribute_name='add_command',
                 local=self.local,
                 filenames=pathnames,
-            ))
+            )
 
+    @locked(exclusive=True)
     def commit(self, message, author=None):
         """
         Commit changes to tracked files in the working tree.
@@ -1160,14 +2060,16 @@ class Repository(PropertyManager):
         """
         self.create()
         logger.info("Committing changes in working tree of %s: %s", self.local, message)
-        execute(self.get_command(
+        self.run_command(
             method_name='commit',
             attribute_name='commit_command',
             local=self.local,
             message=message,
             **self.get_author(author)
-        ))
+        )
+        self.invalidate_ref_snapshot()
 
+    @locked()
     def export(self, directory, revision=None):
         """
         Export the complete tree from the local version control repository.
@@ -1178,21 +2080,366 @@ class Repository(PropertyManager):
                          :attr:`default_revision`).
         :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
 
+        When :attr:`incremental_export` is set and `directory` holds a
+        previous export the export is updated using :func:`update_export()`.
+        Otherwise when :attr:`export_cache` is set the tree is exported using
+        the cache (refer to :class:`~vcs_repo_mgr.exports.ExportCache`) and
+        if neither applies the tree is exported using :func:`export_tree()`.
+
         .. note:: Automatically creates the local repository on the first run.
         """
         self.create()
         revision = revision or self.default_revision
+        incremental = self.incremental_export and getattr(self, 'export_files_command', None)
+        exported_revision = None
+        if incremental:
+            # Export the exact revision that we record.
+            revision = self.find_revision_id(revision)
+            exported_revision = self.find_exported_revision(directory)
+        # Forget the previous export until the new export is complete. This
+        # also invalidates the records of other repositories that exported
+        # to the same directory (by removing the marker in the directory).
+        self.record_exported_revision(directory, None)
+        if exported_revision:
+            self.update_export(directory, exported_revision, revision)
+        elif self.export_cache:
+            from vcs_repo_mgr.exports import ExportCache
+            tree_id = self.find_tree_id(revision)
+            cache = ExportCache(directory=self.export_cache, max_size=self.export_cache_size)
+            logger.info("Exporting revision %s of %s to %s (using export cache) ..", revision, self.local, directory)
+            cache.export(tree_id, directory, functools.partial(self.export_tree, revision=revision),
+                         method=self.export_cache_method)
+        else:
+            self.export_tree(directory, revision)
+        if incremental:
+            self.record_exported_revision(directory, revision)
+
+    def export_tree(self, directory, revision):
+        """
+        Export the complete tree using :attr:`export_command`.
+
+        :param directory: The directory where the tree should be exported (a
+                          string, it's created when it doesn't exist yet).
+        :param revision: The revision to export (a string).
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        Used internally by :func:`export()`.
+        """
         logger.info("Exporting revision %s of %s to %s ..", revision, self.local, directory)
         if not os.path.isdir(directory):
             os.makedirs(directory)
-        execute(self.get_command(
+        self.run_command(
             method_name='export',
             attribute_name='export_command',
             local=self.local,
             revision=revision,
             directory=directory,
+        )
+
+    def update_export(self, directory, old_revision, new_revision):
+        """
+        Update an export of one revision to another revision.
+
+        :param directory: The directory that holds the export (a string).
+        :param old_revision: The global revision id of the revision that's
+                             currently exported to `directory` (a string).
+        :param new_revision: The global revision id of the revision that
+                             should be exported to `directory` (a string).
+        :raises: :exc:`~executor.ExternalCommandFailed` if a command fails.
+
+        The files that were removed or changed between the two revisions are
+        found using :func:`find_changed_files()`. The removed and changed
+        files are deleted (together with directories that become empty) and
+        the changed files are exported again using :func:`export_files()`.
+        Files that didn't change are left alone. Used internally by
+        :func:`export()`.
+        """
+        if old_revision == new_revision:
+            logger.info("Export of revision %s in %s is up to date.", new_revision, directory)
+            return
+        removed, changed = self.find_changed_files(old_revision, new_revision)
+        logger.info("Updating export of %s in %s from revision %s to %s (%s and %s) ..",
+                    self.local, directory, old_revision, new_revision,
+                    pluralize(len(changed), "changed file"), pluralize(len(removed), "removed file"))
+        root = os.path.abspath(directory)
+        for filename in removed + changed:
+            pathname = os.path.join(root, filename)
+            # Changed files are removed as well, to break hard links.
+            if os.path.islink(pathname) or os.path.isfile(pathname):
+                os.unlink(pathname)
+            parent = os.path.dirname(pathname)
+            while parent != root and os.path.isdir(parent) and not os.listdir(parent):
+                os.rmdir(parent)
+                parent = os.path.dirname(parent)
+        # Avoid exceeding the maximum length of command lines.
+        for i in range(0, len(changed), 500):
+            self.export_files(directory, new_revision, changed[i:i + 500])
+
+    def find_changed_files(self, old_revision, new_revision):
+        """
+        Find the files that changed between two revisions.
+
+        :param old_revision: The global revision id of the old revision (a string).
+        :param new_revision: The global revision id of the new revision (a string).
+        :returns: A tuple with two lists of filenames (strings, relative to
+                  the root of the repository):
+
+                  1. The files that exist in the old revision but not in the
+                     new revision (renamed files are reported as removed).
+                  2. The files that were added or changed in the new revision.
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        Subclasses need to define :attr:`find_changed_files_command` and
+        implement :func:`parse_changed_files()`.
+        """
+        return self.parse_changed_files(self.run_command(
+            method_name='find_changed_files',
+            attribute_name='find_changed_files_command',
+            capture=True,
+            local=self.local,
+            old_revision=old_revision,
+            new_revision=new_revision,
         ))
 
+    def parse_changed_files(self, output):
+        """
+        Parse the output of :attr:`find_changed_files_command`.
+
+        :param output: The output of :attr:`find_changed_files_command` (a string).
+        :returns: The same value as :func:`find_changed_files()`.
+
+        The :func:`parse_changed_files()` method needs to be implemented by subclasses.
+        """
+        raise NotImplementedError()
+
+    def export_files(self, directory, revision, filenames):
+        """
+        Export specific files from the local version control repository.
+
+        :param directory: The directory where the files should be exported (a
+                          string).
+        :param revision: The revision to export (a string).
+        :param filenames: The filenames to export (a list of strings, relative
+                          to the root of the repository).
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        Used internally by :func:`update_export()`.
+        """
+        self.run_command(
+            method_name='export_files',
+            attribute_name='export_files_command',
+            local=self.local,
+            revision=revision,
+            directory=directory,
+            filenames=filenames,
+        )
+
+    def find_exported_revision(self, directory):
+        """
+        Find the revision that :func:`export()` exported to a directory.
+
+        :param directory: The pathname of a directory (a string).
+        :returns: The global revision id of the exported revision (a string)
+                  or :data:`None` when the directory doesn't exist or
+                  doesn't hold a complete export recorded by
+                  :func:`record_exported_revision()`.
+
+        The record is only used when the marker in the directory (see
+        :data:`EXPORT_MARKER`) contains the token stored in the record, so
+        that a stale record isn't used after something else (for example
+        another repository) exported to the same directory.
+        """
+        if os.path.isdir(directory):
+            try:
+                with open(self.get_export_record(directory)) as handle:
+                    pathname, revision_id, token = handle.read().splitlines()
+                with open(os.path.join(directory, EXPORT_MARKER)) as handle:
+                    marker = handle.read().strip()
+                if pathname == os.path.abspath(directory) and marker == token:
+                    return revision_id
+            except (IOError, OSError, ValueError):
+                pass
+
+    def record_exported_revision(self, directory, revision_id):
+        """
+        Record the revision that was exported to a directory.
+
+        :param directory: The pathname of a directory (a string).
+        :param revision_id: The global revision id of the exported revision (a
+                            string) or :data:`None` to forget the record.
+
+        The record is stored in the local clone (in :attr:`export_records`)
+        together with a random token that's also written to a marker file in
+        the directory (see :data:`EXPORT_MARKER`). Forgetting the record
+        removes the marker, which invalidates the records of all repositories
+        that exported to the directory.
+        """
+        filename = self.get_export_record(directory)
+        marker = os.path.join(directory, EXPORT_MARKER)
+        if revision_id:
+            token = binascii.hexlify(os.urandom(16)).decode('ascii')
+            if not os.path.isdir(self.export_records):
+                os.makedirs(self.export_records)
+            with open(marker, 'w') as handle:
+                handle.write('%s\n' % token)
+            with open(filename + '.tmp', 'w') as handle:
+                handle.write('%s\n%s\n%s\n' % (os.path.abspath(directory), revision_id, token))
+            os.rename(filename + '.tmp', filename)
+        else:
+            for pathname in filename, marker:
+                if os.path.isfile(pathname):
+                    os.unlink(pathname)
+
+    def get_export_record(self, directory):
+        """Get the pathname of the file that records the revision exported to a directory (a string)."""
+        key = hashlib.sha1(os.path.abspath(directory).encode('UTF-8')).hexdigest()
+        return os.path.join(self.export_records, key)
+
+    @locked()
+    def export_archive(self, target, revision=None, format=None):
+        """
+        Export the complete tree from the local version control repository to an archive.
+
+        :param target: The pathname of the archive (a string) or a writable
+                       file object (opened in binary mode).
+        :param revision: The revision to export (a string, defaults to
+                         :attr:`default_revision`).
+        :param format: The archive format (one of the formats in
+                       :data:`ARCHIVE_FORMATS`, defaults to the format that
+                       matches the extension of `target` when `target` is a
+                       pathname and ``tar`` otherwise).
+        :returns: The size of the archive in bytes (an integer).
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        The archive is streamed from the version control system to `target`
+        without extracting the tree to disk (refer to
+        :func:`generate_archive()`). When `target` is a pathname the archive
+        is written to a temporary file that's renamed to `target` when the
+        export succeeds, so a failed export doesn't leave behind an
+        incomplete archive (or replace an existing file). The archive format
+        is validated before any files are created.
+
+        .. note:: Automatically creates the local repository on the first run.
+        """
+        if isinstance(target, string_types):
+            format = format or find_archive_format(target)
+            self.find_archive_type(format)
+            temporary_file = target + '.tmp'
+            try:
+                with open(temporary_file, 'wb') as handle:
+                    num_bytes = self.export_archive(handle, revision=revision, format=format)
+                os.rename(temporary_file, target)
+                return num_bytes
+            finally:
+                if os.path.exists(temporary_file):
+                    os.unlink(temporary_file)
+        num_bytes = 0
+        for chunk in self.generate_archive(revision=revision, format=format or 'tar'):
+            target.write(chunk)
+            num_bytes += len(chunk)
+        return num_bytes
+
+    def generate_archive(self, revision=None, format='tar', chunk_size=1024 * 64):
+        """
+        Generate an archive of the complete tree from the local version control repository.
+
+        :param revision: The revision to export (a string, defaults to
+                         :attr:`default_revision`).
+        :param format: The archive format (one of the formats in
+                       :data:`ARCHIVE_FORMATS`, defaults to ``tar``).
+        :param chunk_size: The maximum size of the generated chunks (an
+                           integer, defaults to 64 KiB).
+        :returns: A generator of byte strings.
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails
+                 and :exc:`~exceptions.ValueError` when the format isn't
+                 supported.
+
+        The archive is generated by :attr:`export_archive_command` (the
+        value of :attr:`ARCHIVE_TYPES` that matches `format` is available as
+        ``{archive_type}``). Compressed tar archives that the version control
+        system can't generate itself are compressed by Python.
+
+        .. note:: Automatically creates the local repository on the first run.
+        """
+        format, compression = self.find_archive_type(format)
+        self.create()
+        revision = revision or self.default_revision
+        command = self.get_command(
+            method_name='generate_archive',
+            attribute_name='export_archive_command',
+            local=self.local,
+            revision=revision,
+            archive_type=self.ARCHIVE_TYPES[format],
+        )
+        logger.info("Exporting revision %s of %s to %s archive ..", revision, self.local, compression or format)
+        chunks = self.stream_command(command, chunk_size)
+        return compress_chunks(chunks, compression) if compression else chunks
+
+    def find_archive_type(self, format):
+        """
+        Find out how an archive format is generated.
+
+        :param format: The archive format (one of the formats in
+                       :data:`ARCHIVE_FORMATS`).
+        :returns: A tuple with two values:
+
+                  1. The format generated by the version control system (a
+                     key of :attr:`ARCHIVE_TYPES`).
+                  2. The format that's compressed by Python (one of the
+                     strings ``tar.gz`` and ``tar.xz``, refer to
+                     :func:`compress_chunks()`) or :data:`None`.
+        :raises: :exc:`~exceptions.ValueError` when the format isn't
+                 supported (by `vcs-repo-mgr`, the version control system or
+                 the Python interpreter).
+        """
+        if format not in set(f for e, f in ARCHIVE_FORMATS):
+            msg = "Archive format %r is not supported! (valid options are %s)"
+            raise ValueError(msg % (format, concatenate(sorted(set(repr(f) for e, f in ARCHIVE_FORMATS)))))
+        compression = None
+        if format not in self.ARCHIVE_TYPES and format.startswith('tar.'):
+            compression = format
+            format = 'tar'
+        if format not in self.ARCHIVE_TYPES:
+            msg = "%s repositories don't support the %r archive format!"
+            raise ValueError(msg % (self.friendly_name, format))
+        if compression == 'tar.xz':
+            try:
+                import lzma  # NOQA
+            except ImportError:
+                raise ValueError("The 'tar.xz' archive format requires the lzma module (Python 3.3 or newer)!")
+        return format, compression
+
+    def stream_command(self, command, chunk_size):
+        """
+        Run a shell command and generate its standard output as chunks.
+
+        :param command: The shell command (a string).
+        :param chunk_size: The maximum size of the generated chunks (an integer).
+        :returns: A generator of byte strings.
+        :raises: :exc:`~executor.ExternalCommandFailed` when the command fails.
+
+        Used internally by :func:`generate_archive()`. When the caller stops
+        consuming the generator before the end of the output, the command is
+        terminated (by closing the pipe it's writing to).
+        """
+        logger.debug("Streaming output of external command: %s", command)
+        timer = Timer()
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+        completed = False
+        num_bytes = 0
+        try:
+            for chunk in iter(functools.partial(process.stdout.read, chunk_size), b''):
+                num_bytes += len(chunk)
+                yield chunk
+            completed = True
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            command_statistics.record(command, timer.elapsed_time, output=num_bytes, failed=returncode != 0)
+        if completed and returncode != 0:
+            failed_command = ExternalCommand(command, returncode=returncode)
+            raise failed_command.error_type(failed_command)
+
     @property
     def is_bare(self):
         """
@@ -1224,6 +2471,7 @@ class Repository(PropertyManager):
                 contains changes to tracked files!
             """, local=self.local))
 
+    @locked()
     def find_revision_number(self, revision=None):
         """
         Find the local revision number of the given revision.
@@ -1234,11 +2482,53 @@ class Repository(PropertyManager):
 
         .. note:: Automatically creates the local repository on the first run.
 
-        The :func:`find_revision_number()` method needs to be implemented by
-        subclasses.
+        This is a shortcut for :func:`find_revision_numbers()` that resolves
+        a single revision.
+        """
+        return self.find_revision_numbers([revision])[0]
+
+    @locked()
+    def find_revision_numbers(self, revisions):
+        """
+        Find the local revision numbers of multiple revisions.
+
+        :param revisions: An iterable of references to revisions (strings,
+                          :data:`None` is replaced by :attr:`default_revision`).
+        :returns: A list of local revision numbers (integers) in the same
+                  order as the given revisions.
+
+        .. note:: Automatically creates the local repository on the first run.
+
+        The default implementation resolves the given revisions to global
+        revision ids using :func:`find_revision_ids()` and looks up the
+        revision numbers in :attr:`revision_numbers`. Revision numbers that
+        aren't known yet are calculated using :func:`count_revisions()` and
+        stored in :attr:`revision_numbers` for future use.
+        """
+        self.create()
+        revision_ids = self.find_revision_ids(revisions)
+        revision_numbers = self.revision_numbers.get_many(revision_ids)
+        new_numbers = {}
+        for revision_id in revision_ids:
+            if revision_id not in revision_numbers:
+                revision_numbers[revision_id] = self.count_revisions(revision_id)
+                new_numbers[revision_id] = revision_numbers[revision_id]
+        self.revision_numbers.update(new_numbers)
+        return [revision_numbers[revision_id] for revision_id in revision_ids]
+
+    def count_revisions(self, revision_id):
+        """
+        Calculate the local revision number of the given revision.
+
+        :param revision_id: A global revision id (a string).
+        :returns: The local revision number (an integer).
+
+        This is an internal method that is used by :func:`find_revision_number()`
+        and needs to be implemented by subclasses.
         """
         raise NotImplementedError()
 
+    @locked()
     def find_revision_id(self, revision=None):
         """
         Find the global revision id of the given revision.
@@ -1254,6 +2544,41 @@ class Repository(PropertyManager):
         """
         raise NotImplementedError()
 
+    @locked()
+    def find_revision_ids(self, revisions):
+        """
+        Find the global revision ids of multiple revisions.
+
+        :param revisions: An iterable of references to revisions (strings,
+                          :data:`None` is replaced by :attr:`default_revision`).
+        :returns: A list of global revision ids (hexadecimal strings) in the
+                  same order as the given revisions.
+
+        .. note:: Automatically creates the local repository on the first run.
+
+        The default implementation calls :func:`find_revision_id()` for each
+        of the given revisions. Subclasses can override this method to resolve
+        all of the revisions using a single external command.
+        """
+        return [self.find_revision_id(revision) for revision in revisions]
+
+    @locked()
+    def find_tree_id(self, revision=None):
+        """
+        Find the id of the tree of a revision.
+
+        :param revision: A reference to a revision, most likely the name of a
+                         branch (a string, defaults to :attr:`default_revision`).
+        :returns: The tree id (a string).
+
+        Revisions with the same tree id have the same contents, which is used
+        by :attr:`export_cache`. Subclasses can override this method to report
+        the id of the tree (git) or manifest (Mercurial), the base
+        implementation returns the global revision id reported by
+        :func:`find_revision_id()`.
+        """
+        return self.find_revision_id(revision)
+
     def generate_control_field(self, revision=None):
         """
         Generate a Debian control file name/value pair for the given repository and revision.
@@ -1298,7 +2623,8 @@ class Repository(PropertyManager):
          'todo':   Revision(repository=GitRepo(...), branch='todo',   revision_id='dea8a2d')}
         """
         self.create()
-        return dict((r.branch, r) for r in self.find_branches())
+        with self.lock():
+            return dict((r.branch, r) for r in self.ref_snapshot.branches)
 
     @property
     def ordered_branches(self):
@@ -1313,6 +2639,7 @@ class Repository(PropertyManager):
 
         .. note:: Automatically creates the local repository on the first run.
         """
+        from natsort import natsort
         return natsort(self.branches.values(), key=operator.attrgetter('branch'))
 
     @property
@@ -1352,7 +2679,8 @@ class Repository(PropertyManager):
                             revision_id='67308bd628c6235dbc1bad60c9ad1f2d27d576cc')}
         """
         self.create()
-        return dict((r.tag, r) for r in self.find_tags())
+        with self.lock():
+            return dict((r.tag, r) for r in self.ref_snapshot.tags)
 
     @property
     def ordered_tags(self):
@@ -1367,6 +2695,7 @@ class Repository(PropertyManager):
 
         .. note:: Automatically creates the local repository on the first run.
         """
+        from natsort import natsort
         return natsort(self.tags.values(), key=operator.attrgetter('tag'))
 
     @property
@@ -1421,15 +2750,44 @@ class Repository(PropertyManager):
         Find information about the releases in the version control repository.
 
         :returns: An ordered :class:`list` of :class:`Release` objects.
-                  The list is ordered by performing a `natural order sort
-                  <https://pypi.python.org/pypi/naturalsort>`_ of release
-                  identifiers in ascending order (i.e. the first value is the
-                  "oldest" release and the last value is the newest
-                  "release").
+                  The list is ordered by sorting the release identifiers
+                  according to :attr:`release_ordering` (by default a
+                  `natural order sort <https://pypi.python.org/pypi/naturalsort>`_)
+                  in ascending order (i.e. the first value is the "oldest"
+                  release and the last value is the newest "release").
+
+        .. note:: Automatically creates the local repository on the first run.
+        """
+        return list(self.release_index)
+
+    @property
+    def release_index(self):
+        """
+        A sorted index of the releases in the repository (a :class:`~vcs_repo_mgr.ordering.ReleaseIndex` object).
+
+        The index is stored in :attr:`ref_snapshot` so it's only rebuilt when
+        the branches or tags in the repository change (or when
+        :attr:`release_scheme`, :attr:`release_filter` or
+        :attr:`release_ordering` change). Apart from :func:`select_release()`
+        the index supports range queries, for example:
+
+        .. code-block:: python
+
+           # The releases between 1.0 and 1.9 (inclusive).
+           repository.release_index.between('1.0', '1.9')
+           # The five newest releases.
+           repository.release_index.latest(5)
 
         .. note:: Automatically creates the local repository on the first run.
         """
-        return natsort(self.releases.values(), key=operator.attrgetter('identifier'))
+        from vcs_repo_mgr.ordering import ReleaseIndex
+        snapshot = self.ref_snapshot
+        key = (self.release_scheme, self.compiled_filter.pattern, self.release_ordering)
+        index = snapshot.release_indexes.get(key)
+        if index is None:
+            index = ReleaseIndex(self.releases.values(), ordering=self.release_ordering)
+            snapshot.release_indexes[key] = index
+        return index
 
     def select_release(self, highest_allowed_release):
         """
@@ -1442,16 +2800,7 @@ class Repository(PropertyManager):
         :raises: :exc:`~vcs_repo_mgr.exceptions.NoMatchingReleasesError`
                  when no matching releases are found.
         """
-        matching_releases = []
-        highest_allowed_key = natsort_key(highest_allowed_release)
-        for release in self.ordered_releases:
-            release_key = natsort_key(release.identifier)
-            if release_key <= highest_allowed_key:
-                matching_releases.append(release)
-        if not matching_releases:
-            msg = "No releases below or equal to %r found in repository!"
-            raise NoMatchingReleasesError(msg % highest_allowed_release)
-        return matching_releases[-1]
+        return self.release_index.select(highest_allowed_release)
 
     def release_to_branch(self, release_id):
         """
@@ -1584,6 +2933,224 @@ class Revision(object):
         return "%s(%s)" % (self.__class__.__name__, ', '.join(fields))
 
 
+class Configuration(object):
+
+    """
+    :class:`Configuration` objects contain the repository definitions loaded by :func:`load_configuration()`.
+
+    .. py:attribute:: fingerprint
+
+       The pathnames, modification times, sizes and inode numbers of the
+       configuration files that were loaded (a tuple).
+
+    .. py:attribute:: sections
+
+       A dictionary with repository names (strings) as keys and dictionaries
+       with the options of the repository definitions as values.
+
+    .. py:attribute:: index
+
+       A dictionary with normalized repository names (see
+       :func:`normalize_name()`) as keys and sorted lists of matching
+       repository names as values.
+    """
+
+    def __init__(self, fingerprint, parser):
+        """
+        Initialize a :class:`Configuration` object.
+
+        :param fingerprint: The fingerprint of the configuration files (a tuple).
+        :param parser: A :class:`~six.moves.configparser.RawConfigParser`
+                       object that has loaded the configuration files.
+        """
+        self.fingerprint = fingerprint
+        self.sections = {}
+        self.index = {}
+        for name in parser.sections():
+            self.sections[name] = dict(parser.items(name))
+            self.index.setdefault(normalize_name(name), []).append(name)
+        for names in self.index.values():
+            names.sort()
+
+    def __repr__(self):
+        """Generate a human readable representation of a configuration object."""
+        return "%s(files=%r)" % (self.__class__.__name__, [f[0] for f in self.fingerprint])
+
+
+class RefSnapshot(object):
+
+    """
+    :class:`RefSnapshot` objects capture the branches and tags of a :class:`Repository`.
+
+    Snapshots are created by :attr:`Repository.ref_snapshot` and are never
+    changed once their branches and tags have been found, instead a new
+    snapshot is created when the branches or tags in the repository change.
+
+    .. py:attribute:: repository
+
+       The :class:`Repository` object that the snapshot was taken from.
+
+    .. py:attribute:: fingerprint
+
+       The value of :attr:`Repository.ref_fingerprint` at the time the
+       snapshot was created (a tuple or :data:`None`).
+
+    .. py:attribute:: release_indexes
+
+       A dictionary with the :class:`~vcs_repo_mgr.ordering.ReleaseIndex`
+       objects created by :attr:`Repository.release_index` (keyed by release
+       scheme, filter and ordering).
+    """
+
+    def __init__(self, repository, fingerprint):
+        """
+        Create a :class:`RefSnapshot` object.
+
+        :param repository: A :class:`Repository` object.
+        :param fingerprint: The value of :attr:`Repository.ref_fingerprint`.
+        """
+        self.repository = repository
+        self.fingerprint = fingerprint
+        self.release_indexes = {}
+
+    @lazy_property
+    def branches(self):
+        """The branches in the repository (a tuple of :class:`Revision` objects)."""
+        return tuple(self.repository.find_branches())
+
+    @lazy_property
+    def tags(self):
+        """The tags in the repository (a tuple of :class:`Revision` objects)."""
+        return tuple(self.repository.find_tags())
+
+    def __repr__(self):
+        """Generate a human readable representation of a snapshot object."""
+        return "%s(repository=%r)" % (self.__class__.__name__, self.repository)
+
+
+class RevisionNumberIndex(object):
+
+    """
+    Persistent mapping of global revision ids to local revision numbers.
+
+    Calculating the revision number of a revision can require walking the
+    complete history of a repository (e.g. ``git rev-list --count``) while the
+    revision number of a given global revision id never changes, so
+    :func:`Repository.find_revision_number()` stores the revision numbers that
+    it calculates in an SQLite database.
+
+    Errors reported by SQLite (for example because the database can't be
+    created in a read only directory) are logged but otherwise ignored,
+    because the index is only an optimization.
+    """
+
+    def __init__(self, filename):
+        """
+        Initialize a :class:`RevisionNumberIndex` object.
+
+        :param filename: The pathname of the SQLite database (a string). The
+                         database is created when the first revision number
+                         is stored.
+        """
+        self.filename = filename
+
+    @property
+    def exists(self):
+        """:data:`True` if the database exists, :data:`False` otherwise."""
+        return os.path.isfile(self.filename)
+
+    def connect(self):
+        """
+        Connect to the database (creating it if it doesn't exist yet).
+
+        :returns: A :class:`sqlite3.Connection` object.
+        """
+        import sqlite3
+        connection = sqlite3.connect(self.filename, timeout=60)
+        connection.execute(compact("""
+            CREATE TABLE IF NOT EXISTS revision_numbers (
+                revision_id TEXT PRIMARY KEY,
+                revision_number INTEGER NOT NULL
+            )
+        """))
+        return connection
+
+    def get(self, revision_id):
+        """
+        Get the revision number of a revision.
+
+        :param revision_id: A global revision id (a string).
+        :returns: The revision number (an integer) or :data:`None` when the
+                  revision number isn't known.
+        """
+        return self.get_many([revision_id]).get(revision_id)
+
+    def get_many(self, revision_ids):
+        """
+        Get the revision numbers of multiple revisions.
+
+        :param revision_ids: An iterable of global revision ids (strings).
+        :returns: A dictionary with global revision ids (strings) as keys and
+                  revision numbers (integers) as values. Revisions whose
+                  revision number isn't known are omitted.
+        """
+        import sqlite3
+        revision_numbers = {}
+        revision_ids = list(set(revision_ids))
+        if revision_ids and self.exists:
+            try:
+                connection = self.connect()
+                try:
+                    # SQLite limits the number of parameters in a single query.
+                    for i in range(0, len(revision_ids), 500):
+                        chunk = revision_ids[i:i + 500]
+                        query = "SELECT revision_id, revision_number FROM revision_numbers WHERE revision_id IN (%s)"
+                        for revision_id, revision_number in connection.execute(
+                                query % ', '.join('?' * len(chunk)), chunk):
+                            revision_numbers[revision_id] = revision_number
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                logger.warning("Failed to read revision numbers from %s! (%s)", format_path(self.filename), e)
+        return revision_numbers
+
+    def set(self, revision_id, revision_number):
+        """
+        Store the revision number of a revision.
+
+        :param revision_id: A global revision id (a string).
+        :param revision_number: The revision number (an integer).
+        """
+        self.update({revision_id: revision_number})
+
+    def update(self, revision_numbers):
+        """
+        Store the revision numbers of multiple revisions.
+
+        :param revision_numbers: A dictionary with global revision ids
+                                 (strings) as keys and revision numbers
+                                 (integers) as values.
+        """
+        import sqlite3
+        if revision_numbers:
+            try:
+                connection = self.connect()
+                try:
+                    with connection:
+                        connection.executemany(
+                            "INSERT OR REPLACE INTO revision_numbers (revision_id, revision_number) VALUES (?, ?)",
+                            revision_numbers.items(),
+                        )
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                logger.warning("Failed to store revision numbers in %s! (%s)", format_path(self.filename), e)
+
+    def __repr__(self):
+        """Generate a human readable representation of an index object."""
+        return "%s(filename=%r)" % (self.__class__.__name__, self.filename)
+
+
 class RepositoryMeta(type):
 
     """Metaclass for automatic registration of :class:`Repository` subclasses."""
@@ -1722,16 +3289,40 @@ class HgRepo(Repository):
     """
     Version control repository interface for Mercurial_ repositories.
 
+    When :attr:`~Repository.coprocess` is enabled the Mercurial commands used
+    by :class:`HgRepo` are run by a long running Mercurial command server (see
+    :attr:`command_server`) instead of starting ``hg`` for every command.
+
+    When :attr:`~Repository.shared_store` is set the shared store is a
+    regular Mercurial repository that every remote repository is pulled into
+    and local clones are cloned from the shared store, restricted to the heads
+    of their own remote repository (see :func:`update_shared_store()`). This
+    means history that's shared between forks of the same project is only
+    transferred over the network once, while every local clone reports the
+    branches and tags of its own remote repository. Because ``hg clone
+    --rev`` implies ``--pull`` the changesets are copied into the local clone
+    (instead of hard linked).
+
+    When :attr:`~Repository.native_refs` is enabled branches and tags are
+    read from Mercurial's own caches (see :attr:`cache_reader`) as long as
+    those caches are up to date.
+
     .. _Mercurial: http://mercurial.selenic.com/
     """
 
     ALIASES = ['hg', 'mercurial']
     """A list of strings with aliases/names for Mercurial."""
 
+    CLONE_STRATEGIES = ('full', 'stream')
+    """The clone strategies supported by Mercurial (a tuple of strings)."""
+
+    ARCHIVE_TYPES = {'tar': 'tar', 'tar.gz': 'tgz', 'zip': 'zip'}
+    """The archive formats supported by ``hg archive --type`` (a dictionary)."""
+
     friendly_name = 'Mercurial'
     control_field = 'Vcs-Hg'
-    create_command = 'hg clone --noupdate {remote} {local}'
-    create_command_non_bare = 'hg clone {remote} {local}'
+    create_command = 'hg clone --noupdate {clone_options} {remote} {local}'
+    create_command_non_bare = 'hg clone {clone_options} {remote} {local}'
     update_command = 'hg -R {local} pull {remote}'
     push_command = 'hg -R {local} push --new-branch {remote}'
     checkout_command = 'hg -R {local} update --rev={revision}'
@@ -1754,6 +3345,15 @@ class HgRepo(Repository):
         hg -R {local} commit --user={author_combined} --message={message}
     ''')
     export_command = 'hg -R {local} archive --rev={revision} {directory}'
+    export_archive_command = 'hg -R {local} archive --rev={revision} --type={archive_type} --prefix=. -'
+    export_files_command = 'hg -R {local} archive --rev={revision} {patterns} {directory}'
+    find_changed_files_command = 'hg --cwd {local} status --rev={old_revision} --rev={new_revision} --print0'
+    find_revision_id_command = 'hg -R {local} id --rev={revision} --debug --id'
+    find_revision_number_command = 'hg -R {local} id --rev={revision} --num'
+    find_tree_id_command = 'hg -R {local} log --rev={revision} --template={{manifest}} --debug'
+    find_branches_command = 'hg -R {local} branches'
+    find_tags_command = 'hg -R {local} tags'
+    remote_refs_command = 'hg -R {local} id --rev=tip --debug --id {remote}'
 
     @staticmethod
     def get_vcs_directory(directory):
@@ -1766,6 +3366,155 @@ class HgRepo(Repository):
         """
         return os.path.join(directory, '.hg')
 
+    @lazy_property
+    def command_server(self):
+        """
+        The long running Mercurial command server (a :class:`~vcs_repo_mgr.coprocesses.HgCommandServer` object).
+
+        This is only used when :attr:`~Repository.coprocess` is enabled. The
+        process is started when the first command is run.
+        """
+        from vcs_repo_mgr.coprocesses import HgCommandServer
+        return HgCommandServer(directory=self.local)
+
+    def close(self):
+        """Terminate the long running Mercurial command server (if it's running)."""
+        self.command_server.close()
+
+    def hg(self, *arguments, **options):
+        """
+        Run a Mercurial command in the local repository.
+
+        :param arguments: The arguments to the ``hg`` program (strings,
+                          without the name of the program and the ``-R``
+                          option).
+        :param options: Any keyword arguments are passed on to
+                        :func:`~executor.execute()`.
+        :returns: The return value of :func:`~executor.execute()`.
+
+        When :attr:`~Repository.coprocess` is enabled and the local repository
+        exists the command is run by :attr:`command_server`.
+        """
+        if self.coprocess and self.exists:
+            return self.command_server.execute(*arguments, **options)
+        return execute('hg', '-R', self.local, *arguments, **options)
+
+    def run_command(self, method_name, attribute_name, capture=False, **kw):
+        """
+        Run the command for a given VCS operation.
+
+        Refer to :func:`Repository.run_command()` for the parameters. When
+        :attr:`~Repository.coprocess` is enabled and the command can be
+        translated by :func:`get_server_commands()` it is run by
+        :attr:`command_server`, otherwise the command is run by the shell.
+        """
+        commands = None
+        if self.coprocess and self.exists:
+            commands = self.get_server_commands(method_name, attribute_name, **kw)
+        if commands is None:
+            return super(HgRepo, self).run_command(method_name, attribute_name, capture=capture, **kw)
+        output = None
+        for arguments, options in commands:
+            output = self.command_server.execute(*arguments, capture=capture, **options)
+        return output
+
+    def get_server_commands(self, method_name, attribute_name, **kw):
+        """
+        Translate the command for a given VCS operation for :attr:`command_server`.
+
+        Refer to :func:`Repository.get_command()` for the parameters.
+
+        :returns: A list of tuples with two values each (the arguments to the
+                  ``hg`` program and a dictionary with keyword arguments for
+                  :func:`~vcs_repo_mgr.coprocesses.HgCommandServer.execute()`)
+                  or :data:`None` when the command can't be translated.
+
+        Commands are split on ``&&`` and ``;`` (where the latter means errors
+        are ignored) and ``2>/dev/null`` means the command is silenced. Each
+        resulting command needs to start with ``hg -R {local}`` or ``hg --cwd
+        {local}`` and can't use any other shell features, otherwise
+        :data:`None` is returned (this is intended to support custom commands
+        that require a shell).
+        """
+        command_template = getattr(self, attribute_name, None)
+        if command_template is None:
+            # Let get_command() raise the appropriate exception.
+            self.get_command(method_name, attribute_name, **kw)
+        quoted_arguments = dict((k, quote(v)) for k, v in kw.items())
+        parts = re.split(r'(&&|;)', command_template) + ['']
+        commands = []
+        for template, separator in zip(parts[0::2], parts[1::2]):
+            template = template.strip()
+            if not template:
+                continue
+            silent = '2>/dev/null' in template
+            template = template.replace('2>/dev/null', '')
+            if re.search(r'[|<>&;`$()]', template):
+                return None
+            tokens = shlex.split(template.format(**quoted_arguments))
+            if tokens[:1] != ['hg'] or tokens[1:2] not in (['-R'], ['--cwd']) or tokens[2:3] != [self.local]:
+                return None
+            commands.append((tokens[3:], dict(check=(separator != ';'), silent=silent)))
+        return commands
+
+    @property
+    def clone_options(self):
+        """The command line arguments for ``hg clone`` that implement :attr:`~Repository.clone_strategy`."""
+        return ['--stream'] if self.clone_strategy == 'stream' else []
+
+    def create_clone(self, remote, directory):
+        """
+        Clone the remote Mercurial repository into a staging directory.
+
+        Refer to :func:`Repository.create_clone()` for the parameters. When
+        :attr:`~Repository.shared_store` is set the remote repository is
+        pulled into the shared store (see :func:`update_shared_store()`) after
+        which the heads of the remote repository are cloned from the shared
+        store (so that the local clone doesn't contain the changesets of
+        other remote repositories in the shared store). The default path of
+        the local clone is set to the remote repository.
+        """
+        if not self.shared_store:
+            return super(HgRepo, self).create_clone(remote, directory)
+        heads = self.update_shared_store(remote=remote)
+        logger.info("Cloning %s from shared Mercurial store at %s ..", remote, format_path(self.shared_store))
+        self.run_command(
+            method_name='create',
+            attribute_name='create_command' if self.bare else 'create_command_non_bare',
+            local=directory,
+            remote=self.shared_store,
+            clone_options=['--rev=%s' % revision_id for revision_id in heads] or ['--rev=null'],
+        )
+        with open(os.path.join(directory, '.hg', 'hgrc'), 'w') as handle:
+            handle.write('[paths]\ndefault = %s\n' % remote)
+
+    def update_shared_store(self, remote=None):
+        """
+        Pull the changesets of a remote repository into :attr:`~Repository.shared_store`.
+
+        :param remote: Overrides the value of :attr:`~Repository.remote` for
+                       the duration of the call to :func:`update_shared_store()`.
+        :returns: The global revision ids of the heads of the remote
+                  repository (a list of strings).
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        The shared store is created when it doesn't exist yet. The heads of
+        the remote repository are the heads of the changesets in the shared
+        store that aren't missing from the remote repository (according to
+        the ``outgoing()`` revset).
+        """
+        remote = remote or self.remote
+        store = self.shared_store
+        if not os.path.isdir(os.path.join(store, '.hg')):
+            logger.info("Creating shared Mercurial store at %s ..", format_path(store))
+            execute('hg', 'init', store)
+        logger.info("Pulling %s into shared Mercurial store at %s ..", remote, format_path(store))
+        execute('hg', '-R', store, 'pull', '--quiet', remote)
+        listing = execute('hg', '-R', store, '--config', 'paths.vcs-repo-mgr-remote=%s' % remote,
+                          'log', "--rev=heads(not outgoing('vcs-repo-mgr-remote'))", '--template={node}\\n',
+                          capture=True)
+        return listing.split()
+
     @writable_property(cached=True)
     def author(self):
         """
@@ -1777,10 +3526,7 @@ class HgRepo(Repository):
         will be respected, but you are still free to explicitly specify a value
         for :attr:`author`.
         """
-        return execute(
-            'hg', '-R', self.local, 'config', 'ui.username',
-            capture=True, check=False, silent=True,
-        )
+        return self.hg('config', 'ui.username', capture=True, check=False, silent=True)
 
     @required_property
     def default_revision(self):
@@ -1790,12 +3536,12 @@ class HgRepo(Repository):
     @property
     def current_branch(self):
         """The name of the branch that's currently checked out in the working tree (a string or :data:`None`)."""
-        return execute('hg', 'branch', capture=True, check=False, directory=self.local)
+        return self.hg('branch', capture=True, check=False, directory=self.local)
 
     @property
     def merge_conflicts(self):
         """The filenames of any files with merge conflicts (a list of strings)."""
-        listing = execute('hg', 'resolve', '--list', capture=True, directory=self.local)
+        listing = self.hg('resolve', '--list', capture=True, directory=self.local)
         filenames = set()
         for line in listing.splitlines():
             tokens = line.split(None, 1)
@@ -1815,7 +3561,7 @@ class HgRepo(Repository):
         """
         self.create()
         try:
-            return int(execute('hg', '-R', self.local, 'id', capture=True)) == 0
+            return int(self.hg('id', capture=True)) == 0
         except Exception:
             return False
 
@@ -1823,24 +3569,97 @@ class HgRepo(Repository):
     def is_clean(self):
         """:data:`True` if the working tree is clean, :data:`False` otherwise."""
         self.create()
-        listing = execute('hg', '-R', self.local, 'diff', capture=True)
+        listing = self.hg('diff', capture=True)
         return len(listing.splitlines()) == 0
 
+    @property
+    def cache_reader(self):
+        """
+        The pure Python reader for the branch and tag caches of the Mercurial repository.
+
+        A :class:`~vcs_repo_mgr.native.HgCacheReader` object or :data:`None`
+        when :attr:`~Repository.native_refs` is disabled or the repository
+        format isn't supported by :class:`~vcs_repo_mgr.native.HgCacheReader`.
+        """
+        if self.native_refs:
+            from vcs_repo_mgr.native import HgCacheReader
+            reader = HgCacheReader(self.vcs_directory)
+            if reader.is_supported:
+                return reader
+
+    @property
+    def ref_files(self):
+        """
+        The pathnames of the files that store branches and tags (a list of strings).
+
+        Mercurial stores branch names and (global) tags in the history of the
+        repository so the changelog is used to detect changes. The branch and
+        tag caches in ``.hg/cache`` aren't used because Mercurial rewrites them
+        while answering queries. The file ``.hg/localtags`` is included for
+        local tags.
+        """
+        return [
+            os.path.join(self.vcs_directory, 'store', '00changelog.i'),
+            os.path.join(self.vcs_directory, 'store', 'obsstore'),
+            os.path.join(self.vcs_directory, '00changelog.i'),
+            os.path.join(self.vcs_directory, 'localtags'),
+        ]
+
+    @locked()
     def find_revision_number(self, revision=None):
         """
         Find the revision number of the given revision expression.
 
         :param revision: A Mercurial specific revision expression (a string).
         :returns: The revision number (an integer).
+
+        Mercurial can report revision numbers without walking the history of
+        the repository so :attr:`~Repository.revision_numbers` isn't used.
         """
         self.create()
-        revision = revision or self.default_revision
-        result = execute('hg', '-R', self.local, 'id', '--rev', revision, '--num',
-                         capture=True).rstrip('+')
+        return self.parse_revision_number(self.run_command(
+            method_name='find_revision_number',
+            attribute_name='find_revision_number_command',
+            capture=True,
+            local=self.local,
+            revision=revision or self.default_revision,
+        ))
+
+    def parse_revision_number(self, output):
+        """
+        Parse the output of ``hg id --num``.
+
+        :param output: The output of :attr:`find_revision_number_command` (a string).
+        :returns: The revision number (an integer).
+        """
+        result = output.rstrip('+')
         assert result and result.isdigit(), \
             "Failed to find local revision number! ('hg id --num' gave unexpected output)"
         return int(result)
 
+    def find_local_refs(self):
+        """
+        Find the tip of the local Mercurial repository.
+
+        :returns: A dictionary with the key ``tip`` and the global revision id
+                  of the tip as value.
+
+        Mercurial doesn't advertise branches and tags as cheaply as git, but
+        every changeset that's pulled becomes the new tip, so comparing the
+        tips is enough to detect new changesets in a mirror.
+        """
+        return dict(tip=self.find_revision_id('tip'))
+
+    def parse_remote_refs(self, listing):
+        """
+        Parse the output of ``hg id --debug --id``.
+
+        :param listing: The output of :attr:`remote_refs_command` (a string).
+        :returns: A dictionary in the format of :func:`find_local_refs()`.
+        """
+        return dict(tip=listing.strip())
+
+    @locked()
     def find_revision_id(self, revision=None):
         """
         Find the revision id of the given revision expression.
@@ -1849,13 +3668,152 @@ class HgRepo(Repository):
         :returns: The revision id (a hexadecimal string).
         """
         self.create()
-        revision = revision or self.default_revision
-        result = execute('hg', '-R', self.local, 'id', '--rev', revision, '--debug', '--id',
-                         capture=True).rstrip('+')
+        return self.parse_revision_id(self.run_command(
+            method_name='find_revision_id',
+            attribute_name='find_revision_id_command',
+            capture=True,
+            local=self.local,
+            revision=revision or self.default_revision,
+        ))
+
+    def parse_revision_id(self, output):
+        """
+        Parse the output of ``hg id --id``.
+
+        :param output: The output of :attr:`find_revision_id_command` (a string).
+        :returns: The revision id (a hexadecimal string).
+        """
+        result = output.rstrip('+')
         assert re.match('^[A-Fa-z0-9]+$', result), \
             "Failed to find global revision id! ('hg id --id' gave unexpected output)"
         return result
 
+    def parse_changed_files(self, output):
+        """
+        Parse the output of ``hg status --print0``.
+
+        Refer to :func:`Repository.find_changed_files()` for details.
+        """
+        removed, changed = [], []
+        for entry in filter(None, output.split('\0')):
+            status, filename = entry[:1], entry[2:]
+            (removed if status == 'R' else changed).append(filename)
+        return removed, changed
+
+    def export_files(self, directory, revision, filenames):
+        """
+        Export specific files from the local Mercurial repository.
+
+        Refer to :func:`Repository.export_files()` for the parameters. The
+        filenames are given to ``hg archive`` as ``--include=path:...``
+        patterns. The metadata file ``.hg_archival.txt`` (which identifies the
+        exported revision) is always included so that it's kept up to date.
+        """
+        filenames = ['.hg_archival.txt'] + list(filenames)
+        self.run_command(
+            method_name='export_files',
+            attribute_name='export_files_command',
+            local=self.local,
+            revision=revision,
+            directory=directory,
+            patterns=['--include=path:%s' % filename for filename in filenames],
+        )
+
+    @locked()
+    def find_tree_id(self, revision=None):
+        """
+        Find the id of the manifest of a revision.
+
+        Refer to :func:`Repository.find_tree_id()` for details.
+        """
+        self.create()
+        return self.parse_tree_id(self.run_command(
+            method_name='find_tree_id',
+            attribute_name='find_tree_id_command',
+            capture=True,
+            local=self.local,
+            revision=revision or self.default_revision,
+        ))
+
+    def parse_tree_id(self, output):
+        """
+        Parse the output of ``hg log --template={manifest} --debug``.
+
+        :param output: The output of :attr:`find_tree_id_command` (a string).
+        :returns: The manifest id (a hexadecimal string).
+        """
+        manifest_id = output.strip().rpartition(':')[2]
+        assert re.match('^[A-Fa-f0-9]+$', manifest_id), \
+            "Failed to find manifest id! ('hg log' gave unexpected output)"
+        return manifest_id
+
+    @locked()
+    def find_revision_numbers(self, revisions):
+        """
+        Find the revision numbers of multiple revision expressions.
+
+        :param revisions: An iterable of Mercurial specific revision
+                          expressions (strings).
+        :returns: A list of revision numbers (integers).
+
+        Refer to :func:`resolve_revisions()` for details.
+        """
+        return [revision_number for revision_number, revision_id in self.resolve_revisions(revisions)]
+
+    @locked()
+    def find_revision_ids(self, revisions):
+        """
+        Find the revision ids of multiple revision expressions.
+
+        :param revisions: An iterable of Mercurial specific revision
+                          expressions (strings).
+        :returns: A list of revision ids (hexadecimal strings).
+
+        Refer to :func:`resolve_revisions()` for details.
+        """
+        return [revision_id for revision_number, revision_id in self.resolve_revisions(revisions)]
+
+    def resolve_revisions(self, revisions):
+        """
+        Find the revision numbers and ids of multiple revision expressions.
+
+        :param revisions: An iterable of Mercurial specific revision
+                          expressions (strings).
+        :returns: A list of tuples with two values each: A revision number (an
+                  integer) and a revision id (a hexadecimal string).
+
+        All of the revisions are resolved using a single ``hg log`` command
+        whose template evaluates each revision expression separately (using
+        the ``revset()`` template function) and reports the matching
+        revisions on a separate line. Expressions that don't match exactly
+        one revision (or that can't be embedded in the template) are resolved
+        using :func:`find_revision_number()` and :func:`find_revision_id()`
+        instead.
+        """
+        self.create()
+        revisions = [revision or self.default_revision for revision in revisions]
+        unique_revisions = []
+        for revision in revisions:
+            if revision not in unique_revisions:
+                unique_revisions.append(revision)
+        mapping = {}
+        embeddable = [r for r in unique_revisions if "'" not in r and '\\' not in r]
+        if embeddable:
+            # Each line starts with the index of the expression because
+            # empty lines are lost when the output is stripped.
+            template = ''.join("%i {revset(r'%%r', r'%s') %% '{rev} {node} '}\\n" % (i, r)
+                               for i, r in enumerate(embeddable))
+            output = self.hg('log', '--rev=null', '--template', template, capture=True)
+            for line in output.splitlines():
+                tokens = line.split()
+                if len(tokens) == 3 and tokens[0].isdigit() and tokens[1].isdigit():
+                    mapping[embeddable[int(tokens[0])]] = (int(tokens[1]), tokens[2])
+        for revision in unique_revisions:
+            if revision not in mapping:
+                logger.debug("Resolving Mercurial revision %r separately ..", revision)
+                mapping[revision] = (self.find_revision_number(revision), self.find_revision_id(revision))
+        return [mapping[revision] for revision in revisions]
+
     def find_branches(self):
         """
         Find the branches in the Mercurial repository.
@@ -1863,8 +3821,29 @@ class HgRepo(Repository):
         :returns: A generator of :class:`Revision` objects.
 
         .. note:: Closed branches are not included.
+
+        When possible the branches are read from the branch cache using
+        :attr:`cache_reader`, otherwise ``hg branches`` is used (which also
+        refreshes the cache).
+        """
+        reader = self.cache_reader
+        branches = reader.find_branches() if reader else None
+        if branches is not None:
+            return (Revision(repository=self, revision_id=i, revision_number=r, branch=n) for n, i, r in branches)
+        return self.parse_branches(self.run_command(
+            method_name='find_branches',
+            attribute_name='find_branches_command',
+            capture=True,
+            local=self.local,
+        ))
+
+    def parse_branches(self, listing):
+        """
+        Parse the output of ``hg branches``.
+
+        :param listing: The output of :attr:`find_branches_command` (a string).
+        :returns: A generator of :class:`Revision` objects.
         """
-        listing = execute('hg', '-R', self.local, 'branches', capture=True)
         for line in listing.splitlines():
             tokens = line.split()
             if len(tokens) >= 2 and ':' in tokens[1]:
@@ -1878,9 +3857,30 @@ class HgRepo(Repository):
         """
         Find the tags in the Mercurial repository.
 
+        :returns: A generator of :class:`Revision` objects.
+
+        When possible the tags are read from the tags cache using
+        :attr:`cache_reader`, otherwise ``hg tags`` is used (which also
+        refreshes the cache).
+        """
+        reader = self.cache_reader
+        tags = reader.find_tags() if reader else None
+        if tags is not None:
+            return (Revision(repository=self, revision_id=i, revision_number=r, tag=n) for n, i, r in tags)
+        return self.parse_tags(self.run_command(
+            method_name='find_tags',
+            attribute_name='find_tags_command',
+            capture=True,
+            local=self.local,
+        ))
+
+    def parse_tags(self, listing):
+        """
+        Parse the output of ``hg tags``.
+
+        :param listing: The output of :attr:`find_tags_command` (a string).
         :returns: A generator of :class:`Revision` objects.
         """
-        listing = execute('hg', '-R', self.local, 'tags', capture=True)
         for line in listing.splitlines():
             tokens = line.split()
             if len(tokens) >= 2 and ':' in tokens[1]:
@@ -1896,17 +3896,53 @@ class GitRepo(Repository):
     """
     Version control repository interface for Git_ repositories.
 
+    Git supports several :attr:`~Repository.clone_strategy` values that
+    create local clones which don't contain the complete repository. When
+    the ``shallow`` or ``single-branch`` strategies are used:
+
+    - :func:`update()` only fetches the branches that exist in the local clone
+      (and keeps shallow clones shallow).
+    - :func:`create()` and :func:`update()` also fetch the release tags of the
+      remote repository when :attr:`~Repository.release_scheme` is ``tags``
+      (see :func:`find_release_tag_refspecs()`), so that
+      :attr:`~Repository.tags` and :attr:`~Repository.releases` are complete.
+    - :func:`export()`, :func:`find_revision_ids()` and related queries fetch
+      revisions that are missing from the local clone on demand (see
+      :func:`prepare_revisions()`).
+    - A shallow clone is converted to a complete clone the first time a
+      revision number is requested, because revision numbers can't be
+      calculated without the complete history of a branch (see
+      :func:`unshallow()`).
+
+    The ``partial`` strategy fetches file contents on demand, which git takes
+    care of transparently.
+
+    When :attr:`~Repository.shared_store` is set the shared store is a bare
+    git repository. The branches and tags of each remote repository are
+    fetched into their own namespace in the shared store (see
+    :func:`update_shared_store()`) and local clones are created using ``git
+    clone --reference`` so that they borrow objects from the shared store
+    (using ``objects/info/alternates``) instead of copying them. Because
+    local clones depend on the objects in the shared store, unreachable
+    objects in the shared store are never pruned by ``git gc``.
+
     .. _Git: http://git-scm.com/
     """
 
     ALIASES = ['git']
     """A list of strings with aliases/names for Git."""
 
+    CLONE_STRATEGIES = ('full', 'partial', 'shallow', 'single-branch')
+    """The clone strategies supported by git (a tuple of strings)."""
+
+    ARCHIVE_TYPES = {'tar': 'tar', 'tar.gz': 'tar.gz', 'zip': 'zip'}
+    """The archive formats supported by ``git archive --format`` (a dictionary)."""
+
     friendly_name = 'Git'
     control_field = 'Vcs-Git'
-    create_command = 'git clone --bare {remote} {local}'
-    create_command_non_bare = 'git clone {remote} {local}'
-    update_command = 'cd {local} && git fetch {remote} +refs/heads/*:refs/heads/*'
+    create_command = 'git clone --bare {clone_options} {remote} {local}'
+    create_command_non_bare = 'git clone {clone_options} {remote} {local}'
+    update_command = 'cd {local} && git fetch {remote} {update_options}'
     push_command = 'cd {local} && git push {remote} && git push --tags {remote}'
     checkout_command = 'cd {local} && git checkout {revision}'
     checkout_command_clean = 'cd {local} && git checkout . && git checkout {revision}'
@@ -1927,6 +3963,18 @@ class GitRepo(Repository):
             commit --all --message {message}
     ''')
     export_command = 'cd {local} && git archive {revision} | tar --extract --directory={directory}'
+    export_archive_command = 'cd {local} && git archive --format={archive_type} {revision}'
+    export_files_command = compact('''
+        cd {local} && git --literal-pathspecs archive {revision} -- {filenames}
+            | tar --extract --directory={directory}
+    ''')
+    find_changed_files_command = 'cd {local} && git diff --name-status --no-renames -z {old_revision} {new_revision}'
+    find_revision_ids_command = 'cd {local} && git rev-parse {revisions}'
+    find_tree_id_command = 'cd {local} && git rev-parse {revision_id}^{{tree}}'
+    count_revisions_command = 'cd {local} && git rev-list {revision_id} --count'
+    remote_refs_command = 'cd {local} && git ls-remote --heads --tags {remote}'
+    find_branches_command = 'cd {local} && git branch --list --verbose'
+    find_tags_command = 'cd {local} && git show-ref --tags'
 
     @staticmethod
     def get_vcs_directory(directory):
@@ -1956,6 +4004,36 @@ class GitRepo(Repository):
         """
         return os.path.isfile(os.path.join(cls.get_vcs_directory(directory), 'config'))
 
+    @property
+    def ref_reader(self):
+        """
+        The pure Python reader for the branches and tags in the git repository.
+
+        A :class:`~vcs_repo_mgr.native.GitRefReader` object or :data:`None`
+        when :attr:`~Repository.native_refs` is disabled or the repository
+        format isn't supported by :class:`~vcs_repo_mgr.native.GitRefReader`.
+        """
+        if self.native_refs:
+            from vcs_repo_mgr.native import GitRefReader
+            reader = GitRefReader(self.vcs_directory)
+            if reader.is_supported:
+                return reader
+
+    @lazy_property
+    def cat_file(self):
+        """
+        The long running ``git cat-file`` process (a :class:`~vcs_repo_mgr.coprocesses.GitCatFile` object).
+
+        This is only used when :attr:`~Repository.coprocess` is enabled. The
+        process is started when the first query is made.
+        """
+        from vcs_repo_mgr.coprocesses import GitCatFile
+        return GitCatFile(directory=self.local)
+
+    def close(self):
+        """Terminate the long running ``git cat-file`` process (if it's running)."""
+        self.cat_file.close()
+
     @writable_property(cached=True)
     def author(self):
         """
@@ -2035,41 +4113,624 @@ class GitRepo(Repository):
         listing = execute('git', 'diff', 'HEAD', capture=True, directory=self.local)
         return len(listing.splitlines()) == 0
 
-    def find_revision_number(self, revision=None):
+    @property
+    def is_shallow(self):
+        """:data:`True` if the local clone is a shallow clone, :data:`False` otherwise."""
+        return os.path.isfile(os.path.join(self.vcs_directory, 'shallow'))
+
+    @property
+    def tracked_branches(self):
         """
-        Find the revision number of the given revision expression.
+        The branches that are fetched by :func:`update()` (a list of strings or :data:`None`).
 
-        :param revision: A git specific revision expression (a string).
-        :returns: The revision number (an integer).
+        When :attr:`~Repository.clone_strategy` is ``shallow`` or
+        ``single-branch`` this is a list with the names of the branches that
+        exist in the local clone, otherwise it's :data:`None` (which means
+        all branches are fetched).
+        """
+        if self.clone_strategy in ('shallow', 'single-branch') and self.exists:
+            return sorted(self.find_branch_tips())
+
+    @property
+    def clone_options(self):
+        """
+        The command line arguments for ``git clone`` that implement :attr:`~Repository.clone_strategy`.
+
+        When :attr:`~Repository.shared_store` is set ``--reference`` is
+        included as well.
+        """
+        options = []
+        if self.clone_strategy == 'partial':
+            options.append('--filter=blob:none')
+        elif self.clone_strategy == 'shallow':
+            options.append('--depth=%i' % self.clone_depth)
+        elif self.clone_strategy == 'single-branch':
+            options.append('--single-branch')
+        if self.shared_store:
+            options.append('--reference=%s' % self.shared_store)
+        return options
+
+    @property
+    def update_options(self):
+        """The command line arguments for ``git fetch`` that implement :attr:`~Repository.clone_strategy`."""
+        options = []
+        if self.clone_strategy == 'partial':
+            options.append('--filter=blob:none')
+        elif self.clone_strategy == 'shallow' and self.is_shallow:
+            options.append('--depth=%i' % self.clone_depth)
+        branches = self.tracked_branches
+        if branches is None:
+            options.append('+refs/heads/*:refs/heads/*')
+        else:
+            options.extend('+refs/heads/%s:refs/heads/%s' % (name, name) for name in branches)
+        return options
+
+    def get_update_options(self, remote):
+        """
+        Get the command line arguments for ``git fetch``.
+
+        Refer to :func:`Repository.get_update_options()` for the parameters
+        and return value. When :attr:`tracked_branches` isn't :data:`None`
+        the result of :func:`find_release_tag_refspecs()` is included.
+        """
+        options = self.update_options
+        if self.tracked_branches is not None:
+            options = options + self.find_release_tag_refspecs(remote)
+        return options
+
+    def find_release_tag_refspecs(self, remote=None):
+        """
+        Find the refspecs that fetch the release tags of a remote repository.
+
+        :param remote: Overrides the value of :attr:`~Repository.remote` for
+                       the duration of the call to
+                       :func:`find_release_tag_refspecs()`.
+        :returns: A list of strings (empty when
+                  :attr:`~Repository.release_scheme` isn't ``tags``).
+
+        When :attr:`~Repository.release_filter` matches every tag (the default)
+        a single wildcard refspec is used, otherwise the tags that match the
+        filter are found using ``git ls-remote --tags`` and fetched by name.
+        """
+        if self.release_scheme != 'tags':
+            return []
+        if self.compiled_filter.pattern == '.*':
+            return ['+refs/tags/*:refs/tags/*']
+        listing = execute('git', 'ls-remote', '--tags', remote or self.remote, capture=True)
+        tags = set()
+        for line in listing.splitlines():
+            tokens = line.split()
+            if len(tokens) == 2 and tokens[1].startswith('refs/tags/') and not tokens[1].endswith('^{}'):
+                tag = tokens[1][len('refs/tags/'):]
+                if self.is_release_tag(tag):
+                    tags.add(tag)
+        return ['+refs/tags/%s:refs/tags/%s' % (tag, tag) for tag in sorted(tags)]
+
+    def is_release_tag(self, tag):
+        """
+        Check whether a tag signifies a release.
+
+        :param tag: The name of a tag (a string).
+        :returns: :data:`True` if :attr:`~Repository.release_scheme` is
+                  ``tags`` and the tag matches
+                  :attr:`~Repository.release_filter`, :data:`False` otherwise.
+        """
+        return self.release_scheme == 'tags' and bool(self.compiled_filter.match(tag))
+
+    @property
+    def ref_files(self):
+        """
+        The pathnames of the files and directories that store branches and tags (a list of strings).
+
+        This includes the ``packed-refs`` file and the ``refs/heads`` and
+        ``refs/tags`` directories including their subdirectories. Git updates
+        loose references by renaming lock files which changes the modification
+        time of the directory containing the reference.
+        """
+        directories = []
+        for name in 'heads', 'tags':
+            for root, dirs, files in os.walk(os.path.join(self.vcs_directory, 'refs', name)):
+                directories.append(root)
+        return [os.path.join(self.vcs_directory, 'packed-refs')] + sorted(directories)
+
+    def update(self, remote=None):
+        """
+        Update the local clone of the remote git repository.
+
+        :param remote: Overrides the value of :attr:`~Repository.remote` for
+                       the duration of the call to :func:`update()`.
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        In addition to what :func:`Repository.update()` does this updates
+        :attr:`~Repository.revision_numbers` incrementally: When a branch
+        moves forward and the revision number of its previous tip is known,
+        the revision number of the new tip is calculated by counting only the
+        new commits (instead of the complete history of the branch).
+        """
+        old_tips = self.find_branch_tips() if self.exists and self.revision_numbers.exists else {}
+        super(GitRepo, self).update(remote=remote)
+        if old_tips:
+            known_numbers = self.revision_numbers.get_many(old_tips.values())
+            new_numbers = {}
+            for branch_name, revision_id in self.find_branch_tips().items():
+                old_id = old_tips.get(branch_name)
+                if old_id in known_numbers and old_id != revision_id:
+                    # Count the commits that are only reachable from one side.
+                    output = execute('git', 'rev-list', '--left-right', '--count', '%s...%s' % (old_id, revision_id),
+                                     capture=True, directory=self.local)
+                    tokens = output.split()
+                    if len(tokens) == 2 and all(t.isdigit() for t in tokens) and int(tokens[0]) == 0:
+                        # The old tip is an ancestor of the new tip.
+                        new_numbers[revision_id] = known_numbers[old_id] + int(tokens[1])
+            self.revision_numbers.update(new_numbers)
+
+    def create(self, remote=None):
+        """
+        Create the local clone of the remote git repository.
+
+        Refer to :func:`Repository.create()` for the parameters and return
+        value. When :attr:`~Repository.shared_store` is set the remote
+        repository is fetched into the shared store first (see
+        :func:`update_shared_store()`).
+        """
+        if self.shared_store and not self.exists:
+            self.update_shared_store(remote=remote)
+        return super(GitRepo, self).create(remote=remote)
+
+    def create_clone(self, remote, directory):
+        """
+        Clone the remote git repository into a staging directory.
+
+        Refer to :func:`Repository.create_clone()` for the parameters. Because
+        ``shallow`` and ``single-branch`` clones only contain the tags in the
+        history of the cloned branch, the release tags of the remote
+        repository are fetched afterwards (see :func:`fetch_release_tags()`).
+        """
+        super(GitRepo, self).create_clone(remote, directory)
+        self.fetch_release_tags(remote, directory)
+
+    def fetch_release_tags(self, remote, directory):
+        """
+        Fetch the release tags of a remote repository into a new clone.
+
+        :param remote: The location of the remote repository (a string).
+        :param directory: The pathname of the clone (a string).
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        Only ``shallow`` and ``single-branch`` clones are affected (in
+        shallow clones only the most recent :attr:`~Repository.clone_depth`
+        commits of each release are fetched).
+        """
+        if self.clone_strategy in ('shallow', 'single-branch'):
+            refspecs = self.find_release_tag_refspecs(remote)
+            if refspecs:
+                options = ['--depth=%i' % self.clone_depth] if self.clone_strategy == 'shallow' else []
+                execute('git', 'fetch', '--quiet', remote, *(options + refspecs), directory=directory)
+
+    def update_shared_store(self, remote=None):
+        """
+        Fetch the branches and tags of a remote repository into :attr:`~Repository.shared_store`.
+
+        :param remote: Overrides the value of :attr:`~Repository.remote` for
+                       the duration of the call to :func:`update_shared_store()`.
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        The shared store is created when it doesn't exist yet. The references
+        of each remote repository are stored under ``refs/remotes/<id>/``
+        where ``<id>`` is derived from the location of the remote repository,
+        so that related remote repositories don't overwrite each other's
+        branches and tags (while sharing the objects they have in common).
+        """
+        remote = remote or self.remote
+        store = self.shared_store
+        if not os.path.isdir(store):
+            logger.info("Creating shared git store at %s ..", format_path(store))
+            execute('git', 'init', '--quiet', '--bare', store)
+            execute('git', 'config', 'gc.pruneExpire', 'never', directory=store)
+        namespace = 'refs/remotes/%s' % hashlib.sha1(remote.encode('UTF-8')).hexdigest()
+        logger.info("Fetching %s into shared git store at %s ..", remote, format_path(store))
+        execute('git', 'fetch', '--quiet', remote,
+                '+refs/heads/*:%s/heads/*' % namespace,
+                '+refs/tags/*:%s/tags/*' % namespace,
+                directory=store)
+
+    @locked(prepare=lambda self, directory, revision=None: self.prepare_revisions([revision]))
+    def export(self, directory, revision=None):
+        """
+        Export the complete tree from the local git repository.
+
+        Refer to :func:`Repository.export()` for the parameters. Revisions
+        that are missing from ``shallow`` and ``single-branch`` clones are
+        fetched before the shared lock is taken (see
+        :func:`prepare_revisions()`).
+        """
+        super(GitRepo, self).export(directory, revision=revision)
+
+    def prepare_revisions(self, revisions, count=False):
+        """
+        Prepare the local clone for queries about the given revisions.
+
+        :param revisions: An iterable of references to revisions (strings,
+                          :data:`None` is replaced by
+                          :attr:`~Repository.default_revision`).
+        :param count: :data:`True` when the revision numbers of the revisions
+                      will be requested, :data:`False` otherwise.
+
+        Revisions that are missing from ``shallow`` and ``single-branch``
+        clones are fetched using :func:`fetch_revision()` and when `count` is
+        :data:`True` and a revision number isn't known yet, a shallow clone
+        is converted to a complete clone using :func:`unshallow()`. This
+        happens before queries take their shared lock (see :func:`locked()`)
+        so that changing the local clone doesn't require converting a shared
+        lock held by the query.
         """
         self.create()
-        revision = revision or self.default_revision
-        result = execute('git', 'rev-list', revision, '--count', capture=True, directory=self.local)
-        assert result and result.isdigit(), \
+        if self.remote and self.clone_strategy in ('shallow', 'single-branch'):
+            revisions = [revision or self.default_revision for revision in revisions]
+            for revision in self.find_missing_revisions(sorted(set(revisions))):
+                self.fetch_revision(revision)
+            if count and self.is_shallow:
+                revision_ids = self.resolve_revision_ids(revisions)
+                if len(self.revision_numbers.get_many(revision_ids)) < len(set(revision_ids)):
+                    self.unshallow()
+
+    def fetch_revision(self, revision):
+        """
+        Fetch a revision that's missing from the local clone.
+
+        :param revision: The name of a branch or tag or a global revision id
+                         (a string).
+        :returns: :data:`True` if the revision was fetched, :data:`False` if
+                  it was already available (or there's no remote).
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+
+        Branches and tags are fetched under their own name so that they can
+        be used afterwards. In shallow clones only the most recent
+        :attr:`~Repository.clone_depth` commits of the revision are fetched.
+        The fetch holds an exclusive :func:`~Repository.lock()` on the local
+        clone, so it shouldn't be called while holding a shared lock (refer
+        to :func:`prepare_revisions()`).
+        """
+        if not self.remote or self.has_revision(revision):
+            return False
+        with self.lock(exclusive=True):
+            if self.has_revision(revision):
+                # Another process or thread fetched the
+                # revision while we were waiting for the lock.
+                return False
+            logger.info("Fetching revision %s from %s into %s ..", revision, self.remote, format_path(self.local))
+            listing = execute('git', 'ls-remote', self.remote, revision, capture=True, directory=self.local)
+            refspecs = []
+            for line in listing.splitlines():
+                tokens = line.split()
+                if len(tokens) == 2 and tokens[1] in ('refs/heads/%s' % revision, 'refs/tags/%s' % revision):
+                    refspecs.append('+%s:%s' % (tokens[1], tokens[1]))
+            options = ['--depth=%i' % self.clone_depth] if self.is_shallow else []
+            execute('git', 'fetch', self.remote, *(options + (refspecs or [revision])), directory=self.local)
+            self.invalidate_ref_snapshot()
+            return True
+
+    def has_revision(self, revision):
+        """
+        Check whether a revision is available in the local clone.
+
+        :param revision: The name of a branch or tag or a global revision id
+                         (a string).
+        :returns: :data:`True` if the revision refers to a commit in the local
+                  clone, :data:`False` otherwise.
+        """
+        return not self.find_missing_revisions([revision])
+
+    def find_missing_revisions(self, revisions):
+        """
+        Find the revisions that aren't available in the local clone.
+
+        :param revisions: A list of branch or tag names or global revision
+                          ids (strings).
+        :returns: The revisions that don't refer to a commit in the local
+                  clone (a list of strings).
+
+        All of the revisions are checked using a single ``git cat-file
+        --batch-check`` command (or :attr:`cat_file` when
+        :attr:`~Repository.coprocess` is enabled).
+        """
+        names = ['%s^{commit}' % revision for revision in revisions]
+        if not names:
+            return []
+        if self.coprocess:
+            results = self.cat_file.resolve(names)
+        else:
+            output = execute('git', 'cat-file', '--batch-check', input=''.join('%s\n' % n for n in names),
+                             capture=True, directory=self.local)
+            # Successful lookups are reported as `<id> <type> <size>'
+            # while failures are reported as `<name> missing'.
+            results = [tokens[0] if len(tokens) == 3 and tokens[2].isdigit() else None
+                       for tokens in (line.split() for line in output.splitlines())]
+        return [revision for revision, result in zip(revisions, results) if not result]
+
+    def find_branch_tips(self):
+        """
+        Find the global revision ids of the branch tips in the git repository.
+
+        :returns: A dictionary with branch names (strings) as keys and global
+                  revision ids (strings) as values.
+        """
+        listing = execute('git', 'for-each-ref', '--format=%(objectname) %(refname)', 'refs/heads',
+                          capture=True, directory=self.local)
+        tips = {}
+        for line in listing.splitlines():
+            revision_id, _, ref_name = line.partition(' ')
+            if ref_name.startswith('refs/heads/'):
+                tips[ref_name[len('refs/heads/'):]] = revision_id
+        return tips
+
+    def count_revisions(self, revision_id):
+        """
+        Calculate the revision number of the given revision.
+
+        :param revision_id: A global revision id (a string).
+        :returns: The revision number (an integer).
+
+        Shallow clones are converted to complete clones first (see
+        :func:`unshallow()`, this normally already happened in
+        :func:`prepare_revisions()`).
+        """
+        self.unshallow()
+        return self.parse_revision_count(self.run_command(
+            method_name='count_revisions',
+            attribute_name='count_revisions_command',
+            capture=True,
+            local=self.local,
+            revision_id=revision_id,
+        ))
+
+    def unshallow(self):
+        """
+        Convert a shallow clone to a complete clone.
+
+        :returns: :data:`True` if the clone was converted, :data:`False`
+                  otherwise.
+
+        The history is fetched while holding an exclusive
+        :func:`~Repository.lock()` on the local clone.
+        """
+        if not (self.is_shallow and self.remote):
+            return False
+        with self.lock(exclusive=True):
+            # Another process or thread may have converted the
+            # clone while we were waiting for the lock.
+            if not self.is_shallow:
+                return False
+            logger.info("Fetching complete history of shallow clone %s (needed to count revisions) ..",
+                        format_path(self.local))
+            options = [o for o in self.update_options if not o.startswith('--depth=')]
+            execute('git', 'fetch', '--unshallow', self.remote, *options, directory=self.local)
+            self.invalidate_ref_snapshot()
+            return True
+
+    def parse_revision_count(self, output):
+        """
+        Parse the output of ``git rev-list --count``.
+
+        :param output: The output of :attr:`count_revisions_command` (a string).
+        :returns: The revision number (an integer).
+        """
+        assert output and output.isdigit(), \
             "Failed to find local revision number! ('git rev-list --count' gave unexpected output)"
-        return int(result)
+        return int(output)
+
+    def find_local_refs(self):
+        """
+        Find the branches and tags in the local git repository.
 
+        :returns: A dictionary with reference names like ``refs/heads/master``
+                  as keys and global revision ids (strings) as values (the ids
+                  of annotated tags are the ids of the tag objects, just like
+                  ``git ls-remote`` reports them).
+        """
+        reader = self.ref_reader
+        if reader:
+            return dict(('%s%s' % (namespace, name), object_id)
+                        for namespace in ('refs/heads/', 'refs/tags/')
+                        for name, object_id in reader.find_refs(namespace))
+        listing = execute('git', 'for-each-ref', '--format=%(objectname) %(refname)', 'refs/heads', 'refs/tags',
+                          capture=True, directory=self.local)
+        refs = {}
+        for line in listing.splitlines():
+            revision_id, _, ref_name = line.partition(' ')
+            if ref_name:
+                refs[ref_name] = revision_id
+        return refs
+
+    def parse_remote_refs(self, listing):
+        """
+        Parse the output of ``git ls-remote``.
+
+        :param listing: The output of :attr:`remote_refs_command` (a string).
+        :returns: A dictionary in the format of :func:`find_local_refs()`
+                  (peeled tags are ignored).
+
+        When :attr:`tracked_branches` isn't :data:`None` branches that aren't
+        tracked and tags that don't exist in the local clone are ignored as
+        well, because :func:`update()` doesn't fetch them (missing tags are
+        fetched on demand instead). Release tags (see :func:`is_release_tag()`)
+        are never ignored because :func:`update()` does fetch them.
+        """
+        branches = self.tracked_branches
+        local_refs = self.find_local_refs() if branches is not None else {}
+        refs = {}
+        for line in listing.splitlines():
+            tokens = line.split()
+            if len(tokens) == 2 and not tokens[1].endswith('^{}'):
+                revision_id, ref_name = tokens
+                if branches is not None:
+                    if ref_name.startswith('refs/heads/') and ref_name[len('refs/heads/'):] not in branches:
+                        continue
+                    if ref_name.startswith('refs/tags/') and ref_name not in local_refs:
+                        if not self.is_release_tag(ref_name[len('refs/tags/'):]):
+                            continue
+                refs[ref_name] = revision_id
+        return refs
+
+    @locked(prepare=lambda self, revision=None: self.prepare_revisions([revision]))
     def find_revision_id(self, revision=None):
         """
         Find the revision id of the given revision expression.
 
         :param revision: A git specific revision expression (a string).
         :returns: The revision id (a hexadecimal string).
+
+        This is a shortcut for :func:`find_revision_ids()` that resolves a
+        single revision.
         """
         self.create()
-        revision = revision or self.default_revision
-        result = execute('git', 'rev-parse', revision, capture=True, directory=self.local)
-        assert re.match('^[A-Fa-z0-9]+$', result), \
+        return self.resolve_revision_ids([revision])[0]
+
+    @locked(prepare=lambda self, revision=None: self.prepare_revisions([revision], count=True))
+    def find_revision_number(self, revision=None):
+        """
+        Find the local revision number of the given revision.
+
+        Refer to :func:`Repository.find_revision_number()` for details.
+        """
+        return super(GitRepo, self).find_revision_numbers([revision])[0]
+
+    @locked(prepare=lambda self, revisions: self.prepare_revisions(revisions, count=True))
+    def find_revision_numbers(self, revisions):
+        """
+        Find the local revision numbers of multiple revisions.
+
+        Refer to :func:`Repository.find_revision_numbers()` for details.
+        """
+        return super(GitRepo, self).find_revision_numbers(revisions)
+
+    @locked(prepare=lambda self, revisions: self.prepare_revisions(revisions))
+    def find_revision_ids(self, revisions):
+        """
+        Find the revision ids of multiple revision expressions.
+
+        Refer to :func:`resolve_revision_ids()` for details. Revisions that
+        are missing from ``shallow`` and ``single-branch`` clones are fetched
+        first (see :func:`prepare_revisions()`).
+        """
+        self.create()
+        return self.resolve_revision_ids(revisions)
+
+    @locked()
+    def resolve_revision_ids(self, revisions):
+        """
+        Find the revision ids of multiple revision expressions.
+
+        :param revisions: An iterable of git specific revision expressions
+                          (strings).
+        :returns: A list of revision ids (hexadecimal strings).
+
+        All of the revisions are resolved using a single ``git rev-parse``
+        command. Complete (40 character) revision ids are passed to ``git
+        rev-parse`` with the suffix ``^{object}`` because otherwise they
+        would be echoed back unchanged without checking that they exist.
+        When :attr:`~Repository.coprocess` is enabled the revisions are
+        resolved using :attr:`cat_file` instead (``git rev-parse`` is still
+        used for revisions that ``git cat-file`` doesn't understand, like
+        revision ranges).
+        """
+        revisions = [revision or self.default_revision for revision in revisions]
+        unresolved = []
+        for revision in revisions:
+            if revision not in unresolved:
+                unresolved.append(revision)
+        mapping = {}
+        if unresolved and self.coprocess:
+            for revision, revision_id in zip(unresolved, self.cat_file.resolve(unresolved)):
+                if revision_id:
+                    mapping[revision] = revision_id
+            unresolved = [revision for revision in unresolved if revision not in mapping]
+        if unresolved:
+            expressions = [revision + '^{object}' if FULL_GIT_REVISION_ID.match(revision) else revision
+                           for revision in unresolved]
+            mapping.update(zip(unresolved, self.parse_revision_ids(expressions, self.run_command(
+                method_name='find_revision_ids',
+                attribute_name='find_revision_ids_command',
+                capture=True,
+                local=self.local,
+                revisions=expressions,
+            ))))
+        return [mapping[revision] for revision in revisions]
+
+    def parse_changed_files(self, output):
+        """
+        Parse the output of ``git diff --name-status -z``.
+
+        Refer to :func:`Repository.find_changed_files()` for details.
+        """
+        removed, changed = [], []
+        tokens = output.split('\0')
+        for status, filename in zip(tokens[0::2], tokens[1::2]):
+            (removed if status == 'D' else changed).append(filename)
+        return removed, changed
+
+    @locked(prepare=lambda self, revision=None: self.prepare_revisions([revision]))
+    def find_tree_id(self, revision=None):
+        """
+        Find the id of the tree of a revision.
+
+        Refer to :func:`Repository.find_tree_id()` for details. When
+        :attr:`~Repository.coprocess` is enabled the tree id is resolved using
+        :attr:`cat_file`.
+        """
+        revision_id = self.find_revision_id(revision)
+        if self.coprocess:
+            tree_id = self.cat_file.resolve(['%s^{tree}' % revision_id])[0]
+            if tree_id:
+                return tree_id
+        return self.parse_revision_ids([revision_id], self.run_command(
+            method_name='find_tree_id',
+            attribute_name='find_tree_id_command',
+            capture=True,
+            local=self.local,
+            revision_id=revision_id,
+        ))[0]
+
+    def parse_revision_ids(self, revisions, output):
+        """
+        Parse the output of ``git rev-parse``.
+
+        :param revisions: The revision expressions that were given to ``git
+                          rev-parse`` (a list of strings).
+        :param output: The output of :attr:`find_revision_ids_command` (a string).
+        :returns: A list of revision ids (hexadecimal strings).
+        """
+        results = output.split()
+        assert len(results) == len(revisions) and all(re.match('^[A-Fa-z0-9]+$', r) for r in results), \
             "Failed to find global revision id! ('git rev-parse' gave unexpected output)"
-        return result
+        return results
 
     def find_branches(self):
         """
         Find the branches in the git repository.
 
+        :returns: A generator of :class:`Revision` objects.
+
+        When possible the branches are read using :attr:`ref_reader`,
+        otherwise ``git branch`` is used.
+        """
+        reader = self.ref_reader
+        if reader:
+            return (Revision(repository=self, revision_id=i, branch=n) for n, i in reader.find_refs('refs/heads/'))
+        return self.parse_branches(self.run_command(
+            method_name='find_branches',
+            attribute_name='find_branches_command',
+            capture=True,
+            local=self.local,
+        ))
+
+    def parse_branches(self, listing):
+        """
+        Parse the output of ``git branch --list --verbose``.
+
+        :param listing: The output of :attr:`find_branches_command` (a string).
         :returns: A generator of :class:`Revision` objects.
         """
-        listing = execute('git', 'branch', '--list', '--verbose', capture=True, directory=self.local)
         for line in listing.splitlines():
             line = line.lstrip('*').strip()
             if not line.startswith('(no branch)'):
@@ -2083,9 +4744,28 @@ class GitRepo(Repository):
         """
         Find the tags in the git repository.
 
+        :returns: A generator of :class:`Revision` objects.
+
+        When possible the tags are read using :attr:`ref_reader`, otherwise
+        ``git show-ref`` is used.
+        """
+        reader = self.ref_reader
+        if reader:
+            return (Revision(repository=self, revision_id=i, tag=n) for n, i in reader.find_refs('refs/tags/'))
+        return self.parse_tags(self.run_command(
+            method_name='find_tags',
+            attribute_name='find_tags_command',
+            capture=True,
+            local=self.local,
+        ))
+
+    def parse_tags(self, listing):
+        """
+        Parse the output of ``git show-ref --tags``.
+
+        :param listing: The output of :attr:`find_tags_command` (a string).
         :returns: A generator of :class:`Revision` objects.
         """
-        listing = execute('git', 'show-ref', '--tags', capture=True, directory=self.local)
         for line in listing.splitlines():
             tokens = line.split()
             if len(tokens) >= 2 and tokens[1].startswith('refs/tags/'):
@@ -2105,6 +4785,9 @@ class BzrRepo(Repository):
     ALIASES = ['bzr', 'bazaar']
     """A list of strings with aliases/names for Bazaar."""
 
+    ARCHIVE_TYPES = {'tar': 'tar', 'tar.gz': 'tgz'}
+    """The archive formats supported by ``bzr export --format`` (a dictionary)."""
+
     friendly_name = 'Bazaar'
     control_field = 'Vcs-Bzr'
     create_command = 'bzr branch --no-tree --use-existing-dir {remote} {local}'
@@ -2112,6 +4795,15 @@ class BzrRepo(Repository):
     update_command = 'cd {local} && bzr pull {remote}'
     push_command = 'cd {local} && bzr push {remote}'
     export_command = 'cd {local} && bzr export --revision={revision} {directory}'
+    export_archive_command = 'cd {local} && bzr export --revision={revision} --format={archive_type} --root= -'
+    find_revision_id_command = compact('''
+        cd {local} && bzr version-info --revision={revision}
+            --custom --template={{revision_id}}
+    ''')
+    count_revisions_command = 'cd {local} && bzr log --revision=..revid:{revision_id} --line'
+    remote_refs_command = 'cd {local} && bzr revision-info --directory={remote}'
+    find_tags_command = 'cd {local} && bzr tags'
+    find_tag_ids_command = 'cd {local} && bzr tags --show-ids'
 
     @staticmethod
     def get_vcs_directory(directory):
@@ -2161,11 +4853,19 @@ class BzrRepo(Repository):
         listing = execute('bzr', 'diff', check=False, capture=True, directory=self.local)
         return len(listing.splitlines()) == 0
 
-    def find_revision_number(self, revision=None):
+    @property
+    def ref_files(self):
+        """The pathnames of the ``.bzr/branch/last-revision`` and ``.bzr/branch/tags`` files (a list of strings)."""
+        return [
+            os.path.join(self.vcs_directory, 'branch', 'last-revision'),
+            os.path.join(self.vcs_directory, 'branch', 'tags'),
+        ]
+
+    def count_revisions(self, revision_id):
         """
-        Find the revision number of the given revision expression.
+        Calculate the revision number of the given revision.
 
-        :param revision: A Bazaar specific revision expression (a string).
+        :param revision_id: A global revision id (a string).
         :returns: The revision number (an integer).
 
         .. note:: Bazaar has the concept of dotted revision numbers:
@@ -2187,13 +4887,45 @@ class BzrRepo(Repository):
                   should increase as new commits are made. Below is the
                   equivalent of the git implementation for Bazaar.
         """
-        self.create()
-        revision = revision or self.default_revision
-        result = execute('bzr', 'log', '--revision=..%s' % revision, '--line', capture=True, directory=self.local)
-        revision_number = len([line for line in result.splitlines() if line and not line.isspace()])
+        return self.parse_revision_count(self.run_command(
+            method_name='count_revisions',
+            attribute_name='count_revisions_command',
+            capture=True,
+            local=self.local,
+            revision_id=revision_id,
+        ))
+
+    def parse_revision_count(self, output):
+        """
+        Parse the output of ``bzr log --line``.
+
+        :param output: The output of :attr:`count_revisions_command` (a string).
+        :returns: The revision number (an integer).
+        """
+        revision_number = len([line for line in output.splitlines() if line and not line.isspace()])
         assert revision_number > 0, "Failed to find local revision number! ('bzr log --line' gave unexpected output)"
         return revision_number
 
+    def find_local_refs(self):
+        """
+        Find the tip of the local Bazaar branch.
+
+        :returns: A dictionary with the key ``tip`` and the global revision id
+                  of the tip as value.
+        """
+        return self.parse_remote_refs(execute('bzr', 'revision-info', capture=True, directory=self.local))
+
+    def parse_remote_refs(self, listing):
+        """
+        Parse the output of ``bzr revision-info``.
+
+        :param listing: The output of :attr:`remote_refs_command` (a string).
+        :returns: A dictionary in the format of :func:`find_local_refs()`.
+        """
+        tokens = listing.split()
+        return dict(tip=tokens[1] if len(tokens) == 2 else listing.strip())
+
+    @locked()
     def find_revision_id(self, revision=None):
         """
         Find the revision id of the given revision expression.
@@ -2202,12 +4934,24 @@ class BzrRepo(Repository):
         :returns: The revision id (a hexadecimal string).
         """
         self.create()
-        revision = revision or self.default_revision
-        result = execute('bzr', 'version-info', '--revision=%s' % revision, '--custom', '--template={revision_id}',
-                         capture=True, directory=self.local)
-        logger.debug("Output of 'bzr version-info' command: %s", result)
-        assert result, "Failed to find global revision id! ('bzr version-info' gave unexpected output)"
-        return result
+        return self.parse_revision_id(self.run_command(
+            method_name='find_revision_id',
+            attribute_name='find_revision_id_command',
+            capture=True,
+            local=self.local,
+            revision=revision or self.default_revision,
+        ))
+
+    def parse_revision_id(self, output):
+        """
+        Parse the output of ``bzr version-info``.
+
+        :param output: The output of :attr:`find_revision_id_command` (a string).
+        :returns: The revision id (a string).
+        """
+        logger.debug("Output of 'bzr version-info' command: %s", output)
+        assert output, "Failed to find global revision id! ('bzr version-info' gave unexpected output)"
+        return output
 
     def find_branches(self):
         """
@@ -2232,14 +4976,35 @@ class BzrRepo(Repository):
                   pointing to non-existing revisions. We combine the output of
                   both because we want all the information.
         """
+        return self.parse_tags(
+            self.run_command(
+                method_name='find_tags',
+                attribute_name='find_tags_command',
+                capture=True,
+                local=self.local,
+            ),
+            self.run_command(
+                method_name='find_tags',
+                attribute_name='find_tag_ids_command',
+                capture=True,
+                local=self.local,
+            ),
+        )
+
+    def parse_tags(self, listing, listing_with_ids):
+        """
+        Parse the output of ``bzr tags`` and ``bzr tags --show-ids``.
+
+        :param listing: The output of :attr:`find_tags_command` (a string).
+        :param listing_with_ids: The output of :attr:`find_tag_ids_command` (a string).
+        :returns: A generator of :class:`Revision` objects.
+        """
         valid_tags = []
-        listing = execute('bzr', 'tags', capture=True, directory=self.local)
         for line in listing.splitlines():
             tokens = line.split()
             if len(tokens) == 2 and tokens[1] != '?':
                 valid_tags.append(tokens[0])
-        listing = execute('bzr', 'tags', '--show-ids', capture=True, directory=self.local)
-        for line in listing.splitlines():
+        for line in listing_with_ids.splitlines():
             tokens = line.split()
             if len(tokens) == 2 and tokens[0] in valid_tags:
                 tag, revision_id = tokens
@@ -0,0 +1,636 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Asynchronous (:mod:`asyncio` based) repository interface.
+
+The methods of the :class:`~vcs_repo_mgr.Repository` classes block the
+calling thread while they wait for external commands to finish. This module
+provides an asynchronous interface on top of the same command templates and
+output parsers that runs the external commands using
+:func:`asyncio.create_subprocess_exec()` (or
+:func:`asyncio.create_subprocess_shell()` for commands that need a shell), so
+that many repository queries can be in flight at the same time without using
+threads:
+
+.. code-block:: python
+
+   import asyncio
+   from vcs_repo_mgr.aio import coerce_async_repository
+
+   async def main():
+       repository = coerce_async_repository('~/projects/vcs-repo-mgr')
+       await repository.update()
+       print(await repository.find_revision_id('master'))
+
+   asyncio.get_event_loop().run_until_complete(main())
+
+.. note:: This module requires Python 3.5 or newer. It's not imported by the
+          :mod:`vcs_repo_mgr` module so that the rest of the package remains
+          compatible with older Python versions.
+"""
+
+# Standard library modules.
+import asyncio
+import logging
+import os
+import re
+import shlex
+import shutil
+
+# External dependencies.
+from executor import ExternalCommand, ExternalCommandFailed, quote
+from humanfriendly import Timer
+from humanfriendly.text import concatenate
+
+# Modules included in our package.
+from vcs_repo_mgr import FULL_GIT_REVISION_ID, UPDATE_VARIABLE, BzrRepo, GitRepo, HgRepo, Repository, coerce_repository
+from vcs_repo_mgr.locking import FileLock
+from vcs_repo_mgr.statistics import command_statistics
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+
+def coerce_async_repository(value, semaphore=None):
+    """
+    Convert a repository name, location or object to an :class:`AsyncRepository` object.
+
+    :param value: Any value accepted by :func:`~vcs_repo_mgr.coerce_repository()`
+                  or an :class:`AsyncRepository` object.
+    :param semaphore: Refer to :class:`AsyncRepository`.
+    :returns: An :class:`AsyncRepository` object (of the subclass that
+              matches the type of the repository).
+    """
+    if isinstance(value, AsyncRepository):
+        return value
+    repository = coerce_repository(value)
+    for cls in (AsyncHgRepo, AsyncGitRepo, AsyncBzrRepo):
+        if isinstance(repository, cls.repository_type):
+            return cls(repository, semaphore=semaphore)
+    return AsyncRepository(repository, semaphore=semaphore)
+
+
+async def acquire_lock(lock):
+    """
+    Acquire a lock in a thread so that waiting for it doesn't block the event loop.
+
+    :param lock: A :class:`~vcs_repo_mgr.locking.FileLock` object.
+
+    A thread that's waiting for a lock can't be interrupted, so when the
+    calling task is cancelled the lock is released as soon as the thread
+    acquires it (instead of leaking the lock).
+    """
+    def release_abandoned_lock(future):
+        if not future.cancelled() and future.exception() is None:
+            lock.release()
+    future = asyncio.get_event_loop().run_in_executor(None, lock.acquire)
+    try:
+        await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(release_abandoned_lock)
+        raise
+
+
+class AsyncRepository(object):
+
+    """
+    Asynchronous interface to a :class:`~vcs_repo_mgr.Repository` object.
+
+    The external commands are constructed using the command templates of the
+    wrapped :attr:`repository` (see :func:`~vcs_repo_mgr.Repository.get_command()`)
+    and their output is parsed using the ``parse_*()`` methods of the wrapped
+    repository, so subclasses of the :class:`~vcs_repo_mgr.Repository` classes
+    that customize those are supported. Refer to :func:`coerce_async_repository()`
+    for a convenient way to create :class:`AsyncRepository` objects.
+
+    .. py:attribute:: repository
+
+       The :class:`~vcs_repo_mgr.Repository` object that's wrapped.
+
+    .. py:attribute:: semaphore
+
+       An :class:`asyncio.Semaphore` object that limits the number of external
+       commands that are run concurrently (or :data:`None`). A single
+       semaphore can be shared by multiple :class:`AsyncRepository` objects.
+    """
+
+    repository_type = Repository
+    """The type of the :attr:`repository` that's wrapped (a :class:`~vcs_repo_mgr.Repository` subclass)."""
+
+    def __init__(self, repository, semaphore=None):
+        """
+        Initialize an :class:`AsyncRepository` object.
+
+        :param repository: The :class:`~vcs_repo_mgr.Repository` object to wrap.
+        :param semaphore: An :class:`asyncio.Semaphore` object or :data:`None`.
+        """
+        self.repository = repository
+        self.semaphore = semaphore
+        self.cached_refs = {}
+
+    async def run_command(self, method_name, attribute_name, capture=False, **kw):
+        """
+        Run the command for a given VCS operation.
+
+        Refer to :func:`vcs_repo_mgr.Repository.run_command()` for details
+        about the parameters and return value. When the command can be
+        translated by :func:`get_program_arguments()` it's run using
+        :func:`run_program()`, otherwise it's run by the shell.
+        """
+        program = self.get_program_arguments(method_name, attribute_name, **kw)
+        if program is None:
+            command = self.repository.get_command(method_name=method_name, attribute_name=attribute_name, **kw)
+            coroutine = self.run_shell_command(command, capture)
+        else:
+            coroutine = self.run_program(program[0], directory=program[1], capture=capture)
+        if self.semaphore is not None:
+            async with self.semaphore:
+                return await coroutine
+        return await coroutine
+
+    def get_program_arguments(self, method_name, attribute_name, **kw):
+        """
+        Translate the command for a given VCS operation to program arguments.
+
+        Refer to :func:`vcs_repo_mgr.Repository.get_command()` for the
+        parameters.
+
+        :returns: A tuple with two values (a list of program arguments and
+                  the working directory or :data:`None`) or :data:`None` when
+                  the command can't be translated.
+
+        Commands of the form ``cd {local} && program ...`` are run in the
+        directory `local` without starting a shell. Commands that use any
+        other shell features can't be translated (this is intended to
+        support custom commands that require a shell).
+        """
+        command_template = getattr(self.repository, attribute_name, None)
+        if command_template is None:
+            # Let get_command() raise the appropriate exception.
+            self.repository.get_command(method_name, attribute_name, **kw)
+        directory = None
+        match = re.match(r'^\s*cd {local} && (.+)$', command_template, re.DOTALL)
+        if match:
+            command_template = match.group(1)
+            directory = kw['local']
+        if re.search(r'[|<>&;`$()]', command_template):
+            return None
+        quoted_arguments = dict((k, quote(v)) for k, v in kw.items())
+        return shlex.split(command_template.format(**quoted_arguments)), directory
+
+    async def run_program(self, arguments, directory=None, capture=False):
+        """
+        Run a program using :func:`asyncio.create_subprocess_exec()`.
+
+        :param arguments: The program and its arguments (a list of strings).
+        :param directory: The working directory of the program (a string or
+                          :data:`None`).
+        :param capture: Refer to :func:`run_shell_command()`.
+        :returns: Refer to :func:`run_shell_command()`.
+        :raises: :exc:`~executor.ExternalCommandFailed` if the program fails.
+        """
+        logger.debug("Executing external command asynchronously: %s", quote(arguments))
+        timer = Timer()
+        process = await asyncio.create_subprocess_exec(
+            *arguments, cwd=directory, stdout=asyncio.subprocess.PIPE if capture else None
+        )
+        return await self.finish_command(process, arguments, timer, capture, directory=directory)
+
+    async def run_shell_command(self, command, capture=False):
+        """
+        Run a shell command using :func:`asyncio.create_subprocess_shell()`.
+
+        :param command: The shell command (a string).
+        :param capture: :data:`True` to capture and return the output of the
+                        command, :data:`False` otherwise.
+        :returns: The output of the command (a string) if `capture` is
+                  :data:`True`. The output is decoded and stripped the same
+                  way as :attr:`executor.ExternalCommand.output`.
+        :raises: :exc:`~executor.ExternalCommandFailed` if the command fails.
+        """
+        logger.debug("Executing external command asynchronously: %s", command)
+        timer = Timer()
+        process = await asyncio.create_subprocess_shell(
+            command, stdout=asyncio.subprocess.PIPE if capture else None,
+        )
+        return await self.finish_command(process, [command], timer, capture)
+
+    async def finish_command(self, process, command, timer, capture, directory=None):
+        """
+        Wait for an external command started by :func:`run_program()` or :func:`run_shell_command()`.
+
+        The command is recorded in :data:`~vcs_repo_mgr.statistics.command_statistics`.
+        """
+        stdout, stderr = await process.communicate()
+        command_statistics.record(command[0] if len(command) == 1 else command, timer.elapsed_time,
+                                  output=stdout, failed=process.returncode != 0)
+        if process.returncode != 0:
+            options = dict(directory=directory) if directory else {}
+            failed_command = ExternalCommand(*command, returncode=process.returncode, **options)
+            raise failed_command.error_type(failed_command)
+        if capture:
+            output = stdout.decode('UTF-8')
+            stripped_output = output.strip()
+            return stripped_output if '\n' not in stripped_output else output
+
+    async def create(self, remote=None):
+        """
+        Create the local clone of the remote version control repository.
+
+        Refer to :func:`vcs_repo_mgr.Repository.create()` for details. When
+        :attr:`~vcs_repo_mgr.Repository.shared_store` is set the synchronous
+        implementation is run in a thread (because it manages the shared
+        store).
+        """
+        if self.repository.exists:
+            return False
+        if self.repository.shared_store:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self.repository.create, remote)
+        remote = remote or self.repository.remote
+        logger.info("Creating %s clone of %s at %s ..", self.repository.friendly_name, remote, self.repository.local)
+        temporary_directory = self.repository.create_staging_directory()
+        try:
+            staging_directory = os.path.join(temporary_directory, 'clone')
+            await self.create_clone(remote, staging_directory)
+            if not self.repository.install_clone(staging_directory):
+                return False
+        finally:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+        self.repository.invalidate_ref_snapshot()
+        self.repository.mark_updated()
+        return True
+
+    async def create_clone(self, remote, directory):
+        """
+        Clone the remote repository into a staging directory.
+
+        Refer to :func:`vcs_repo_mgr.Repository.create_clone()` for details.
+        """
+        await self.run_command(
+            method_name='create',
+            attribute_name='create_command' if self.repository.bare else 'create_command_non_bare',
+            local=directory,
+            remote=remote,
+            clone_options=self.repository.clone_options,
+        )
+
+    async def update(self, remote=None):
+        """
+        Update the local clone of the remote version control repository.
+
+        Refer to :func:`vcs_repo_mgr.Repository.update()` for details. Unlike
+        :func:`vcs_repo_mgr.GitRepo.update()` this doesn't update the
+        revision numbers of branches incrementally (they are calculated on
+        demand instead). Concurrent updates are coalesced and locked the same
+        way as :func:`vcs_repo_mgr.Repository.update()` does (the locks are
+        acquired in a thread so that waiting for them doesn't block the event
+        loop).
+        """
+        remote = remote or self.repository.remote
+        update_limit = int(os.environ.get(UPDATE_VARIABLE, '0'))
+        if not remote:
+            logger.debug("Skipping update (pull) because there's no remote.")
+        elif await self.create(remote=remote):
+            logger.debug("Skipping update (pull) because local repository was just created.")
+        elif update_limit and self.repository.last_updated >= update_limit:
+            logger.debug("Skipping update (pull) due to update limit.")
+        elif self.repository.is_fresh:
+            logger.debug("Skipping update (pull) because local repository is less than %i seconds old.",
+                         self.repository.max_age)
+        else:
+            fingerprint = self.repository.update_fingerprint
+            # The exclusive lock on the local clone is acquired before the
+            # lock on update_lock_file, just like Repository.update() does.
+            exclusive_lock = await self.lock_clone()
+            try:
+                lock = FileLock(self.repository.update_lock_file, timeout=self.repository.lock_timeout)
+                await acquire_lock(lock)
+                try:
+                    if self.repository.update_fingerprint != fingerprint:
+                        logger.info("Skipping update (pull) because a concurrent update of %s just finished.",
+                                    self.repository.local)
+                        self.repository.invalidate_ref_snapshot()
+                    elif self.repository.check_remote and not await self.has_remote_changes(remote=remote):
+                        logger.info("Skipping update (pull) because %s has no new changes.", remote)
+                        self.repository.mark_updated()
+                    else:
+                        logger.info("Pulling %s updates from %s into %s ..",
+                                    self.repository.friendly_name, remote, self.repository.local)
+                        update_options = await asyncio.get_event_loop().run_in_executor(
+                            None, self.repository.get_update_options, remote,
+                        )
+                        await self.run_command(
+                            method_name='update',
+                            attribute_name='update_command',
+                            local=self.repository.local,
+                            remote=remote,
+                            update_options=update_options,
+                        )
+                        self.repository.invalidate_ref_snapshot()
+                        self.repository.mark_updated()
+                finally:
+                    lock.release()
+            finally:
+                exclusive_lock.release()
+
+    async def has_remote_changes(self, remote=None):
+        """
+        Check whether the remote repository contains changes that haven't been pulled yet.
+
+        Refer to :func:`vcs_repo_mgr.Repository.has_remote_changes()` for
+        details. The local references are read and compared in a thread so
+        that the file system access doesn't block the event loop.
+        """
+        remote = remote or self.repository.remote
+        if not (remote and self.repository.exists and getattr(self.repository, 'remote_refs_command', None)):
+            return True
+        loop = asyncio.get_event_loop()
+        try:
+            listing = await self.run_command(
+                method_name='has_remote_changes',
+                attribute_name='remote_refs_command',
+                capture=True,
+                local=self.repository.local,
+                remote=remote,
+            )
+            remote_refs = await loop.run_in_executor(None, self.repository.parse_remote_refs, listing)
+            local_refs = await loop.run_in_executor(None, self.repository.find_local_refs)
+        except ExternalCommandFailed as e:
+            logger.warning("Failed to check %s for changes, assuming there are changes! (%s)", remote, e)
+            return True
+        changed_refs = sorted(n for n, i in remote_refs.items() if local_refs.get(n) != i)
+        if changed_refs:
+            logger.debug("Remote repository has changes: %s", concatenate(changed_refs))
+        return bool(changed_refs)
+
+    async def lock_clone(self, exclusive=True):
+        """
+        Acquire a lock on the local clone.
+
+        :param exclusive: :data:`True` for an exclusive lock (the default),
+                          :data:`False` for a shared lock.
+        :returns: The acquired :class:`~vcs_repo_mgr.locking.FileLock` object
+                  (the caller is responsible for releasing it).
+
+        The re-entrant :func:`vcs_repo_mgr.Repository.lock()` is bound to a
+        thread, so a plain lock on :attr:`~vcs_repo_mgr.Repository.lock_file`
+        is used instead. This means the lock isn't re-entrant: A coroutine
+        that holds a lock must not acquire another lock on the same clone.
+        The lock is acquired in a thread so that waiting for it doesn't block
+        the event loop (see :func:`acquire_lock()`).
+        """
+        lock = FileLock(self.repository.lock_file, exclusive=exclusive, timeout=self.repository.lock_timeout)
+        await acquire_lock(lock)
+        self.repository.lock_statistics.record(lock.wait_time)
+        return lock
+
+    async def run_query(self, method_name, attribute_name, **kw):
+        """
+        Run a command that queries the local clone.
+
+        :param method_name: Refer to :func:`run_command()`.
+        :param attribute_name: Refer to :func:`run_command()`.
+        :param kw: Refer to :func:`run_command()`.
+        :returns: The output of the command (a string).
+
+        The command runs while holding a shared lock on the local clone (see
+        :func:`lock_clone()`), just like the queries of the synchronous
+        :class:`~vcs_repo_mgr.Repository` classes do.
+        """
+        lock = await self.lock_clone(exclusive=False)
+        try:
+            return await self.run_command(method_name, attribute_name, capture=True, **kw)
+        finally:
+            lock.release()
+
+    async def find_revision_id(self, revision=None):
+        """
+        Find the global revision id of the given revision.
+
+        :param revision: A reference to a revision, most likely the name of a
+                         branch (a string, defaults to
+                         :attr:`~vcs_repo_mgr.Repository.default_revision`).
+        :returns: The global revision id (a hexadecimal string).
+
+        This method needs to be implemented by subclasses.
+        """
+        raise NotImplementedError()
+
+    async def find_revision_number(self, revision=None):
+        """
+        Find the local revision number of the given revision.
+
+        :param revision: A reference to a revision, most likely the name of a
+                         branch (a string, defaults to
+                         :attr:`~vcs_repo_mgr.Repository.default_revision`).
+        :returns: The local revision number (an integer).
+
+        Revision numbers are looked up in and added to
+        :attr:`~vcs_repo_mgr.Repository.revision_numbers`, just like
+        :func:`vcs_repo_mgr.Repository.find_revision_numbers()` does (in a
+        thread, because the revision numbers are stored in an SQLite
+        database).
+        """
+        loop = asyncio.get_event_loop()
+        revision_id = await self.find_revision_id(revision)
+        revision_number = await loop.run_in_executor(None, self.repository.revision_numbers.get, revision_id)
+        if revision_number is None:
+            revision_number = await self.count_revisions(revision_id)
+            await loop.run_in_executor(None, self.repository.revision_numbers.set, revision_id, revision_number)
+        return revision_number
+
+    async def count_revisions(self, revision_id):
+        """
+        Calculate the revision number of the given revision.
+
+        :param revision_id: A global revision id (a string).
+        :returns: The revision number (an integer).
+        """
+        return self.repository.parse_revision_count(await self.run_query(
+            method_name='count_revisions',
+            attribute_name='count_revisions_command',
+            local=self.repository.local,
+            revision_id=revision_id,
+        ))
+
+    async def find_branches(self):
+        """
+        Find the branches in the repository.
+
+        :returns: A list of :class:`~vcs_repo_mgr.Revision` objects.
+        """
+        return list(self.repository.parse_branches(await self.run_query(
+            method_name='find_branches',
+            attribute_name='find_branches_command',
+            local=self.repository.local,
+        )))
+
+    async def find_tags(self):
+        """
+        Find the tags in the repository.
+
+        :returns: A list of :class:`~vcs_repo_mgr.Revision` objects.
+        """
+        return list(self.repository.parse_tags(await self.run_query(
+            method_name='find_tags',
+            attribute_name='find_tags_command',
+            local=self.repository.local,
+        )))
+
+    async def branches(self):
+        """
+        Find information about the branches in the repository.
+
+        :returns: A :class:`dict` with branch names (strings) as keys and
+                  :class:`~vcs_repo_mgr.Revision` objects as values.
+
+        The result is cached until
+        :attr:`~vcs_repo_mgr.Repository.ref_fingerprint` changes.
+        """
+        return dict((r.branch, r) for r in await self.find_cached_refs('branches', self.find_branches))
+
+    async def tags(self):
+        """
+        Find information about the tags in the repository.
+
+        :returns: A :class:`dict` with tag names (strings) as keys and
+                  :class:`~vcs_repo_mgr.Revision` objects as values.
+
+        The result is cached until
+        :attr:`~vcs_repo_mgr.Repository.ref_fingerprint` changes.
+        """
+        return dict((r.tag, r) for r in await self.find_cached_refs('tags', self.find_tags))
+
+    async def find_cached_refs(self, name, query):
+        """Used by :func:`branches()` and :func:`tags()` to cache their results."""
+        await self.create()
+        # Computing the fingerprint walks the references on disk.
+        fingerprint = await asyncio.get_event_loop().run_in_executor(
+            None, getattr, self.repository, 'ref_fingerprint',
+        )
+        cached_fingerprint, revisions = self.cached_refs.get(name, (None, None))
+        if fingerprint is None or fingerprint != cached_fingerprint:
+            revisions = await query()
+            self.cached_refs[name] = (fingerprint, revisions)
+        return revisions
+
+    def __repr__(self):
+        """Generate a human readable representation of an asynchronous repository object."""
+        return "%s(%r)" % (self.__class__.__name__, self.repository)
+
+
+class AsyncHgRepo(AsyncRepository):
+
+    """Asynchronous interface to a :class:`~vcs_repo_mgr.HgRepo` object."""
+
+    repository_type = HgRepo
+
+    async def find_revision_id(self, revision=None):
+        """Find the global revision id of a revision (see :func:`vcs_repo_mgr.HgRepo.find_revision_id()`)."""
+        await self.create()
+        return self.repository.parse_revision_id(await self.run_query(
+            method_name='find_revision_id',
+            attribute_name='find_revision_id_command',
+            local=self.repository.local,
+            revision=revision or self.repository.default_revision,
+        ))
+
+    async def find_revision_number(self, revision=None):
+        """Find the local revision number of a revision (see :func:`vcs_repo_mgr.HgRepo.find_revision_number()`)."""
+        await self.create()
+        return self.repository.parse_revision_number(await self.run_query(
+            method_name='find_revision_number',
+            attribute_name='find_revision_number_command',
+            local=self.repository.local,
+            revision=revision or self.repository.default_revision,
+        ))
+
+
+class AsyncGitRepo(AsyncRepository):
+
+    """Asynchronous interface to a :class:`~vcs_repo_mgr.GitRepo` object."""
+
+    repository_type = GitRepo
+
+    async def find_revision_id(self, revision=None):
+        """Find the global revision id of a revision (see :func:`vcs_repo_mgr.GitRepo.find_revision_id()`)."""
+        await self.create()
+        revisions = [revision or self.repository.default_revision]
+        if FULL_GIT_REVISION_ID.match(revisions[0]):
+            # Make sure complete revision ids are validated.
+            revisions[0] += '^{object}'
+        return self.repository.parse_revision_ids(revisions, await self.run_query(
+            method_name='find_revision_ids',
+            attribute_name='find_revision_ids_command',
+            local=self.repository.local,
+            revisions=revisions,
+        ))[0]
+
+    async def create_clone(self, remote, directory):
+        """Clone the remote repository and fetch its release tags (see :func:`vcs_repo_mgr.GitRepo.create_clone()`)."""
+        await super().create_clone(remote, directory)
+        await asyncio.get_event_loop().run_in_executor(None, self.repository.fetch_release_tags, remote, directory)
+
+    async def count_revisions(self, revision_id):
+        """Calculate the revision number of a revision (see :func:`vcs_repo_mgr.GitRepo.count_revisions()`)."""
+        if self.repository.is_shallow and self.repository.remote:
+            exclusive_lock = await self.lock_clone()
+            try:
+                if self.repository.is_shallow:
+                    logger.info("Fetching complete history of shallow clone %s (needed to count revisions) ..",
+                                self.repository.local)
+                    options = [o for o in self.repository.update_options if not o.startswith('--depth=')]
+                    await self.run_program(['git', 'fetch', '--unshallow', self.repository.remote] + options,
+                                           directory=self.repository.local)
+                    self.repository.invalidate_ref_snapshot()
+            finally:
+                exclusive_lock.release()
+        return await super().count_revisions(revision_id)
+
+
+class AsyncBzrRepo(AsyncRepository):
+
+    """Asynchronous interface to a :class:`~vcs_repo_mgr.BzrRepo` object."""
+
+    repository_type = BzrRepo
+
+    async def find_revision_id(self, revision=None):
+        """Find the global revision id of a revision (see :func:`vcs_repo_mgr.BzrRepo.find_revision_id()`)."""
+        await self.create()
+        return self.repository.parse_revision_id(await self.run_query(
+            method_name='find_revision_id',
+            attribute_name='find_revision_id_command',
+            local=self.repository.local,
+            revision=revision or self.repository.default_revision,
+        ))
+
+    async def find_branches(self):
+        """Bazaar repository support doesn't support branches (see :func:`vcs_repo_mgr.BzrRepo.find_branches()`)."""
+        return list(self.repository.find_branches())
+
+    async def find_tags(self):
+        """Find the tags in the repository (refer to :func:`vcs_repo_mgr.BzrRepo.find_tags()`)."""
+        lock = await self.lock_clone(exclusive=False)
+        try:
+            listing, listing_with_ids = await asyncio.gather(
+                self.run_command(
+                    method_name='find_tags',
+                    attribute_name='find_tags_command',
+                    capture=True,
+                    local=self.repository.local,
+                ),
+                self.run_command(
+                    method_name='find_tags',
+                    attribute_name='find_tag_ids_command',
+                    capture=True,
+                    local=self.repository.local,
+                ),
+            )
+        finally:
+            lock.release()
+        return list(self.repository.parse_tags(listing, listing_with_ids))
@@ -0,0 +1,235 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Thread safe caching of objects that are expensive to construct.
+
+The :class:`LRUCache` class is used by :func:`~vcs_repo_mgr.repository_factory()`
+to keep track of previously constructed :class:`~vcs_repo_mgr.Repository`
+objects (see :data:`~vcs_repo_mgr.loaded_repositories`) without growing
+without bound in long running processes like the daemon started by ``vcs-tool
+--serve``.
+"""
+
+# Standard library modules.
+import itertools
+import logging
+import sys
+import threading
+import weakref
+
+# External dependencies.
+from six import reraise
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 256
+"""The default maximum number of objects in an :class:`LRUCache` (an integer)."""
+
+
+class LRUCache(object):
+
+    """
+    A thread safe least recently used (LRU) cache.
+
+    Objects are added to the cache using :func:`get_or_create()`. When
+    multiple threads ask for the same key at the same time the object is
+    constructed once: the first thread constructs the object while the other
+    threads wait for the result. When the cache contains more than
+    :attr:`capacity` objects the least recently used objects are evicted.
+
+    .. py:attribute:: capacity
+
+       The maximum number of objects in the cache (an integer, :data:`None`
+       means the cache is unbounded).
+
+    .. py:attribute:: weak
+
+       :data:`True` if the cache holds weak references to its objects (which
+       means objects are evicted as soon as they're no longer used elsewhere),
+       :data:`False` if the cache holds strong references.
+
+    .. py:attribute:: hits
+
+       The number of lookups that were answered from the cache (an integer).
+
+    .. py:attribute:: misses
+
+       The number of lookups that required an object to be constructed (an
+       integer).
+
+    .. py:attribute:: evictions
+
+       The number of objects that were evicted from the cache (an integer).
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, weak=False):
+        """
+        Initialize an :class:`LRUCache` object.
+
+        :param capacity: Used to set :attr:`capacity` (an integer or
+                         :data:`None`, defaults to :data:`DEFAULT_CAPACITY`).
+        :param weak: Used to set :attr:`weak` (a boolean, defaults to
+                     :data:`False`).
+        """
+        self.capacity = capacity
+        self.weak = weak
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.pending = {}
+        self.counter = itertools.count()
+
+    def get(self, key, default=None):
+        """
+        Get an object from the cache.
+
+        :param key: The key of the object (any hashable value).
+        :param default: The value to return when the key isn't cached.
+        :returns: The cached object or the value of `default`.
+        """
+        with self.lock:
+            value = self.lookup(key)
+        return default if value is None else value
+
+    def get_or_create(self, key, constructor):
+        """
+        Get an object from the cache or construct it.
+
+        :param key: The key of the object (any hashable value).
+        :param constructor: A callable that takes no arguments and returns the
+                            object to cache (it's called without holding the
+                            lock, so constructors can use the cache).
+        :returns: The cached or newly constructed object.
+        :raises: Any exceptions raised by `constructor` are propagated (to
+                 all threads that were waiting for the object).
+        """
+        with self.lock:
+            value = self.lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            construction = self.pending.get(key)
+            if construction is None:
+                construction = PendingConstruction()
+                self.pending[key] = construction
+                self.misses += 1
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+        if not owner:
+            logger.debug("Waiting for concurrent construction of %r ..", key)
+            return construction.wait()
+        try:
+            value = constructor()
+        except BaseException:
+            # Also handle KeyboardInterrupt and SystemExit, otherwise the key
+            # would remain pending and waiting threads would never wake up.
+            with self.lock:
+                del self.pending[key]
+            construction.fail()
+            raise
+        with self.lock:
+            del self.pending[key]
+            self.store(key, value)
+        construction.succeed(value)
+        return value
+
+    def lookup(self, key):
+        """
+        Find an object and mark it as recently used (the caller must hold :attr:`lock`).
+
+        :param key: The key of the object (any hashable value).
+        :returns: The cached object or :data:`None`.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value = entry[1]() if self.weak else entry[1]
+        if value is None:
+            # The object referenced by a weak reference was garbage collected.
+            del self.entries[key]
+            self.evictions += 1
+            return None
+        self.entries[key] = (next(self.counter), entry[1])
+        return value
+
+    def store(self, key, value):
+        """
+        Add an object to the cache (the caller must hold :attr:`lock`).
+
+        :param key: The key of the object (any hashable value).
+        :param value: The object to cache.
+        """
+        self.entries[key] = (next(self.counter), weakref.ref(value) if self.weak else value)
+        if self.capacity is not None:
+            excess = len(self.entries) - max(0, self.capacity)
+            if excess > 0:
+                ordered = sorted(self.entries.items(), key=lambda item: item[1][0])
+                for evicted_key, entry in ordered[:excess]:
+                    logger.debug("Evicting least recently used object %r from cache ..", evicted_key)
+                    del self.entries[evicted_key]
+                    self.evictions += 1
+
+    def clear(self):
+        """Remove all objects from the cache (the counters are preserved)."""
+        with self.lock:
+            self.entries.clear()
+
+    @property
+    def stats(self):
+        """A dictionary with the keys ``capacity``, ``evictions``, ``hits``, ``misses`` and ``size``."""
+        with self.lock:
+            return dict(capacity=self.capacity, evictions=self.evictions,
+                        hits=self.hits, misses=self.misses, size=len(self.entries))
+
+    def __contains__(self, key):
+        """Check whether an object is cached (without marking it as recently used)."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and (not self.weak or entry[1]() is not None)
+
+    def __len__(self):
+        """Get the number of cached objects."""
+        with self.lock:
+            return len(self.entries)
+
+
+class PendingConstruction(object):
+
+    """Enables threads to wait for an object that is being constructed by another thread."""
+
+    def __init__(self):
+        """Initialize a :class:`PendingConstruction` object."""
+        self.event = threading.Event()
+        self.value = None
+        self.exc_info = None
+
+    def succeed(self, value):
+        """Publish the constructed object to waiting threads."""
+        self.value = value
+        self.event.set()
+
+    def fail(self):
+        """Publish the exception that is currently being handled to waiting threads."""
+        self.exc_info = sys.exc_info()
+        self.event.set()
+
+    def wait(self):
+        """
+        Wait for the construction to finish.
+
+        :returns: The constructed object.
+        :raises: The exception raised by the constructor.
+        """
+        self.event.wait()
+        if self.exc_info is not None:
+            reraise(*self.exc_info)
+        return self.value
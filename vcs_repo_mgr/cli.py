@@ -1,7 +1,7 @@
 # Command line interface for vcs-repo-mgr.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: April 29, 2017
+# Last Change: October 16, 2026
 # URL: https://github.com/xolox/python-vcs-repo-mgr
 
 """
@@ -16,8 +16,8 @@ Supported options:
   -r, --repository=REPOSITORY
 
     Select a repository to operate on by providing the name of a repository
-    defined in one of the configuration files ~/.vcs-repo-mgr.ini and
-    /etc/vcs-repo-mgr.ini.
+    defined in one of the configuration files ~/.vcs-repo-mgr.ini,
+    /etc/vcs-repo-mgr.ini and /etc/vcs-repo-mgr.d/*.ini.
 
     Alternatively the location of a remote repository can be given. The
     location should be prefixed by the type of the repository (with a `+' in
@@ -79,7 +79,7 @@ Supported options:
 
     Print the summed revision numbers of multiple repository/revision pairs.
     The repository/revision pairs are taken from the positional arguments to
-    vcs-repo-mgr.
+    vcs-repo-mgr. The repositories are queried concurrently.
 
     This is useful when you're building a package based on revisions from
     multiple VCS repositories. By taking changes in all repositories into
@@ -99,6 +99,12 @@ Supported options:
     changes from the remote repository. This option is used in combination with
     the --repository option.
 
+  --update-all
+
+    Create/update the local clones of all repositories defined in the
+    configuration files ~/.vcs-repo-mgr.ini, /etc/vcs-repo-mgr.ini and
+    /etc/vcs-repo-mgr.d/*.ini. Multiple repositories are updated concurrently.
+
   -m, --merge-up
 
     Merge a change into one or more release branches and the default branch.
@@ -120,13 +126,58 @@ Supported options:
 
     Export the contents of a specific revision of a repository to a local
     directory. This option is used in combination with the --repository and
-    --revision options.
+    --revision options. When DIRECTORY ends in .tar, .tar.gz, .tar.xz or .zip
+    an archive is created instead (without extracting the tree to disk).
 
   -d, --find-directory
 
     Print the absolute pathname of a local repository. This option is used in
     combination with the --repository option.
 
+  --batch
+
+    Answer many queries using a single vcs-tool process. Queries are read from
+    standard input, one JSON object per line, with the keys `action' (one of
+    `find-directory', `find-revision-number', `find-revision-id',
+    `list-releases', `select-release', `sum-revisions', `vcs-control-field',
+    `update', `merge-up' or `commit'), `repository' and optionally `revision',
+    `release', `arguments' (the repository/revision pairs for `sum-revisions'),
+    `feature_branch' (for `merge-up'), `message' (for `commit') and `id'. For
+    the `select-release' action `release' is the highest allowed release.
+
+    For every query one line with a JSON object is written to standard output,
+    containing the key `result' on success or `error' on failure (and the `id'
+    of the query, when given). Repositories and their branches and tags are
+    cached between queries. The output of external commands is redirected to
+    standard error.
+
+  --serve
+
+    Run a daemon that answers the queries of `vcs-tool --client' over a UNIX
+    domain socket (the location of the socket can be set using the environment
+    variable $VCS_REPO_MGR_SOCKET). The daemon keeps repositories and their
+    branches, tags and revision numbers in memory so that queries don't pay for
+    the startup of vcs-tool. Queries that change a repository (updates, merges
+    and commits) are serialized per repository while other queries are
+    answered concurrently.
+
+  --client
+
+    Send the queries given by the other options to the daemon started by
+    --serve instead of answering them in the vcs-tool process. When the daemon
+    isn't running the queries are answered by vcs-tool itself. This option can
+    be combined with all options except --update-all and --export.
+
+  --stats
+
+    Report statistics about the external commands that were run by the other
+    options (the number of commands, how long they took, the size of their
+    output and the number of failures, grouped by repository operation and
+    command) on standard error. Commands that take longer than ten seconds
+    are logged (this threshold can be changed by setting the environment
+    variable $VCS_REPO_MGR_SLOW_COMMANDS). Commands run by the daemon on
+    behalf of --client aren't included.
+
   -v, --verbose
 
     Increase logging verbosity (can be repeated).
@@ -141,33 +192,40 @@ Supported options:
 """
 
 # Standard library modules.
+import contextlib
 import functools
 import getopt
 import logging
+import os
 import sys
 
 # External dependencies.
-import coloredlogs
 from executor import execute
 from humanfriendly.terminal import usage, warning
+from humanfriendly.text import concatenate, pluralize
 
 # Modules included in our package.
-from vcs_repo_mgr import coerce_repository, sum_revision_numbers
+from vcs_repo_mgr import ARCHIVE_FORMATS, coerce_repository, sum_revision_numbers
+from vcs_repo_mgr.statistics import instrument
 
 # Initialize a logger.
 logger = logging.getLogger(__name__)
 
-# Inject our logger into all execute() calls.
-execute = functools.partial(execute, logger=logger)
+# Inject our logger into all execute() calls and record statistics about them.
+execute = instrument(functools.partial(execute, logger=logger))
 
 
 def main():
     """The command line interface of the ``vcs-tool`` program."""
     # Initialize logging to the terminal.
+    import coloredlogs
     coloredlogs.install()
     # Command line option defaults.
     repository = None
     revision = None
+    release = None
+    client = None
+    show_stats = False
     actions = []
     # Parse the command line arguments.
     try:
@@ -175,16 +233,26 @@ def main():
             'repository=', 'rev=', 'revision=', 'release=', 'find-directory',
             'find-revision-number', 'find-revision-id', 'list-releases',
             'select-release=', 'sum-revisions', 'vcs-control-field', 'update',
-            'merge-up', 'export=', 'verbose', 'quiet', 'help',
+            'update-all', 'merge-up', 'export=', 'batch', 'serve', 'client',
+            'stats', 'verbose', 'quiet', 'help',
         ])
+        # In client mode queries are answered by the daemon.
+        if any(option == '--client' for option, value in options):
+            from vcs_repo_mgr.server import RepositoryClient, resolve_location
+            client = RepositoryClient()
         for option, value in options:
             if option in ('-r', '--repository'):
                 value = value.strip()
                 assert value, "Please specify the name of a repository! (using -r, --repository)"
-                repository = coerce_repository(value)
+                repository = resolve_location(value) if client else coerce_repository(value)
             elif option in ('--rev', '--revision'):
                 revision = value.strip()
+                release = None
                 assert revision, "Please specify a nonempty revision string!"
+            elif option == '--release' and client:
+                release = value.strip()
+                revision = None
+                assert release, "Please specify a nonempty release identifier!"
             elif option == '--release':
                 # TODO Right now --release and --merge-up cannot be combined
                 #      because the following statements result in a global
@@ -198,43 +266,104 @@ def main():
                 revision = repository.releases[release_id].revision.revision_id
             elif option in ('-d', '--find-directory'):
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(print_directory, repository))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='find-directory', repository=repository,
+                    )))
+                else:
+                    actions.append(functools.partial(print_directory, repository))
             elif option in ('-n', '--find-revision-number'):
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(print_revision_number, repository, revision))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='find-revision-number', repository=repository, revision=revision, release=release,
+                    )))
+                else:
+                    actions.append(functools.partial(print_revision_number, repository, revision))
             elif option in ('-i', '--find-revision-id'):
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(print_revision_id, repository, revision))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='find-revision-id', repository=repository, revision=revision, release=release,
+                    )))
+                else:
+                    actions.append(functools.partial(print_revision_id, repository, revision))
             elif option == '--list-releases':
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(print_releases, repository))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='list-releases', repository=repository,
+                    )))
+                else:
+                    actions.append(functools.partial(print_releases, repository))
             elif option == '--select-release':
                 assert repository, "Please specify a repository first!"
                 release_id = value.strip()
                 assert release_id, "Please specify a nonempty release identifier!"
-                actions.append(functools.partial(print_selected_release, repository, release_id))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='select-release', repository=repository, release=release_id,
+                    )))
+                else:
+                    actions.append(functools.partial(print_selected_release, repository, release_id))
             elif option in ('-s', '--sum-revisions'):
                 assert len(arguments) >= 2, "Please specify one or more repository/revision pairs!"
-                actions.append(functools.partial(print_summed_revisions, arguments))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='sum-revisions', arguments=arguments,
+                    )))
+                else:
+                    actions.append(functools.partial(print_summed_revisions, arguments))
                 arguments = []
             elif option == '--vcs-control-field':
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(print_vcs_control_field, repository, revision))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='vcs-control-field', repository=repository, revision=revision, release=release,
+                    )))
+                else:
+                    actions.append(functools.partial(print_vcs_control_field, repository, revision))
             elif option in ('-u', '--update'):
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(repository.update))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='update', repository=repository,
+                    )))
+                else:
+                    actions.append(functools.partial(repository.update))
+            elif option == '--update-all':
+                assert not client, "The --update-all option can't be combined with --client!"
+                actions.append(update_all_repositories)
+            elif option == '--batch':
+                actions.append(functools.partial(run_batch, function=client.answer if client else None))
+            elif option == '--serve':
+                actions.append(run_server)
+            elif option == '--client':
+                pass
             elif option in ('-m', '--merge-up'):
                 assert repository, "Please specify a repository first!"
-                actions.append(functools.partial(
-                    repository.merge_up,
-                    target_branch=revision,
-                    feature_branch=arguments[0] if arguments else None,
-                ))
+                if client:
+                    actions.append(functools.partial(print_query_result, client, dict(
+                        action='merge-up', repository=repository, revision=revision, release=release,
+                        feature_branch=arguments[0] if arguments else None,
+                    )))
+                else:
+                    actions.append(functools.partial(
+                        repository.merge_up,
+                        target_branch=revision,
+                        feature_branch=arguments[0] if arguments else None,
+                    ))
             elif option in ('-e', '--export'):
                 directory = value.strip()
                 assert repository, "Please specify a repository first!"
+                assert not client, "The --export option can't be combined with --client!"
                 assert directory, "Please specify the directory where the revision should be exported!"
-                actions.append(functools.partial(repository.export, directory, revision))
+                if directory.lower().endswith(tuple(e for e, f in ARCHIVE_FORMATS)):
+                    actions.append(functools.partial(repository.export_archive, directory, revision))
+                else:
+                    actions.append(functools.partial(repository.export, directory, revision))
+            elif option == '--stats':
+                show_stats = True
             elif option in ('-v', '--verbose'):
                 coloredlogs.increase_verbosity()
             elif option in ('-q', '--quiet'):
@@ -255,6 +384,9 @@ def main():
     except Exception:
         logger.exception("Failed to execute requested action(s)!")
         sys.exit(1)
+    finally:
+        if show_stats:
+            print_statistics()
 
 
 def print_directory(repository):
@@ -287,6 +419,97 @@ def print_summed_revisions(arguments):
     print(sum_revision_numbers(arguments))
 
 
+def update_all_repositories():
+    """Create or update all configured repositories (raises an exception when any of the updates failed)."""
+    from vcs_repo_mgr.fleet import update_repositories
+    failures = [result.name for result in update_repositories() if not result.succeeded]
+    if failures:
+        raise Exception("Failed to update %s! (%s)" % (
+            pluralize(len(failures), "repository", "repositories"),
+            concatenate(failures),
+        ))
+
+
+def print_statistics():
+    """Report statistics about the external commands that were run to standard error."""
+    from vcs_repo_mgr.statistics import command_statistics
+    table = command_statistics.format_table()
+    sys.stderr.write((table or "No external commands were run.") + "\n")
+
+
 def print_vcs_control_field(repository, revision):
     """Report the VCS control field for the given repository and revision to standard output."""
     print("%s: %s" % repository.generate_control_field(revision))
+
+
+def run_batch(input_stream=None, output_stream=None, function=None):
+    """
+    Answer queries read from standard input (refer to the ``--batch`` option).
+
+    :param input_stream: The file-like object to read queries from (defaults
+                         to :data:`sys.stdin`).
+    :param output_stream: The file-like object to write results to (defaults
+                          to :data:`sys.stdout`, refer to
+                          :func:`protect_standard_output()`).
+    :param function: The function that answers queries (defaults to
+                     :func:`~vcs_repo_mgr.server.answer_query()`).
+    """
+    if output_stream is None:
+        with protect_standard_output() as output_stream:
+            return run_batch(input_stream, output_stream, function)
+    from vcs_repo_mgr.server import answer_query, generate_response
+    input_stream = input_stream or sys.stdin
+    # We don't iterate over the input stream because Python 2
+    # reads ahead, which would make the pipe unresponsive.
+    for line in iter(input_stream.readline, ''):
+        line = line.strip()
+        if line:
+            output_stream.write(generate_response(line, function or answer_query) + '\n')
+            output_stream.flush()
+
+
+@contextlib.contextmanager
+def protect_standard_output():
+    """
+    Redirect standard output to standard error while answering queries.
+
+    :returns: A context manager that produces a file-like object connected
+              to the original standard output stream.
+
+    External commands (like ``hg pull``) report progress on standard output,
+    which would corrupt the responses written by :func:`run_batch()`. This
+    context manager duplicates the file descriptor of standard output (the
+    duplicate is used for the responses) and points the original file
+    descriptor (inherited by external commands) at standard error. When
+    :data:`sys.stdout` isn't connected to a file descriptor it's used as is.
+    """
+    try:
+        stdout_fd = sys.stdout.fileno()
+        stderr_fd = sys.stderr.fileno()
+    except Exception:
+        yield sys.stdout
+        return
+    sys.stdout.flush()
+    saved_fd = os.dup(stdout_fd)
+    try:
+        os.dup2(stderr_fd, stdout_fd)
+        with os.fdopen(os.dup(saved_fd), 'w') as handle:
+            yield handle
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_fd, stdout_fd)
+        os.close(saved_fd)
+
+
+def run_server():
+    """Run the daemon that answers queries (refer to the ``--serve`` option)."""
+    from vcs_repo_mgr.server import serve
+    serve()
+
+
+def print_query_result(client, query):
+    """Report the result of a query answered by the daemon to standard output."""
+    from vcs_repo_mgr.server import MUTATING_ACTIONS
+    result = client.answer(query)
+    if query['action'] not in MUTATING_ACTIONS:
+        print('\n'.join(map(str, result)) if isinstance(result, list) else result)
@@ -0,0 +1,357 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Long running version control processes that answer many queries.
+
+Most of the work done by `vcs-repo-mgr` consists of running short lived
+external commands. When hundreds of queries are made against a single
+repository the startup time of these commands can dominate the total time
+spent, so this module implements support for long running processes that are
+started once and then reused for many queries.
+
+The following long running processes are supported:
+
+- :class:`GitCatFile` resolves git object names.
+- :class:`HgCommandServer` runs arbitrary Mercurial commands.
+"""
+
+# Standard library modules.
+import logging
+import struct
+import subprocess
+import sys
+import threading
+
+# External dependencies.
+from executor import ExternalCommand
+from humanfriendly import Timer, format_path
+
+# Modules included in our package.
+from vcs_repo_mgr.statistics import command_statistics
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TIMEOUT = 60
+"""The number of seconds after which idle coprocesses are terminated (a number)."""
+
+
+class Coprocess(object):
+
+    """
+    Base class for long running processes that answer queries.
+
+    The process is started on demand by :func:`ensure_running()` and
+    terminated by :func:`close()`, which is called automatically when the
+    process hasn't been used for :attr:`idle_timeout` seconds. Queries are
+    serialized using :attr:`lock` so that a single :class:`Coprocess` object
+    can be shared by multiple threads.
+    """
+
+    def __init__(self, directory, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        Initialize a :class:`Coprocess` object.
+
+        :param directory: The working directory of the process (a string).
+        :param idle_timeout: The number of seconds after which the process is
+                             terminated when it isn't used (a number or
+                             :data:`None` to disable the timeout).
+        """
+        self.directory = directory
+        self.idle_timeout = idle_timeout
+        self.lock = threading.RLock()
+        self.process = None
+        self.timer = None
+
+    @property
+    def command(self):
+        """
+        The command line of the process (a list of strings).
+
+        The :attr:`command` property needs to be implemented by subclasses.
+        """
+        raise NotImplementedError()
+
+    @property
+    def is_running(self):
+        """:data:`True` if the process is running, :data:`False` otherwise."""
+        return self.process is not None and self.process.poll() is None
+
+    def ensure_running(self):
+        """
+        Start the process if it isn't already running.
+
+        This method also cancels the idle timeout, use :func:`mark_idle()` to
+        restart the idle timeout once the query has been answered.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.is_running:
+            logger.debug("Starting coprocess in %s: %s", format_path(self.directory), ' '.join(self.command))
+            self.process = subprocess.Popen(
+                self.command, cwd=self.directory,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            )
+            self.handle_startup()
+
+    def handle_startup(self):
+        """Hook for subclasses that need to communicate with the process after it has been started."""
+
+    def mark_idle(self):
+        """Start the idle timeout (if enabled)."""
+        if self.idle_timeout is not None and self.is_running:
+            self.timer = threading.Timer(self.idle_timeout, self.close)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def close(self):
+        """Terminate the process (if it's running)."""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.process is not None:
+                logger.debug("Terminating coprocess in %s ..", format_path(self.directory))
+                try:
+                    # Closing the standard input stream signals the end of the
+                    # queries, so the process should exit by itself.
+                    self.process.stdin.close()
+                    self.process.stdout.close()
+                    self.process.wait()
+                except Exception:
+                    self.process.kill()
+                self.process = None
+
+    def __repr__(self):
+        """Generate a human readable representation of a coprocess object."""
+        return "%s(directory=%r)" % (self.__class__.__name__, self.directory)
+
+
+class GitCatFile(Coprocess):
+
+    """
+    Resolve git object names using a long running ``git cat-file --batch-check`` process.
+
+    The ``git cat-file --batch-check`` command reads object names (anything
+    accepted by ``git rev-parse``, except for revision ranges) from its
+    standard input and reports the object id, type and size of each object on
+    its standard output. Because the process keeps running the cost of
+    starting git is only paid once per repository.
+    """
+
+    batch_size = 100
+    """
+    The maximum number of object names written before reading the results (an integer).
+
+    Results are read in batches to avoid a deadlock where git blocks on
+    writing results (because we're not reading them) while we block on writing
+    object names (because git isn't reading them).
+    """
+
+    @property
+    def command(self):
+        """The ``git cat-file --batch-check`` command (a list of strings)."""
+        return ['git', 'cat-file', '--batch-check']
+
+    def resolve(self, names):
+        """
+        Resolve object names to object ids.
+
+        :param names: A list of object names (strings).
+        :returns: A list with an object id (a hexadecimal string) for each
+                  object name that was resolved and :data:`None` for each
+                  object name that couldn't be resolved.
+
+        The query is recorded in
+        :data:`~vcs_repo_mgr.statistics.command_statistics` (as a single
+        command, regardless of the number of object names).
+        """
+        results = []
+        num_bytes = 0
+        timer = Timer()
+        with self.lock:
+            self.ensure_running()
+            try:
+                for i in range(0, len(names), self.batch_size):
+                    batch = names[i:i + self.batch_size]
+                    for name in batch:
+                        if '\n' in name:
+                            raise ValueError("Object names can't contain newlines! (%r)" % name)
+                        self.process.stdin.write(name.encode('UTF-8') + b'\n')
+                    self.process.stdin.flush()
+                    for name in batch:
+                        line = self.process.stdout.readline().decode('UTF-8')
+                        num_bytes += len(line)
+                        if not line:
+                            raise EnvironmentError("The 'git cat-file --batch-check' process exited unexpectedly!")
+                        # Successful lookups are reported as `<id> <type> <size>'
+                        # while failures are reported as `<name> missing' or
+                        # `<name> ambiguous'.
+                        tokens = line.split()
+                        results.append(tokens[0] if len(tokens) == 3 and tokens[2].isdigit() else None)
+            except Exception:
+                command_statistics.record(self.command, timer.elapsed_time, output=num_bytes, failed=True)
+                # Make sure we don't get out of sync with the process.
+                self.close()
+                raise
+            self.mark_idle()
+        command_statistics.record(self.command, timer.elapsed_time, output=num_bytes)
+        return results
+
+
+class HgCommandServer(Coprocess):
+
+    """
+    Run Mercurial commands using a long running ``hg serve --cmdserver pipe`` process.
+
+    Mercurial's `command server`_ accepts commands on its standard input and
+    reports the output and exit code of each command on its standard output
+    using a simple framed protocol (the same protocol used by python-hglib
+    and chg). Because the Python interpreter and Mercurial's extensions are
+    only loaded once this is a lot faster than running ``hg`` for every
+    command.
+
+    .. _command server: https://www.mercurial-scm.org/wiki/CommandServer
+    """
+
+    encoding = 'UTF-8'
+    """The character encoding used to communicate with the command server (a string)."""
+
+    @property
+    def command(self):
+        """The ``hg serve --cmdserver pipe`` command (a list of strings)."""
+        return [
+            'hg', '--encoding', self.encoding, '--repository', self.directory,
+            'serve', '--cmdserver', 'pipe', '--config', 'ui.interactive=False',
+        ]
+
+    def handle_startup(self):
+        """
+        Read the hello message of the command server.
+
+        :raises: :exc:`~exceptions.EnvironmentError` when the command server
+                 doesn't support the ``runcommand`` command.
+        """
+        channel, payload = self.read_message()
+        capabilities = []
+        for line in payload.decode(self.encoding).splitlines():
+            name, _, value = line.partition(':')
+            if name.strip() == 'capabilities':
+                capabilities = value.split()
+        if channel != b'o' or 'runcommand' not in capabilities:
+            raise EnvironmentError("The Mercurial command server doesn't support 'runcommand'!")
+
+    def read_message(self):
+        """
+        Read a single message from the command server.
+
+        :returns: A tuple with two values:
+
+                  1. The channel identifier (a byte string of one character).
+                  2. The payload of the message (a byte string) or for the
+                     input channels ``I`` and ``L`` the maximum number of bytes
+                     requested by the command server (an integer).
+        """
+        header = self.process.stdout.read(5)
+        if len(header) != 5:
+            raise EnvironmentError("The Mercurial command server exited unexpectedly!")
+        channel, length = struct.unpack('>cI', header)
+        if channel in (b'I', b'L'):
+            return channel, length
+        return channel, self.process.stdout.read(length)
+
+    def run(self, arguments):
+        """
+        Run a Mercurial command using the command server.
+
+        :param arguments: The arguments to the ``hg`` program (a list of
+                          strings, without the name of the program and the
+                          ``--repository`` option).
+        :returns: A tuple with three values:
+
+                  1. The exit code of the command (an integer).
+                  2. The standard output of the command (a byte string).
+                  3. The standard error of the command (a byte string).
+        """
+        output = []
+        errors = []
+        with self.lock:
+            self.ensure_running()
+            try:
+                data = b'\0'.join(a.encode(self.encoding) for a in arguments)
+                self.process.stdin.write(b'runcommand\n' + struct.pack('>I', len(data)) + data)
+                self.process.stdin.flush()
+                while True:
+                    channel, payload = self.read_message()
+                    if channel == b'o':
+                        output.append(payload)
+                    elif channel == b'e':
+                        errors.append(payload)
+                    elif channel == b'r':
+                        returncode = struct.unpack('>i', payload)[0]
+                        break
+                    elif channel in (b'I', b'L'):
+                        # We don't provide any input, so we
+                        # respond to input requests with EOF.
+                        self.process.stdin.write(struct.pack('>I', 0))
+                        self.process.stdin.flush()
+                    elif channel.isupper():
+                        # Required channels can't be ignored.
+                        raise EnvironmentError("Unsupported Mercurial command server channel! (%r)" % channel)
+            except Exception:
+                # Make sure we don't get out of sync with the process.
+                self.close()
+                raise
+            self.mark_idle()
+        return returncode, b''.join(output), b''.join(errors)
+
+    def execute(self, *arguments, **options):
+        """
+        Run a Mercurial command using the command server.
+
+        :param arguments: The arguments to the ``hg`` program (strings,
+                          without the name of the program and the
+                          ``--repository`` option).
+        :param options: The keyword arguments `capture`, `check` and
+                        `silent` are supported and have the same meaning as
+                        for :func:`executor.execute()`. Other keyword
+                        arguments are ignored.
+        :returns: The output of the command (a string) when `capture` is
+                  :data:`True`, otherwise a boolean indicating whether the
+                  command succeeded.
+        :raises: :exc:`~executor.ExternalCommandFailed` when the command
+                 fails and `check` is :data:`True` (the default).
+
+        This method mimics :func:`executor.execute()` so that callers can
+        switch between the command server and running ``hg`` directly. The
+        command is recorded in
+        :data:`~vcs_repo_mgr.statistics.command_statistics`.
+        """
+        capture = options.get('capture', False)
+        silent = options.get('silent', False)
+        logger.debug("Running command using Mercurial command server: hg %s", ' '.join(arguments))
+        timer = Timer()
+        try:
+            returncode, output, errors = self.run(arguments)
+        except Exception:
+            command_statistics.record(('hg',) + arguments, timer.elapsed_time, failed=True)
+            raise
+        command_statistics.record(('hg',) + arguments, timer.elapsed_time, output=output, failed=returncode != 0)
+        if not silent:
+            if errors:
+                sys.stderr.write(errors.decode(self.encoding, 'replace'))
+            if output and not capture:
+                sys.stdout.write(output.decode(self.encoding, 'replace'))
+        if returncode != 0 and options.get('check', True):
+            command = ExternalCommand('hg', *arguments, directory=self.directory, returncode=returncode)
+            raise command.error_type(command)
+        if capture:
+            text = output.decode(self.encoding)
+            stripped = text.strip()
+            return stripped if '\n' not in stripped else text
+        return returncode == 0
@@ -75,3 +75,24 @@ class MergeConflictError(VcsRepoMgrError):
     Raised by :func:`~vcs_repo_mgr.Repository.merge()` when it performs a merge
     that results in merge conflicts.
     """
+
+
+class RemoteQueryError(VcsRepoMgrError):
+
+    """
+    Exception raised when the daemon reports that a query failed.
+
+    Raised by :func:`~vcs_repo_mgr.server.RepositoryClient.answer()` when the
+    daemon started by ``vcs-tool --serve`` fails to answer a query.
+    """
+
+
+class LockTimeoutError(VcsRepoMgrError):
+
+    """
+    Exception raised when a lock can't be acquired in time.
+
+    Raised by :func:`~vcs_repo_mgr.locking.FileLock.acquire()` when the lock
+    isn't released by other processes or threads within the configured
+    timeout (refer to :attr:`~vcs_repo_mgr.Repository.lock_timeout`).
+    """
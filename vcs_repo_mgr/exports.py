@@ -0,0 +1,256 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Content addressed caching of exported trees.
+
+The :class:`ExportCache` class is used by :func:`~vcs_repo_mgr.Repository.export()`
+when :attr:`~vcs_repo_mgr.Repository.export_cache` is set. It keeps one
+pristine export of each tree (identified by the tree id reported by
+:func:`~vcs_repo_mgr.Repository.find_tree_id()`) so that exporting a revision
+whose tree was exported before only requires copying (or hard linking) files
+instead of running ``git archive``, ``hg archive`` or ``bzr export`` again.
+"""
+
+# Standard library modules.
+import errno
+import logging
+import os
+import shutil
+import tempfile
+
+# External dependencies.
+from executor import execute
+from humanfriendly import format_path, format_size
+
+# Modules included in our package.
+from vcs_repo_mgr.locking import FileLock
+from vcs_repo_mgr.statistics import instrument
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+# Record statistics about all execute() calls.
+execute = instrument(execute)
+
+DEFAULT_MAX_SIZE = 1024 ** 3
+"""The default size budget of an :class:`ExportCache` in bytes (an integer, 1 GiB)."""
+
+MATERIALIZE_METHODS = ('copy', 'hardlink')
+"""The names of the supported ways to materialize cached trees (a tuple of strings)."""
+
+
+class ExportCache(object):
+
+    """
+    A directory with pristine exports of trees, evicted in least recently used order.
+
+    The cache directory contains a subdirectory for each cached tree (named
+    after the tree id) and a file with the suffix ``.size`` that records the
+    disk usage of the tree. The modification time of a tree's directory is
+    updated whenever the tree is used, which makes it possible to evict the
+    least recently used trees when the cache exceeds :attr:`max_size`.
+
+    Multiple processes can safely share a cache directory: trees are exported
+    to a temporary directory which is renamed into place when the export is
+    complete and evictions wait for concurrent exports to finish (this is
+    coordinated using a :class:`~vcs_repo_mgr.locking.FileLock` on the file
+    ``.lock`` in the cache directory).
+
+    .. py:attribute:: directory
+
+       The pathname of the cache directory (a string).
+
+    .. py:attribute:: max_size
+
+       The size budget of the cache in bytes (an integer).
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        """
+        Initialize an :class:`ExportCache` object.
+
+        :param directory: Used to set :attr:`directory` (a string, the
+                          directory is created when it doesn't exist yet).
+        :param max_size: Used to set :attr:`max_size` (an integer, defaults to
+                         :data:`DEFAULT_MAX_SIZE`).
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    def export(self, tree_id, directory, exporter, method='copy'):
+        """
+        Export a tree using the cache.
+
+        :param tree_id: The tree id of the tree to export (a string).
+        :param directory: The directory where the tree should be exported (a
+                          string).
+        :param exporter: A callable that exports the tree to the directory
+                         given as its only argument (used when the tree isn't
+                         cached yet).
+        :param method: One of the strings in :data:`MATERIALIZE_METHODS`
+                       (refer to :func:`materialize()`).
+        :returns: :data:`True` if the tree was already cached, :data:`False`
+                  if the tree was exported using `exporter`.
+        """
+        if method not in MATERIALIZE_METHODS:
+            msg = "Unsupported materialize method! (%r)"
+            raise ValueError(msg % method)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        entry = self.get_entry(tree_id)
+        with self.lock(exclusive=False):
+            if os.path.isdir(entry):
+                logger.debug("Using cached export of tree %s ..", tree_id)
+                self.touch(tree_id)
+                self.materialize(entry, directory, method)
+                return True
+        logger.debug("Adding tree %s to export cache %s ..", tree_id, format_path(self.directory))
+        temporary_directory = tempfile.mkdtemp(dir=self.directory, prefix='.export-')
+        try:
+            exporter(temporary_directory)
+            with open(self.get_size_file(tree_id), 'w') as handle:
+                handle.write('%i\n' % get_disk_usage(temporary_directory))
+            with self.lock(exclusive=False):
+                try:
+                    os.rename(temporary_directory, entry)
+                except OSError as e:
+                    # Another process exported the same tree in the meantime.
+                    if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                        raise
+                self.touch(tree_id)
+                self.materialize(entry, directory, method)
+        finally:
+            if os.path.isdir(temporary_directory):
+                shutil.rmtree(temporary_directory)
+        self.evict(keep=tree_id)
+        return False
+
+    def materialize(self, entry, directory, method):
+        """
+        Copy a cached tree to a directory.
+
+        :param entry: The pathname of the cached tree (a string).
+        :param directory: The target directory (a string, it's created when it
+                          doesn't exist yet).
+        :param method: One of the strings in :data:`MATERIALIZE_METHODS`:
+
+                       ``copy``
+                        Copy the files using ``cp --reflink=auto`` which
+                        clones the files on file systems that support it (like
+                        Btrfs and XFS) and copies them otherwise.
+                       ``hardlink``
+                        Hard link the files. This is the fastest option but
+                        the exported files share their contents and metadata
+                        with the cache, so they must not be modified in place.
+                        Files are copied when they can't be hard linked (for
+                        example because the target is on a different file
+                        system).
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if method == 'copy':
+            execute('cp', '--archive', '--reflink=auto', '--remove-destination',
+                    os.path.join(entry, '.'), directory)
+            return
+        for root, dirs, files in os.walk(entry):
+            target_root = os.path.join(directory, os.path.relpath(root, entry))
+            for name in list(dirs):
+                source = os.path.join(root, name)
+                target = os.path.join(target_root, name)
+                if os.path.islink(source):
+                    # os.walk() doesn't descend into symbolic links to directories.
+                    files.append(name)
+                elif not os.path.isdir(target):
+                    os.mkdir(target)
+            for name in files:
+                source = os.path.join(root, name)
+                target = os.path.join(target_root, name)
+                if os.path.lexists(target):
+                    os.unlink(target)
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), target)
+                else:
+                    try:
+                        os.link(source, target)
+                    except OSError:
+                        shutil.copy2(source, target)
+
+    def evict(self, keep=None):
+        """
+        Evict the least recently used trees until the cache fits :attr:`max_size`.
+
+        :param keep: The tree id of a tree that must not be evicted (a string
+                     or :data:`None`).
+        :returns: The number of evicted trees (an integer).
+        """
+        with self.lock(exclusive=True):
+            entries = []
+            total_size = 0
+            for tree_id in os.listdir(self.directory):
+                entry = self.get_entry(tree_id)
+                if tree_id.startswith('.') or not os.path.isdir(entry):
+                    continue
+                try:
+                    with open(self.get_size_file(tree_id)) as handle:
+                        size = int(handle.read())
+                except Exception:
+                    size = get_disk_usage(entry)
+                entries.append((os.path.getmtime(entry), tree_id, size))
+                total_size += size
+            num_evicted = 0
+            for last_used, tree_id, size in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                if tree_id != keep:
+                    logger.debug("Evicting tree %s from export cache (%s) ..", tree_id, format_size(size))
+                    shutil.rmtree(self.get_entry(tree_id))
+                    if os.path.isfile(self.get_size_file(tree_id)):
+                        os.unlink(self.get_size_file(tree_id))
+                    total_size -= size
+                    num_evicted += 1
+            return num_evicted
+
+    def touch(self, tree_id):
+        """Mark a cached tree as the most recently used tree."""
+        os.utime(self.get_entry(tree_id), None)
+
+    def get_entry(self, tree_id):
+        """Get the pathname of the cached tree with the given tree id (a string)."""
+        return os.path.join(self.directory, tree_id)
+
+    def get_size_file(self, tree_id):
+        """Get the pathname of the file that records the disk usage of a cached tree (a string)."""
+        return os.path.join(self.directory, '%s.size' % tree_id)
+
+    def lock(self, exclusive):
+        """
+        Lock the cache directory.
+
+        :param exclusive: :data:`True` for an exclusive lock, :data:`False`
+                          for a shared lock.
+        :returns: A :class:`~vcs_repo_mgr.locking.FileLock` object (to be
+                  used as a context manager).
+        """
+        return FileLock(os.path.join(self.directory, '.lock'), exclusive=exclusive)
+
+    def __repr__(self):
+        """Generate a human readable representation of an export cache."""
+        return "%s(directory=%r, max_size=%r)" % (self.__class__.__name__, self.directory, self.max_size)
+
+
+def get_disk_usage(directory):
+    """
+    Calculate the combined size of the files in a directory tree.
+
+    :param directory: The pathname of a directory (a string).
+    :returns: The combined size in bytes (an integer).
+    """
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            total += os.lstat(os.path.join(root, name)).st_size
+    return total
@@ -0,0 +1,214 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Update many configured repositories concurrently.
+
+The :func:`update_repositories()` function creates or updates all of the
+repositories defined in the configuration files (or a given selection of
+repositories) using a pool of threads. Because updating mirrors is mostly a
+matter of waiting for the network this can be a lot faster than updating the
+repositories one at a time, while the number of concurrent updates per remote
+host is limited to avoid overloading individual servers.
+"""
+
+# Standard library modules.
+import logging
+import re
+import threading
+
+# External dependencies.
+from humanfriendly import Timer
+from humanfriendly.text import pluralize
+from six.moves import urllib_parse as urlparse
+
+# Modules included in our package.
+from vcs_repo_mgr import find_configured_repositories, map_concurrently
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST_CONCURRENCY = 2
+"""The default maximum number of concurrent updates per remote host (an integer)."""
+
+SCP_LIKE_LOCATION = re.compile(r'^(?:[^@/:]+@)?([^@/:]+):')
+"""A compiled regular expression that matches scp-like locations (e.g. ``git@github.com:xolox/vcs-repo-mgr``)."""
+
+
+def update_repositories(repositories=None, concurrency=None, host_concurrency=DEFAULT_HOST_CONCURRENCY):
+    """
+    Create or update multiple repositories concurrently.
+
+    :param repositories: A dictionary with repository names (strings) as keys
+                         and :class:`~vcs_repo_mgr.Repository` objects as
+                         values (defaults to the result of
+                         :func:`~vcs_repo_mgr.find_configured_repositories()`).
+    :param concurrency: The maximum number of concurrent updates (an integer,
+                        defaults to :data:`~vcs_repo_mgr.DEFAULT_CONCURRENCY`).
+    :param host_concurrency: The maximum number of concurrent updates per
+                             remote host (an integer or :data:`None` to
+                             disable the limit, defaults to
+                             :data:`DEFAULT_HOST_CONCURRENCY`).
+    :returns: A list of :class:`UpdateResult` objects (one for each
+              repository, ordered by repository name).
+
+    Failing updates are logged and reported using :attr:`UpdateResult.exception`,
+    they don't prevent other repositories from being updated. Repository
+    definitions that share a local directory are only updated once.
+    """
+    timer = Timer()
+    if repositories is None:
+        repositories = find_configured_repositories()
+    # Group the repository names by local directory.
+    directories = []
+    names = {}
+    for name, repository in sorted(repositories.items()):
+        if repository.local not in names:
+            directories.append(repository.local)
+            names[repository.local] = []
+        names[repository.local].append(name)
+    # Prepare the per host concurrency limits.
+    semaphores = {}
+    if host_concurrency:
+        for name, repository in repositories.items():
+            host = find_remote_host(repository.remote)
+            if host and host not in semaphores:
+                semaphores[host] = threading.Semaphore(host_concurrency)
+
+    def update(directory):
+        repository = repositories[names[directory][0]]
+        semaphore = semaphores.get(find_remote_host(repository.remote))
+        if semaphore:
+            semaphore.acquire()
+        try:
+            return update_repository(names[directory][0], repository)
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    results = []
+    for directory, result in zip(directories, map_concurrently(update, directories, concurrency=concurrency)):
+        for name in names[directory]:
+            results.append(UpdateResult(
+                name=name,
+                repository=repositories[name],
+                created=result.created,
+                duration=result.duration,
+                exception=result.exception,
+            ))
+    results.sort(key=lambda r: r.name)
+    failures = [r for r in results if not r.succeeded]
+    logger.info("Updated %s in %s (%s).",
+                pluralize(len(results), "repository", "repositories"), timer,
+                pluralize(len(failures), "failure") if failures else "no failures")
+    return results
+
+
+def update_repository(name, repository):
+    """
+    Create or update a single repository (used by :func:`update_repositories()`).
+
+    :param name: The name of the repository (a string).
+    :param repository: A :class:`~vcs_repo_mgr.Repository` object.
+    :returns: An :class:`UpdateResult` object.
+    """
+    timer = Timer()
+    created = False
+    exception = None
+    try:
+        created = repository.create()
+        if not created:
+            repository.update()
+    except Exception as e:
+        logger.exception("Failed to update %s repository %s!", repository.friendly_name, name)
+        exception = e
+    return UpdateResult(
+        name=name,
+        repository=repository,
+        created=created,
+        duration=timer.elapsed_time,
+        exception=exception,
+    )
+
+
+def find_remote_host(remote):
+    """
+    Find the name of the host that serves a remote repository.
+
+    :param remote: The location of a remote repository (a string or :data:`None`).
+    :returns: The name of the host (a string) or :data:`None` when the
+              location doesn't refer to a remote host (e.g. because it's the
+              pathname of a local directory).
+    """
+    if remote:
+        if '://' in remote:
+            return urlparse.urlparse(remote).hostname or None
+        match = SCP_LIKE_LOCATION.match(remote)
+        if match:
+            return match.group(1)
+
+
+class UpdateResult(object):
+
+    """
+    The result of creating or updating a repository using :func:`update_repositories()`.
+
+    .. py:attribute:: name
+
+       The name of the repository (a string).
+
+    .. py:attribute:: repository
+
+       The :class:`~vcs_repo_mgr.Repository` object.
+
+    .. py:attribute:: created
+
+       :data:`True` if the local clone was created, :data:`False` if it
+       already existed.
+
+    .. py:attribute:: duration
+
+       The number of seconds spent creating or updating the repository (a
+       floating point number).
+
+    .. py:attribute:: exception
+
+       The exception that was raised while creating or updating the
+       repository (an :exc:`~exceptions.Exception` object or :data:`None`).
+    """
+
+    def __init__(self, name, repository, created, duration, exception):
+        """
+        Initialize an update result.
+
+        :param name: The name of the repository (a string).
+        :param repository: The :class:`~vcs_repo_mgr.Repository` object.
+        :param created: :data:`True` if the local clone was created,
+                        :data:`False` otherwise.
+        :param duration: The number of seconds spent (a number).
+        :param exception: The exception that was raised (an
+                          :exc:`~exceptions.Exception` object or
+                          :data:`None`).
+        """
+        self.name = name
+        self.repository = repository
+        self.created = created
+        self.duration = duration
+        self.exception = exception
+
+    @property
+    def succeeded(self):
+        """:data:`True` if the repository was created or updated successfully, :data:`False` otherwise."""
+        return self.exception is None
+
+    def __repr__(self):
+        """Generate a human readable representation of an update result."""
+        return "%s(%s)" % (self.__class__.__name__, ', '.join([
+            "name=%r" % self.name,
+            "created=%r" % self.created,
+            "duration=%.2f" % self.duration,
+            "exception=%r" % self.exception,
+        ]))
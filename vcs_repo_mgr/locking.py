@@ -0,0 +1,390 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Advisory file locks that coordinate multiple processes and threads.
+
+The :class:`FileLock` class is used by :func:`~vcs_repo_mgr.Repository.update()`
+to make sure that concurrent requests to update the same local clone result
+in a single fetch (see :attr:`~vcs_repo_mgr.Repository.update_lock_file`) and
+by :class:`~vcs_repo_mgr.exports.ExportCache` to coordinate access to a shared
+cache directory.
+
+The :class:`ReadWriteLock` class is used by :func:`~vcs_repo_mgr.Repository.lock()`
+to allow concurrent queries of a local clone while making sure that operations
+that change the local clone have exclusive access (see
+:attr:`~vcs_repo_mgr.Repository.lock_file`).
+"""
+
+# Standard library modules.
+import errno
+import fcntl
+import logging
+import os
+import threading
+import time
+
+# External dependencies.
+from humanfriendly import Timer, format_path, format_timespan
+
+# Modules included in our package.
+from vcs_repo_mgr.exceptions import LockTimeoutError
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+SLOW_LOCK_THRESHOLD = 1
+"""Waiting for a lock longer than this number of seconds is logged (an integer)."""
+
+held_locks = threading.local()
+"""The locks held by :class:`ReadWriteLock` objects in the current thread (a :class:`threading.local` object)."""
+
+
+class FileLock(object):
+
+    """
+    An advisory lock on a file, based on :func:`fcntl.flock()`.
+
+    Because each :class:`FileLock` object opens the file separately the lock
+    coordinates threads in the same process as well as separate processes.
+    The lock is released automatically when the process holding it dies.
+    :class:`FileLock` objects can be used as context managers.
+
+    .. py:attribute:: filename
+
+       The pathname of the lock file (a string, the file is created when it
+       doesn't exist yet). An existing lock file is opened read-only, which
+       is enough for :func:`fcntl.flock()`. When the lock file can't be opened
+       or created due to missing permissions (for example a shared mirror in
+       a read-only directory) no lock is taken at all (see
+       :func:`open_lock_file()`).
+
+    .. py:attribute:: exclusive
+
+       :data:`True` for an exclusive lock, :data:`False` for a shared lock
+       (multiple shared locks can be held at the same time, but not while an
+       exclusive lock is held).
+
+    .. py:attribute:: timeout
+
+       The maximum number of seconds to wait for the lock (a number or
+       :data:`None` to wait indefinitely).
+
+    .. py:attribute:: wait_time
+
+       The number of seconds spent waiting for the lock by the most recent
+       call to :func:`acquire()` or :func:`convert()` (a float).
+    """
+
+    def __init__(self, filename, exclusive=True, timeout=None):
+        """
+        Initialize a :class:`FileLock` object.
+
+        :param filename: Used to set :attr:`filename`.
+        :param exclusive: Used to set :attr:`exclusive` (a boolean, defaults
+                          to :data:`True`).
+        :param timeout: Used to set :attr:`timeout` (defaults to :data:`None`).
+        """
+        self.filename = filename
+        self.exclusive = exclusive
+        self.timeout = timeout
+        self.wait_time = 0.0
+        self.handle = None
+
+    @property
+    def is_locked(self):
+        """:data:`True` if the lock is held by this object, :data:`False` otherwise."""
+        return self.handle is not None
+
+    def acquire(self):
+        """
+        Acquire the lock, waiting for other holders to release it.
+
+        :raises: :exc:`~exceptions.RuntimeError` when the lock is already
+                 held by this object and
+                 :exc:`~vcs_repo_mgr.exceptions.LockTimeoutError` when the
+                 lock can't be acquired within :attr:`timeout` seconds.
+        """
+        if self.is_locked:
+            raise RuntimeError("Lock %s is already held!" % format_path(self.filename))
+        handle = self.open_lock_file()
+        if handle is None:
+            return
+        try:
+            self.wait_for_lock(handle, self.exclusive)
+        except Exception:
+            handle.close()
+            raise
+        logger.debug("Acquired %s lock %s.", "exclusive" if self.exclusive else "shared", format_path(self.filename))
+        self.handle = handle
+
+    def open_lock_file(self):
+        """
+        Open the lock file, creating it when it doesn't exist yet.
+
+        :returns: A file object or :data:`None` when the lock file can't be
+                  opened (or created) due to missing permissions or a
+                  read-only file system.
+
+        Locking is advisory and users that can't create the lock file also
+        can't change the files that it protects, so in that case the caller
+        proceeds without a lock.
+        """
+        for mode in ('r', 'a'):
+            try:
+                return open(self.filename, mode)
+            except (IOError, OSError) as e:
+                if mode == 'r' and e.errno == errno.ENOENT:
+                    continue
+                if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+                    raise
+                logger.debug("Proceeding without lock because %s can't be opened! (%s)",
+                             format_path(self.filename), e)
+                return None
+
+    def convert(self, exclusive, timeout=None):
+        """
+        Convert a held lock between shared and exclusive.
+
+        :param exclusive: :data:`True` to convert the lock to an exclusive
+                          lock, :data:`False` to convert it to a shared lock.
+        :param timeout: Overrides :attr:`timeout` for this conversion
+                        (optional, :attr:`timeout` isn't changed).
+        :raises: :exc:`~vcs_repo_mgr.exceptions.LockTimeoutError` when the
+                 lock can't be converted within the timeout. The original
+                 lock is restored (respecting the same timeout) and when
+                 that fails as well the lock is released.
+
+        .. warning:: Converting a lock is not atomic: The lock is released
+                     while waiting for the new lock, so other processes or
+                     threads can acquire (and change the files protected by)
+                     the lock while it's being converted. Callers that need
+                     to change the files protected by a shared lock should
+                     do so before acquiring the shared lock, or re-check
+                     their assumptions after the conversion.
+        """
+        if exclusive != self.exclusive and self.handle is None:
+            # There's no lock file to convert (see open_lock_file()).
+            self.exclusive = exclusive
+        elif exclusive != self.exclusive:
+            try:
+                self.wait_for_lock(self.handle, exclusive, timeout=timeout)
+            except LockTimeoutError:
+                # A failed conversion can drop the original lock.
+                wait_time = self.wait_time
+                try:
+                    self.wait_for_lock(self.handle, self.exclusive, timeout=timeout)
+                except LockTimeoutError:
+                    handle, self.handle = self.handle, None
+                    handle.close()
+                    logger.warning("Lost %s lock %s while converting it!",
+                                   "exclusive" if self.exclusive else "shared",
+                                   format_path(self.filename))
+                self.wait_time += wait_time
+                raise
+            logger.debug("Converted lock %s to %s lock.", format_path(self.filename),
+                         "exclusive" if exclusive else "shared")
+            self.exclusive = exclusive
+
+    def release(self):
+        """Release the lock (it's not an error when the lock isn't held)."""
+        if self.is_locked:
+            handle, self.handle = self.handle, None
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            handle.close()
+            logger.debug("Released lock %s.", format_path(self.filename))
+
+    def wait_for_lock(self, handle, exclusive, timeout=None):
+        """
+        Lock an open file, respecting :attr:`timeout`.
+
+        :param handle: The open lock file (a file object).
+        :param exclusive: :data:`True` for an exclusive lock, :data:`False`
+                          for a shared lock.
+        :param timeout: Overrides :attr:`timeout` (optional).
+        :raises: :exc:`~vcs_repo_mgr.exceptions.LockTimeoutError` when the
+                 file can't be locked within the timeout.
+
+        Sets :attr:`wait_time` and logs slow lock acquisitions (see
+        :data:`SLOW_LOCK_THRESHOLD`).
+        """
+        timer = Timer()
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is None:
+            fcntl.flock(handle.fileno(), mode)
+        else:
+            while True:
+                try:
+                    fcntl.flock(handle.fileno(), mode | fcntl.LOCK_NB)
+                    break
+                except (IOError, OSError) as e:
+                    if e.errno not in (errno.EACCES, errno.EAGAIN):
+                        raise
+                if timer.elapsed_time >= timeout:
+                    self.wait_time = timer.elapsed_time
+                    msg = "Timeout while waiting for %s lock %s! (gave up after %s)"
+                    raise LockTimeoutError(msg % ("exclusive" if exclusive else "shared",
+                                                  format_path(self.filename), format_timespan(timeout)))
+                time.sleep(0.05)
+        self.wait_time = timer.elapsed_time
+        if self.wait_time >= SLOW_LOCK_THRESHOLD:
+            logger.info("Waited %s for %s lock %s.", timer, "exclusive" if exclusive else "shared",
+                        format_path(self.filename))
+
+    def __enter__(self):
+        """Acquire the lock when entering the context."""
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Release the lock when leaving the context."""
+        self.release()
+
+    def __repr__(self):
+        """Generate a human readable representation of a lock."""
+        return "%s(filename=%r, exclusive=%r)" % (self.__class__.__name__, self.filename, self.exclusive)
+
+
+class ReadWriteLock(object):
+
+    """
+    A re-entrant reader/writer lock based on :class:`FileLock`.
+
+    :class:`ReadWriteLock` objects are context managers that acquire a shared
+    or exclusive lock on a lock file. Within a thread the locks are re-entrant:
+    When the thread already holds a lock on the file, entering the context
+    reuses that lock (a shared lock is converted to an exclusive lock when
+    necessary, and converted back when leaving the context). This means
+    methods that take a lock can call other methods that take a lock.
+
+    When the filename is :data:`None` no lock is taken (this is used for
+    local clones that haven't been created yet).
+    """
+
+    def __init__(self, filename, exclusive=False, timeout=None, statistics=None):
+        """
+        Initialize a :class:`ReadWriteLock` object.
+
+        :param filename: The pathname of the lock file (a string or :data:`None`).
+        :param exclusive: :data:`True` for an exclusive lock, :data:`False`
+                          for a shared lock (the default).
+        :param timeout: Refer to :attr:`FileLock.timeout`.
+        :param statistics: A :class:`LockStatistics` object that records the
+                           time spent waiting for the lock (optional).
+        """
+        self.filename = os.path.abspath(filename) if filename else None
+        self.exclusive = exclusive
+        self.timeout = timeout
+        self.statistics = statistics
+        self.acquired = False
+        self.converted = False
+
+    def __enter__(self):
+        """Acquire (or reuse) the lock when entering the context."""
+        if not hasattr(held_locks, 'locks'):
+            held_locks.locks = {}
+        if self.filename is None:
+            return self
+        lock = held_locks.locks.get(self.filename)
+        try:
+            if lock is None:
+                lock = FileLock(self.filename, exclusive=self.exclusive, timeout=self.timeout)
+                lock.acquire()
+                held_locks.locks[self.filename] = lock
+                self.acquired = True
+            elif self.exclusive and not lock.exclusive:
+                lock.convert(exclusive=True, timeout=self.timeout)
+                self.converted = True
+            else:
+                return self
+        except LockTimeoutError:
+            if self.statistics:
+                self.statistics.record_timeout(lock.wait_time)
+            raise
+        if self.statistics:
+            self.statistics.record(lock.wait_time)
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Release (or restore) the lock when leaving the context."""
+        lock = held_locks.locks.get(self.filename)
+        if self.converted:
+            self.converted = False
+            lock.convert(exclusive=False)
+        elif self.acquired:
+            self.acquired = False
+            del held_locks.locks[self.filename]
+            lock.release()
+
+    def __repr__(self):
+        """Generate a human readable representation of a lock."""
+        return "%s(filename=%r, exclusive=%r)" % (self.__class__.__name__, self.filename, self.exclusive)
+
+
+class LockStatistics(object):
+
+    """
+    Statistics about the time spent waiting for locks.
+
+    .. py:attribute:: acquisitions
+
+       The number of times a lock was acquired (an integer).
+
+    .. py:attribute:: timeouts
+
+       The number of times a lock couldn't be acquired in time (an integer).
+
+    .. py:attribute:: total_wait_time
+
+       The combined number of seconds spent waiting for locks (a float).
+
+    .. py:attribute:: max_wait_time
+
+       The longest time spent waiting for a lock in seconds (a float).
+    """
+
+    def __init__(self):
+        """Initialize a :class:`LockStatistics` object."""
+        self.lock = threading.Lock()
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def average_wait_time(self):
+        """The average number of seconds spent waiting for a lock (a float)."""
+        return self.total_wait_time / self.acquisitions if self.acquisitions else 0.0
+
+    def record(self, wait_time):
+        """
+        Record that a lock was acquired.
+
+        :param wait_time: The number of seconds spent waiting for the lock (a float).
+        """
+        with self.lock:
+            self.acquisitions += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def record_timeout(self, wait_time):
+        """
+        Record that a lock couldn't be acquired in time.
+
+        :param wait_time: The number of seconds spent waiting for the lock (a float).
+        """
+        with self.lock:
+            self.timeouts += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def __repr__(self):
+        """Generate a human readable representation of lock statistics."""
+        return "%s(acquisitions=%i, timeouts=%i, total_wait_time=%.2f, max_wait_time=%.2f)" % (
+            self.__class__.__name__, self.acquisitions, self.timeouts, self.total_wait_time, self.max_wait_time,
+        )
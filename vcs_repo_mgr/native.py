@@ -0,0 +1,507 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Pure Python readers for version control metadata.
+
+Listing the branches and tags of a repository using the command line
+interface of a version control system means starting a new process that
+often does more work than needed. For repositories with many branches or tags
+it's a lot faster to read the on-disk metadata directly, which is what the
+readers in this module do. They are careful to only do so when they
+understand the on-disk format, otherwise the caller is expected to fall back
+to the command line interface.
+"""
+
+# Standard library modules.
+import binascii
+import logging
+import mmap
+import os
+import re
+import struct
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+GIT_OBJECT_ID = re.compile('^[0-9a-f]{40}([0-9a-f]{24})?$')
+"""A compiled regular expression that matches git object ids (SHA-1 and SHA-256)."""
+
+SUPPORTED_GIT_EXTENSIONS = ('noop', 'objectformat', 'partialclone', 'preciousobjects', 'worktreeconfig')
+"""The git repository format extensions that don't affect :class:`GitRefReader` (a tuple of strings)."""
+
+SUPPORTED_HG_REQUIREMENTS = (
+    'bookmarksinstore', 'dirstate-v2', 'dotencode', 'exp-archived-phase', 'fncache', 'generaldelta',
+    'internal-phase', 'persistent-nodemap', 'revlog-compression-zstd', 'revlogv1', 'share-safe',
+    'sparserevlog', 'store',
+)
+"""The Mercurial repository requirements that don't affect :class:`HgCacheReader` (a tuple of strings)."""
+
+HG_NULL_ID = '0' * 40
+"""The global revision id of Mercurial's null revision (a string)."""
+
+MAX_INDEX_SCANS = 10
+"""The maximum number of full changelog index scans before falling back to the ``hg`` program (an integer)."""
+
+
+class GitRefReader(object):
+
+    """
+    Read git references (branches and tags) without running git.
+
+    Git stores references in two places: The file ``packed-refs`` contains
+    many references (one per line) while "loose" references are stored as
+    individual files in the ``refs`` directory. Loose references take
+    precedence over packed references. The ``packed-refs`` file is memory
+    mapped so that large files (with tens of thousands of tags) aren't copied
+    into memory before they are parsed.
+
+    .. py:attribute:: directory
+
+       The pathname of the git directory (a string), this is the ``.git``
+       directory of a repository with a working tree.
+    """
+
+    def __init__(self, directory):
+        """
+        Initialize a :class:`GitRefReader` object.
+
+        :param directory: The pathname of the git directory (a string).
+        """
+        self.directory = directory
+
+    @property
+    def is_supported(self):
+        """
+        :data:`True` if the references can be read by :class:`GitRefReader`, :data:`False` otherwise.
+
+        References can't be read when the git directory isn't a regular
+        directory, when the git directory is a linked worktree (where the
+        references are spread over multiple directories) or when the
+        repository format uses an extension that :class:`GitRefReader`
+        doesn't know about (like the ``reftable`` reference storage format).
+        """
+        if not os.path.isfile(os.path.join(self.directory, 'config')):
+            return False
+        if os.path.exists(os.path.join(self.directory, 'commondir')):
+            return False
+        config = self.read_config()
+        try:
+            version = int(config.get('core.repositoryformatversion', '0'))
+        except ValueError:
+            return False
+        if version == 0:
+            return True
+        elif version == 1:
+            for name, value in config.items():
+                section, _, key = name.partition('.')
+                if section == 'extensions':
+                    if key == 'refstorage':
+                        if value.lower() != 'files':
+                            return False
+                    elif key not in SUPPORTED_GIT_EXTENSIONS:
+                        return False
+            return True
+        return False
+
+    def read_config(self):
+        """
+        Read the repository specific git configuration file.
+
+        :returns: A dictionary with option names of the form ``section.key``
+                  (lowercase strings) as keys and option values (strings) as
+                  values. Options in subsections are not included.
+        """
+        options = {}
+        section = None
+        with open(os.path.join(self.directory, 'config')) as handle:
+            for line in handle:
+                line = line.strip()
+                if line.startswith('['):
+                    header = line[1:].partition(']')[0].strip()
+                    section = None if ' ' in header or '"' in header else header.lower()
+                elif section and line and not line.startswith(('#', ';')):
+                    key, _, value = line.partition('=')
+                    options['%s.%s' % (section, key.strip().lower())] = value.strip()
+        return options
+
+    def find_refs(self, namespace):
+        """
+        Find the references in the given namespace.
+
+        :param namespace: The namespace of the references (a string like
+                          ``refs/heads/`` or ``refs/tags/``).
+        :returns: A list of tuples with two strings each: The name of the
+                  reference (with the namespace removed) and the object id
+                  that the reference points to. The list is sorted by name.
+
+        Symbolic references are resolved (references that can't be resolved
+        are ignored). For annotated tags the object id of the tag object is
+        reported, just like ``git show-ref --tags`` does (refer to
+        :func:`read_packed_refs()` for the ids of the tagged commits).
+        """
+        packed_refs, peeled_refs = self.read_packed_refs()
+        loose_refs = self.read_loose_refs(namespace)
+        refs = dict(packed_refs)
+        refs.update(loose_refs)
+        results = []
+        for name, value in refs.items():
+            if name.startswith(namespace):
+                object_id = self.resolve_ref(value, refs)
+                if object_id:
+                    results.append((name[len(namespace):], object_id))
+        return sorted(results)
+
+    def resolve_ref(self, value, refs, limit=5):
+        """
+        Resolve a (possibly symbolic) reference.
+
+        :param value: The value of a reference (an object id or a string of the
+                      form ``ref: refs/heads/master``).
+        :param refs: A dictionary with all known references.
+        :param limit: The maximum number of symbolic references to follow.
+        :returns: An object id (a string) or :data:`None`.
+        """
+        for i in range(limit):
+            if not value.startswith('ref:'):
+                return value if GIT_OBJECT_ID.match(value) else None
+            value = refs.get(value[len('ref:'):].strip(), '')
+            if not value:
+                return None
+
+    def read_packed_refs(self):
+        """
+        Read the ``packed-refs`` file.
+
+        :returns: A tuple with two dictionaries that map reference names to
+                  object ids. The first dictionary contains the packed
+                  references while the second dictionary contains the peeled
+                  object ids of annotated tags (the commits that they point
+                  to), for those tags that are peeled in ``packed-refs``.
+        """
+        refs = {}
+        peeled = {}
+        filename = os.path.join(self.directory, 'packed-refs')
+        if os.path.isfile(filename) and os.path.getsize(filename) > 0:
+            with open(filename, 'rb') as handle:
+                contents = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    name = None
+                    for line in iter(contents.readline, b''):
+                        line = line.rstrip()
+                        if line.startswith(b'^'):
+                            # Peeled object id of the preceding annotated tag.
+                            if name:
+                                peeled[name] = line[1:].decode('ascii')
+                        elif line and not line.startswith(b'#'):
+                            object_id, _, name = line.decode('UTF-8').partition(' ')
+                            refs[name] = object_id
+                finally:
+                    contents.close()
+        return refs, peeled
+
+    def read_loose_refs(self, namespace):
+        """
+        Read the loose references in the given namespace.
+
+        :param namespace: The namespace of the references (a string like
+                          ``refs/heads/`` or ``refs/tags/``).
+        :returns: A dictionary that maps reference names to their values (an
+                  object id or a symbolic reference).
+        """
+        refs = {}
+        root = os.path.join(self.directory, *namespace.strip('/').split('/'))
+        for directory, subdirectories, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith('.lock'):
+                    continue
+                pathname = os.path.join(directory, filename)
+                name = os.path.relpath(pathname, self.directory).replace(os.sep, '/')
+                with open(pathname) as handle:
+                    value = handle.read().strip()
+                if value:
+                    refs[name] = value
+        return refs
+
+
+class HgCacheReader(object):
+
+    """
+    Read Mercurial branches and tags from Mercurial's own on-disk caches.
+
+    Mercurial caches the heads of branches in ``.hg/cache/branch2-*`` files
+    and the global tags (defined in ``.hgtags`` files) in
+    ``.hg/cache/tags2-*`` files. Both caches record the tip of the changelog
+    that they are valid for. :class:`HgCacheReader` only uses a cache when
+    its tip matches the tip of the changelog and no revisions were filtered
+    while the cache was computed (which means the cache describes all
+    revisions), otherwise :data:`None` is returned so that the caller can
+    fall back to the ``hg`` program (which refreshes the caches).
+
+    Revision numbers are found by searching the changelog index (the file
+    ``.hg/store/00changelog.i``) which is memory mapped for this purpose.
+
+    .. py:attribute:: directory
+
+       The pathname of the ``.hg`` directory (a string).
+    """
+
+    def __init__(self, directory):
+        """
+        Initialize an :class:`HgCacheReader` object.
+
+        :param directory: The pathname of the ``.hg`` directory (a string).
+        """
+        self.directory = directory
+
+    @property
+    def changelog_index(self):
+        """The pathname of the changelog index (a string)."""
+        return os.path.join(self.directory, 'store', '00changelog.i')
+
+    @property
+    def is_supported(self):
+        """
+        :data:`True` if the caches can be read by :class:`HgCacheReader`, :data:`False` otherwise.
+
+        Caches can't be read when the repository has requirements (the files
+        ``.hg/requires`` and ``.hg/store/requires``) that :class:`HgCacheReader`
+        doesn't know about, for example because the repository shares its
+        store with another repository or it uses a different changelog format.
+        """
+        requirements = set()
+        for filename in (os.path.join(self.directory, 'requires'),
+                         os.path.join(self.directory, 'store', 'requires')):
+            if os.path.isfile(filename):
+                with open(filename) as handle:
+                    requirements.update(line.strip() for line in handle if line.strip())
+        if 'revlogv1' not in requirements:
+            return False
+        if not all(r in SUPPORTED_HG_REQUIREMENTS for r in requirements):
+            return False
+        return os.path.isfile(self.changelog_index)
+
+    def find_branches(self):
+        """
+        Find the branches in the repository using the branch cache.
+
+        :returns: A list of tuples with three values each (the name of the
+                  branch, the global revision id of the tip-most open head of
+                  the branch and its revision number) or :data:`None` when no
+                  valid branch cache is available. Closed branches are not
+                  included (just like ``hg branches``).
+        """
+        tip = self.find_tip()
+        if tip:
+            for filename in self.find_cache_files('branch2-'):
+                with open(filename) as handle:
+                    lines = handle.read().splitlines()
+                header = lines[0].split() if lines else []
+                if header != [tip[1], str(tip[0])]:
+                    continue
+                open_heads = {}
+                for line in lines[1:]:
+                    tokens = line.split(' ', 2)
+                    if len(tokens) == 3 and tokens[1] == 'o':
+                        # Heads are stored in order of increasing revision numbers.
+                        open_heads[tokens[2]] = tokens[0]
+                numbers = self.find_revision_numbers(open_heads.values())
+                if numbers is not None:
+                    return sorted((name, node, numbers[node]) for name, node in open_heads.items())
+
+    def find_tags(self):
+        """
+        Find the tags in the repository using the tags cache.
+
+        :returns: A list of tuples with three values each (the name of the
+                  tag, the global revision id of the tagged revision and its
+                  revision number) or :data:`None` when no valid tags cache is
+                  available. The ``tip`` pseudo tag and local tags (in the
+                  file ``.hg/localtags``) are included (just like ``hg tags``).
+        """
+        tip = self.find_tip()
+        if tip:
+            for filename in self.find_cache_files('tags2-'):
+                with open(filename) as handle:
+                    lines = handle.read().splitlines()
+                header = lines[0].split() if lines else []
+                if header != [str(tip[0]), tip[1]]:
+                    continue
+                tags = {}
+                for line in lines[1:]:
+                    node, _, name = line.partition(' ')
+                    if name:
+                        # Later entries override earlier entries.
+                        tags[name] = node
+                filename = os.path.join(self.directory, 'localtags')
+                if os.path.isfile(filename):
+                    with open(filename) as handle:
+                        for line in handle:
+                            node, _, name = line.strip().partition(' ')
+                            if name:
+                                tags[name] = node
+                numbers = self.find_revision_numbers(tags.values())
+                if numbers is None:
+                    return None
+                results = [(name, node, numbers[node]) for name, node in tags.items() if node in numbers]
+                results.append(('tip', tip[1], tip[0]))
+                return sorted(results)
+
+    def find_cache_files(self, prefix):
+        """
+        Find cache files with the given prefix.
+
+        :param prefix: The prefix of the filenames (a string).
+        :returns: A list of pathnames (strings).
+        """
+        directory = os.path.join(self.directory, 'cache')
+        if os.path.isdir(directory):
+            return sorted(os.path.join(directory, fn) for fn in os.listdir(directory) if fn.startswith(prefix))
+        return []
+
+    def find_tip(self):
+        """
+        Find the tip of the changelog.
+
+        :returns: A tuple with the revision number (an integer) and global
+                  revision id (a string) of the tip or :data:`None` when the
+                  repository is empty or the changelog format isn't supported.
+        """
+        inline = self.read_changelog_header()
+        if inline is False:
+            # Without inline revision data the tip is the last index entry.
+            rev = os.path.getsize(self.changelog_index) // 64 - 1
+            with open(self.changelog_index, 'rb') as handle:
+                handle.seek(rev * 64)
+                entry = handle.read(64)
+            return rev, binascii.hexlify(entry[32:52]).decode('ascii')
+        tip = None
+        if inline:
+            for rev, node in self.read_changelog_index():
+                tip = (rev, node)
+        return tip
+
+    def find_revision_numbers(self, nodes):
+        """
+        Find the revision numbers of global revision ids.
+
+        :param nodes: An iterable of global revision ids (strings).
+        :returns: A dictionary with global revision ids (strings) as keys and
+                  revision numbers (integers) as values or :data:`None` when
+                  a revision id is unknown or the lookup would take too long
+                  (in which case the caller is expected to fall back to the
+                  ``hg`` program).
+
+        The global revision ids are converted to their binary representation
+        once so that they can be compared to the changelog index directly.
+        When the changelog isn't inline the index entries have a fixed size,
+        so each revision id is searched for using :func:`mmap.mmap.rfind()`
+        (starting from the tip, because recent revisions are the most likely
+        to be queried) and its position gives the revision number. Proving
+        that a revision id is unknown requires a full scan of the index so
+        in that case :data:`None` is returned, as is the case when the
+        searches would exceed :data:`MAX_INDEX_SCANS` full scans.
+        """
+        try:
+            wanted = dict((binascii.unhexlify(node), node) for node in set(nodes) if node != HG_NULL_ID)
+        except (TypeError, ValueError):
+            return None
+        numbers = {}
+        if not wanted:
+            return numbers
+        inline = self.read_changelog_header()
+        if inline is None:
+            return None
+        if inline:
+            # Inline changelogs are small, a forward scan is fine.
+            for rev, entry in self.read_changelog_entries():
+                node = wanted.get(entry[32:52])
+                if node:
+                    numbers[node] = rev
+                    if len(numbers) == len(wanted):
+                        return numbers
+            return None
+        with open(self.changelog_index, 'rb') as handle:
+            contents = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                budget = MAX_INDEX_SCANS * len(contents)
+                for binary_node, node in wanted.items():
+                    end = len(contents)
+                    while True:
+                        position = contents.rfind(binary_node, 0, end)
+                        if position < 0:
+                            # The revision id is unknown.
+                            return None
+                        if position % 64 == 32:
+                            numbers[node] = position // 64
+                            break
+                        # Skip matches that aren't aligned to a revision id.
+                        end = position + len(binary_node) - 1
+                    budget -= len(contents) - position
+                    if budget < 0:
+                        logger.debug("Changelog index %s is too large to search for %i revisions.",
+                                     self.changelog_index, len(wanted))
+                        return None
+            finally:
+                contents.close()
+        return numbers
+
+    def read_changelog_header(self):
+        """
+        Read the header of the changelog index.
+
+        :returns: :data:`True` if the changelog is inline, :data:`False` if it
+                  isn't or :data:`None` when the changelog is empty or doesn't
+                  use the revlog version 1 format.
+        """
+        if os.path.getsize(self.changelog_index) >= 64:
+            with open(self.changelog_index, 'rb') as handle:
+                header = struct.unpack('>I', handle.read(4))[0]
+            if header & 0xFFFF == 1:
+                return bool(header & (1 << 16))
+
+    def read_changelog_index(self):
+        """
+        Read the entries in the changelog index.
+
+        :returns: A generator of tuples with two values each: A revision
+                  number (an integer) and global revision id (a string). Empty
+                  when the changelog doesn't use the revlog version 1 format.
+        """
+        for rev, entry in self.read_changelog_entries():
+            yield rev, binascii.hexlify(entry[32:52]).decode('ascii')
+
+    def read_changelog_entries(self):
+        """
+        Read the raw entries in the changelog index.
+
+        :returns: A generator of tuples with two values each: A revision
+                  number (an integer) and the index entry (a byte string).
+                  Empty when the changelog doesn't use the revlog version 1
+                  format.
+
+        Each index entry is 64 bytes, the global revision id is stored at
+        offset 32 and the length of the (compressed) revision data at offset
+        8. Small changelogs are "inline" which means the revision data is
+        stored in the index file right after each index entry.
+        """
+        inline = self.read_changelog_header()
+        if inline is None:
+            return
+        with open(self.changelog_index, 'rb') as handle:
+            contents = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                offset = 0
+                rev = 0
+                while offset + 64 <= len(contents):
+                    entry = contents[offset:offset + 64]
+                    yield rev, entry
+                    offset += 64
+                    if inline:
+                        offset += struct.unpack('>i', entry[8:12])[0]
+                    rev += 1
+            finally:
+                contents.close()
@@ -0,0 +1,265 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Ordering and indexing of releases.
+
+Selecting a release (see :func:`~vcs_repo_mgr.Repository.select_release()`)
+requires the releases of a repository to be ordered. This module defines the
+supported orderings (see :data:`RELEASE_ORDERINGS`) and the
+:class:`ReleaseIndex` class which computes the sort key of every release once
+and keeps the releases in a sorted list, so that releases can be selected
+using binary search instead of comparing every release.
+"""
+
+# Standard library modules.
+import bisect
+import logging
+import re
+
+# External dependencies.
+from natsort import NaturalOrderKey
+
+# Modules included in our package.
+from vcs_repo_mgr.exceptions import NoMatchingReleasesError
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+PEP_440_VERSION = re.compile(r'''
+    ^ \s* v?
+    (?: (?P<epoch> [0-9]+ ) ! )?
+    (?P<release> [0-9]+ (?: \. [0-9]+ )* )
+    (?: [-_.]? (?P<pre_phase> a | b | c | rc | alpha | beta | pre | preview ) [-_.]? (?P<pre_number> [0-9]+ )? )?
+    (?: -(?P<post_implicit> [0-9]+ ) | [-_.]? (?P<post> post | rev | r ) [-_.]? (?P<post_number> [0-9]+ )? )?
+    (?: [-_.]? (?P<dev> dev ) [-_.]? (?P<dev_number> [0-9]+ )? )?
+    (?: \+ (?P<local> [a-z0-9]+ (?: [-_.] [a-z0-9]+ )* ) )?
+    \s* $
+''', re.IGNORECASE | re.VERBOSE)
+"""A compiled regular expression that matches `PEP 440`_ version numbers.
+
+.. _PEP 440: https://www.python.org/dev/peps/pep-0440/
+"""
+
+PEP_440_PHASES = dict(a=0, alpha=0, b=1, beta=1, c=2, pre=2, preview=2, rc=2)
+"""A dictionary that maps `PEP 440`_ pre-release phases to their relative order."""
+
+SEMANTIC_VERSION = re.compile(r'''
+    ^ v?
+    (?P<major> 0 | [1-9][0-9]* ) \. (?P<minor> 0 | [1-9][0-9]* ) \. (?P<patch> 0 | [1-9][0-9]* )
+    (?: - (?P<prerelease> [0-9A-Za-z-]+ (?: \. [0-9A-Za-z-]+ )* ) )?
+    (?: \+ [0-9A-Za-z-]+ (?: \. [0-9A-Za-z-]+ )* )?
+    $
+''', re.VERBOSE)
+"""A compiled regular expression that matches `semantic versions`_.
+
+.. _semantic versions: https://semver.org/
+"""
+
+
+def natural_order_key(identifier):
+    """
+    Get the natural order sorting key of a release identifier.
+
+    :param identifier: A release identifier (a string).
+    :returns: A :class:`natsort.NaturalOrderKey` object.
+
+    This is the ordering that `vcs-repo-mgr` has always used.
+    """
+    return NaturalOrderKey(identifier)
+
+
+def pep440_key(identifier):
+    """
+    Get the `PEP 440`_ sorting key of a release identifier.
+
+    :param identifier: A release identifier (a string).
+    :returns: A tuple that sorts according to `PEP 440`_.
+    :raises: :exc:`~exceptions.ValueError` when the identifier isn't a valid
+             `PEP 440`_ version number.
+    """
+    match = PEP_440_VERSION.match(identifier)
+    if not match:
+        raise ValueError("Release identifier %r isn't a valid PEP 440 version number!" % identifier)
+    release = [int(n) for n in match.group('release').split('.')]
+    # Trailing zeros don't affect the ordering (1.0 == 1.0.0).
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    if match.group('pre_phase'):
+        pre = (PEP_440_PHASES[match.group('pre_phase').lower()], int(match.group('pre_number') or 0))
+    elif match.group('dev') and not (match.group('post_implicit') or match.group('post')):
+        # Developmental releases sort before pre-releases (1.0.dev1 < 1.0a1).
+        pre = (-1, 0)
+    else:
+        pre = (3, 0)
+    if match.group('post_implicit') or match.group('post'):
+        post = int(match.group('post_implicit') or match.group('post_number') or 0)
+    else:
+        post = -1
+    dev = int(match.group('dev_number') or 0) if match.group('dev') else float('inf')
+    local = ()
+    if match.group('local'):
+        # Numeric segments sort after alphanumeric segments.
+        local = tuple((1, int(s), '') if s.isdigit() else (0, 0, s.lower())
+                      for s in re.split('[-_.]', match.group('local')))
+    return (int(match.group('epoch') or 0), tuple(release), pre, post, dev, local)
+
+
+def semver_key(identifier):
+    """
+    Get the `semantic versioning`_ sorting key of a release identifier.
+
+    :param identifier: A release identifier (a string).
+    :returns: A tuple that sorts according to `semantic versioning`_ (build
+              metadata is ignored).
+    :raises: :exc:`~exceptions.ValueError` when the identifier isn't a valid
+             semantic version.
+
+    .. _semantic versioning: https://semver.org/
+    """
+    match = SEMANTIC_VERSION.match(identifier)
+    if not match:
+        raise ValueError("Release identifier %r isn't a valid semantic version!" % identifier)
+    if match.group('prerelease'):
+        # Numeric identifiers sort before alphanumeric identifiers
+        # and pre-releases sort before the corresponding release.
+        prerelease = (0, tuple((0, int(s), '') if s.isdigit() else (1, 0, s)
+                               for s in match.group('prerelease').split('.')))
+    else:
+        prerelease = (1, ())
+    return (int(match.group('major')), int(match.group('minor')), int(match.group('patch')), prerelease)
+
+
+RELEASE_ORDERINGS = dict(natural=natural_order_key, pep440=pep440_key, semver=semver_key)
+"""
+A dictionary with the names of release orderings (strings) as keys and key functions as values.
+
+Each key function takes a release identifier (a string) and returns an object
+that can be compared to the keys of other release identifiers.
+"""
+
+
+class ReleaseIndex(object):
+
+    """
+    A sorted index of releases that supports selecting releases using binary search.
+
+    The sort key of every release is computed once (when the index is
+    created) after which :func:`select()`, :func:`between()` and
+    :func:`latest()` use :mod:`bisect` to find releases. Release identifiers
+    that aren't valid according to the ordering (for example tags that aren't
+    semantic versions in combination with the ``semver`` ordering) are
+    excluded from the index.
+
+    .. py:attribute:: ordering
+
+       The name of the release ordering (one of the keys of
+       :data:`RELEASE_ORDERINGS`).
+
+    .. py:attribute:: keys
+
+       The sort keys of the releases (a list in ascending order).
+
+    .. py:attribute:: releases
+
+       The :class:`~vcs_repo_mgr.Release` objects (a list in the same order
+       as :attr:`keys`).
+    """
+
+    def __init__(self, releases, ordering='natural'):
+        """
+        Initialize a :class:`ReleaseIndex` object.
+
+        :param releases: An iterable of :class:`~vcs_repo_mgr.Release` objects.
+        :param ordering: The name of the release ordering (one of the keys of
+                         :data:`RELEASE_ORDERINGS`, defaults to 'natural').
+        :raises: :exc:`~exceptions.ValueError` when the ordering isn't known.
+        """
+        if ordering not in RELEASE_ORDERINGS:
+            msg = "Release ordering %r is not supported! (valid options are %s)"
+            raise ValueError(msg % (ordering, ', '.join(map(repr, sorted(RELEASE_ORDERINGS)))))
+        self.ordering = ordering
+        entries = []
+        for release in releases:
+            try:
+                entries.append((self.get_key(release.identifier), release))
+            except ValueError as e:
+                logger.debug("Excluding release from index: %s", e)
+        entries.sort(key=lambda e: e[0])
+        self.keys = [e[0] for e in entries]
+        self.releases = [e[1] for e in entries]
+
+    def get_key(self, identifier):
+        """
+        Get the sort key of a release identifier.
+
+        :param identifier: A release identifier (a string).
+        :returns: The sort key (refer to :data:`RELEASE_ORDERINGS`).
+        :raises: :exc:`~exceptions.ValueError` when the identifier isn't valid
+                 according to :attr:`ordering`.
+        """
+        return RELEASE_ORDERINGS[self.ordering](identifier)
+
+    def select(self, highest_allowed_release):
+        """
+        Select the newest release that is not newer than the given release.
+
+        :param highest_allowed_release: The identifier of the release that sets
+                                        the upper bound for the selection (a
+                                        string).
+        :returns: The selected :class:`~vcs_repo_mgr.Release` object.
+        :raises: :exc:`~vcs_repo_mgr.exceptions.NoMatchingReleasesError`
+                 when no matching releases are found.
+        """
+        position = bisect.bisect_right(self.keys, self.get_key(highest_allowed_release))
+        if position == 0:
+            msg = "No releases below or equal to %r found in repository!"
+            raise NoMatchingReleasesError(msg % highest_allowed_release)
+        return self.releases[position - 1]
+
+    def between(self, lowest_release=None, highest_release=None):
+        """
+        Find the releases in a range.
+
+        :param lowest_release: The identifier of the oldest release to include
+                               (a string or :data:`None` to start at the
+                               oldest release).
+        :param highest_release: The identifier of the newest release to
+                                include (a string or :data:`None` to end at
+                                the newest release).
+        :returns: A list of :class:`~vcs_repo_mgr.Release` objects (oldest
+                  release first). Both bounds are inclusive.
+        """
+        start = 0
+        end = len(self.keys)
+        if lowest_release is not None:
+            start = bisect.bisect_left(self.keys, self.get_key(lowest_release))
+        if highest_release is not None:
+            end = bisect.bisect_right(self.keys, self.get_key(highest_release))
+        return self.releases[start:end]
+
+    def latest(self, count=1):
+        """
+        Find the newest releases.
+
+        :param count: The number of releases to find (an integer).
+        :returns: A list of :class:`~vcs_repo_mgr.Release` objects (oldest
+                  release first).
+        """
+        return self.releases[-count:] if count > 0 else []
+
+    def __iter__(self):
+        """Iterate over the releases in the index (oldest release first)."""
+        return iter(self.releases)
+
+    def __len__(self):
+        """Get the number of releases in the index."""
+        return len(self.releases)
+
+    def __repr__(self):
+        """Generate a human readable representation of a release index."""
+        return "%s(ordering=%r, releases=%r)" % (self.__class__.__name__, self.ordering,
+                                                 [r.identifier for r in self.releases])
@@ -0,0 +1,404 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Answer queries about repositories using a long running daemon.
+
+Every ``vcs-tool`` invocation pays for the startup of the Python interpreter,
+the parsing of configuration files and the validation of the repositories
+involved. The daemon started by ``vcs-tool --serve`` (see :func:`serve()`)
+keeps :class:`~vcs_repo_mgr.Repository` objects (including their branches,
+tags and revision numbers) in memory and answers queries sent to it over a
+UNIX domain socket by ``vcs-tool --client`` or :class:`RepositoryClient`.
+
+Queries and responses are JSON objects, one per line, using the same format
+as ``vcs-tool --batch`` (refer to :func:`answer_query()`). Queries that change
+a repository (see :data:`MUTATING_ACTIONS`) are serialized per repository
+while other queries are answered concurrently.
+"""
+
+# Standard library modules.
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+
+# External dependencies.
+from humanfriendly import format_path, parse_path
+from six import string_types
+from six.moves import socketserver
+
+# Modules included in our package.
+from vcs_repo_mgr import coerce_repository, sum_revision_numbers
+from vcs_repo_mgr.exceptions import RemoteQueryError
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+SOCKET_VARIABLE = 'VCS_REPO_MGR_SOCKET'
+"""The name of the environment variable that overrides the location of the daemon's socket (a string)."""
+
+MUTATING_ACTIONS = ('commit', 'merge-up', 'update')
+"""The actions that change a repository and are serialized per repository by the daemon (a tuple of strings)."""
+
+
+def find_socket_path():
+    """
+    Find the pathname of the UNIX domain socket used by the daemon.
+
+    :returns: The value of the environment variable :data:`SOCKET_VARIABLE`
+              when it's set, otherwise ``vcs-repo-mgr.sock`` in the directory
+              given by ``$XDG_RUNTIME_DIR`` or ``~/.vcs-repo-mgr.sock`` (a
+              string).
+    """
+    value = os.environ.get(SOCKET_VARIABLE)
+    if value:
+        return parse_path(value)
+    runtime_directory = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_directory and os.path.isdir(runtime_directory):
+        return os.path.join(runtime_directory, 'vcs-repo-mgr.sock')
+    return os.path.expanduser('~/.vcs-repo-mgr.sock')
+
+
+def answer_query(query):
+    """
+    Answer a single query (in-process).
+
+    :param query: A dictionary with the keys documented for the ``--batch``
+                  option of ``vcs-tool``.
+    :returns: The result of the query (a JSON serializable value).
+    :raises: :exc:`~exceptions.ValueError` when the query is invalid, other
+             exceptions are propagated.
+    """
+    action = query.get('action')
+    if action == 'sum-revisions':
+        arguments = query.get('arguments')
+        if not (isinstance(arguments, list) and len(arguments) >= 2):
+            raise ValueError("Please specify one or more repository/revision pairs!")
+        return sum_revision_numbers(arguments)
+    if not query.get('repository'):
+        raise ValueError("Please specify a repository!")
+    repository = coerce_repository(query['repository'])
+    revision = query.get('revision')
+    if action == 'select-release':
+        if not query.get('release'):
+            raise ValueError("Please specify a nonempty release identifier!")
+        return repository.select_release(query['release']).identifier
+    if query.get('release'):
+        if query['release'] not in repository.releases:
+            raise ValueError("The given release identifier is invalid!")
+        revision = repository.releases[query['release']].revision.revision_id
+    if action == 'find-directory':
+        return repository.local
+    elif action == 'find-revision-number':
+        return repository.find_revision_number(revision)
+    elif action == 'find-revision-id':
+        return repository.find_revision_id(revision)
+    elif action == 'list-releases':
+        return [release.identifier for release in repository.ordered_releases]
+    elif action == 'vcs-control-field':
+        return "%s: %s" % repository.generate_control_field(revision)
+    elif action == 'update':
+        repository.update()
+        return True
+    elif action == 'merge-up':
+        return repository.merge_up(target_branch=revision, feature_branch=query.get('feature_branch'))
+    elif action == 'commit':
+        if not query.get('message'):
+            raise ValueError("Please specify a commit message!")
+        repository.commit(message=query['message'])
+        return True
+    raise ValueError("Unsupported action %r!" % action)
+
+
+def resolve_locations(query):
+    """
+    Convert the locations of local repositories in a query to absolute pathnames.
+
+    :param query: A dictionary (refer to :func:`answer_query()`).
+    :returns: A dictionary with the same keys and values, except that the
+              repository locations that name an existing local directory
+              (see :func:`resolve_location()`) are absolute.
+
+    The daemon's working directory differs from the working directory of its
+    clients, so relative pathnames need to be resolved before a query is sent.
+    """
+    query = dict(query)
+    if isinstance(query.get('repository'), string_types):
+        query['repository'] = resolve_location(query['repository'])
+    if query.get('action') == 'sum-revisions' and isinstance(query.get('arguments'), list):
+        query['arguments'] = [
+            resolve_location(value) if i % 2 == 0 and isinstance(value, string_types) else value
+            for i, value in enumerate(query['arguments'])
+        ]
+    return query
+
+
+def resolve_location(value):
+    """
+    Convert the location of a local repository to an absolute pathname.
+
+    :param value: The name or location of a repository (a string).
+    :returns: The absolute pathname when the value names an existing local
+              directory (optionally prefixed with a VCS type, as in
+              ``git+../project``), otherwise the value (a string).
+    """
+    if os.path.isdir(value):
+        return os.path.abspath(value)
+    vcs_type, _, location = value.partition('+')
+    if vcs_type and location and os.path.isdir(location):
+        return '%s+%s' % (vcs_type, os.path.abspath(location))
+    return value
+
+
+def generate_response(line, function=answer_query):
+    """
+    Answer a query encoded as a line of JSON.
+
+    :param line: A line containing a JSON object (a string).
+    :param function: The function that answers the query (a callable that
+                     takes a dictionary and returns the result, defaults to
+                     :func:`answer_query()`).
+    :returns: A line containing a JSON object (a string, without a trailing
+              newline) with the key ``result`` or ``error`` (and ``id`` when
+              the query contains an ``id``).
+    """
+    response = {}
+    try:
+        query = json.loads(line)
+        if not isinstance(query, dict):
+            raise ValueError("Expected a JSON object!")
+        if 'id' in query:
+            response['id'] = query['id']
+        response['result'] = function(query)
+    except Exception as e:
+        logger.debug("Failed to answer query %s!", line, exc_info=True)
+        response['error'] = str(e)
+    return json.dumps(response, sort_keys=True)
+
+
+def serve(socket_path=None):
+    """
+    Run the daemon until it's interrupted.
+
+    :param socket_path: The pathname of the UNIX domain socket (a string,
+                        defaults to the result of :func:`find_socket_path()`).
+    """
+    server = RepositoryServer(socket_path or find_socket_path())
+    logger.info("Listening for queries on %s ..", format_path(server.socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down ..")
+    finally:
+        server.server_close()
+
+
+class RepositoryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """
+    The daemon that answers queries about repositories (used by :func:`serve()`).
+
+    Each connection is handled by a separate thread (see :class:`QueryHandler`)
+    and each connection can be used for any number of queries.
+
+    .. py:attribute:: socket_path
+
+       The pathname of the UNIX domain socket (a string).
+    """
+
+    daemon_threads = True
+    """Don't wait for connection threads when the daemon shuts down."""
+
+    def __init__(self, socket_path):
+        """
+        Initialize a :class:`RepositoryServer` object.
+
+        :param socket_path: The pathname of the UNIX domain socket (a string).
+        :raises: :exc:`~exceptions.EnvironmentError` when another daemon is
+                 already listening on the socket.
+        """
+        self.socket_path = socket_path
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        if os.path.exists(socket_path):
+            try:
+                RepositoryClient(socket_path, fallback=False).connect().close()
+            except socket.error:
+                logger.debug("Removing stale socket %s ..", format_path(socket_path))
+                os.unlink(socket_path)
+            else:
+                raise EnvironmentError("Another daemon is already listening on %s!" % socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, QueryHandler)
+        os.chmod(socket_path, 0o600)
+
+    def answer(self, query):
+        """
+        Answer a query (serializing queries that change a repository).
+
+        :param query: A dictionary (refer to :func:`answer_query()`).
+        :returns: The result of the query.
+        """
+        if query.get('action') in MUTATING_ACTIONS and query.get('repository'):
+            with self.get_lock(query['repository']):
+                return answer_query(query)
+        return answer_query(query)
+
+    def get_lock(self, repository):
+        """
+        Get the lock that serializes changes to a repository.
+
+        :param repository: The name or location of a repository (a string).
+        :returns: A :class:`threading.Lock` object (the same object for all
+                  names and locations that refer to the same local clone).
+        """
+        key = os.path.realpath(coerce_repository(repository).local)
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def server_close(self):
+        """Stop listening and remove the UNIX domain socket."""
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+
+    """Answer the queries received on a single connection to :class:`RepositoryServer`."""
+
+    def handle(self):
+        """Answer queries until the client closes the connection."""
+        for line in iter(self.rfile.readline, b''):
+            line = line.strip()
+            if line:
+                response = generate_response(line.decode('UTF-8'), self.server.answer)
+                self.wfile.write(response.encode('UTF-8') + b'\n')
+                self.wfile.flush()
+
+
+class RepositoryClient(object):
+
+    """
+    Python client for the daemon started by ``vcs-tool --serve``.
+
+    Here's an example:
+
+    >>> from vcs_repo_mgr.server import RepositoryClient
+    >>> client = RepositoryClient()
+    >>> client.query('find-revision-number', repository='vcs-repo-mgr', revision='master')
+    194
+
+    When the daemon isn't running (and :attr:`fallback` is :data:`True`)
+    queries are answered in the current process using :func:`answer_query()`.
+
+    .. py:attribute:: socket_path
+
+       The pathname of the UNIX domain socket (a string).
+
+    .. py:attribute:: fallback
+
+       :data:`True` to answer queries in the current process when the daemon
+       isn't running, :data:`False` to raise an exception instead.
+    """
+
+    def __init__(self, socket_path=None, fallback=True):
+        """
+        Initialize a :class:`RepositoryClient` object.
+
+        :param socket_path: The pathname of the UNIX domain socket (a string,
+                            defaults to the result of :func:`find_socket_path()`).
+        :param fallback: Used to set :attr:`fallback` (a boolean).
+        """
+        self.socket_path = socket_path or find_socket_path()
+        self.fallback = fallback
+        self.socket = None
+        self.reader = None
+
+    def connect(self):
+        """
+        Connect to the daemon (if not already connected).
+
+        :returns: The :class:`RepositoryClient` object.
+        :raises: :exc:`socket.error` when the daemon isn't running.
+        """
+        if self.socket is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self.socket_path)
+            except Exception:
+                connection.close()
+                raise
+            self.socket = connection
+            self.reader = connection.makefile('rb')
+        return self
+
+    def query(self, action, **options):
+        """
+        Answer a query.
+
+        :param action: The action to perform (a string).
+        :param options: The other keys of the query (refer to :func:`answer_query()`).
+        :returns: The result of the query.
+        """
+        options['action'] = action
+        return self.answer(options)
+
+    def answer(self, query):
+        """
+        Answer a query using the daemon (or in-process when the daemon isn't running).
+
+        :param query: A dictionary (refer to :func:`answer_query()`).
+        :returns: The result of the query.
+        :raises: :exc:`~vcs_repo_mgr.exceptions.RemoteQueryError` when the
+                 daemon fails to answer the query. When the query is answered
+                 in the current process exceptions are propagated.
+
+        Relative pathnames of local repositories are resolved against the
+        working directory of the client (see :func:`resolve_locations()`).
+        """
+        query = resolve_locations(query)
+        try:
+            response = self.send(query)
+        except socket.error as e:
+            if self.fallback and e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                logger.debug("Daemon isn't running, answering query in current process ..")
+                return answer_query(query)
+            raise
+        if 'error' in response:
+            raise RemoteQueryError(response['error'])
+        return response.get('result')
+
+    def send(self, query):
+        """
+        Send a query to the daemon and wait for the response.
+
+        :param query: A dictionary (refer to :func:`answer_query()`).
+        :returns: The response (a dictionary).
+        :raises: :exc:`socket.error` when communication with the daemon fails.
+        """
+        self.connect()
+        try:
+            self.socket.sendall(json.dumps(query).encode('UTF-8') + b'\n')
+            line = self.reader.readline()
+            if not line:
+                raise socket.error(errno.ECONNRESET, "Daemon closed the connection!")
+            return json.loads(line.decode('UTF-8'))
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """Close the connection to the daemon."""
+        if self.socket is not None:
+            self.reader.close()
+            self.socket.close()
+            self.socket = None
+            self.reader = None
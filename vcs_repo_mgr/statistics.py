@@ -0,0 +1,371 @@
+# Version control system repository manager.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/xolox/python-vcs-repo-mgr
+
+"""
+Statistics about the external commands run by `vcs-repo-mgr`.
+
+Almost all of the time spent by `vcs-repo-mgr` is spent waiting for external
+commands, so this module records the number of commands that were run, how
+long they took, how much output they generated and how many of them failed.
+The statistics are aggregated per :class:`~vcs_repo_mgr.Repository` method
+(the operation) and per kind of command (the program and its subcommand, for
+example ``git fetch`` or ``git rev-list``) which makes it possible to find out
+where the time goes:
+
+.. code-block:: python
+
+   from vcs_repo_mgr import coerce_repository
+   from vcs_repo_mgr.statistics import command_statistics
+
+   repository = coerce_repository('~/projects/vcs-repo-mgr')
+   repository.update()
+   print(repository.find_revision_number('master'))
+   print(command_statistics.format_table())
+
+Commands that take longer than :attr:`CommandStatistics.slow_threshold`
+seconds are logged. The same statistics are reported by ``vcs-tool --stats``.
+"""
+
+# Standard library modules.
+import logging
+import os
+import shlex
+import sys
+import threading
+
+# External dependencies.
+from humanfriendly import Timer, format_size, format_timespan, parse_timespan
+from six import string_types
+
+# Initialize a logger.
+logger = logging.getLogger(__name__)
+
+SLOW_COMMAND_VARIABLE = 'VCS_REPO_MGR_SLOW_COMMANDS'
+"""The name of the environment variable that sets the slow command threshold (a string)."""
+
+DEFAULT_SLOW_THRESHOLD = 10
+"""The default number of seconds after which commands are logged as slow (a number)."""
+
+PROGRAM_OPTIONS = {
+    'bzr': ('-d', '--directory'),
+    'git': ('-C', '-c', '--git-dir', '--work-tree'),
+    'hg': ('-R', '--repository', '--cwd', '--config', '--encoding'),
+}
+"""
+The options of version control programs that take a separate value (a dictionary).
+
+The keys are program names and the values are tuples of strings. Used by
+:func:`get_command_kind()` to skip global options that precede subcommands.
+"""
+
+SHELL_OPERATORS = ('&&', '||', ';', '|')
+"""Shell operators that separate the commands of a pipeline (a tuple of strings)."""
+
+
+class CommandStatistics(object):
+
+    """
+    Thread safe statistics about external commands.
+
+    .. py:attribute:: slow_threshold
+
+       Commands that take longer than this number of seconds are logged (a
+       number or :data:`None` to disable logging of slow commands). Defaults
+       to the value of the environment variable ``$VCS_REPO_MGR_SLOW_COMMANDS``
+       (parsed using :func:`~humanfriendly.parse_timespan()`) or
+       :data:`DEFAULT_SLOW_THRESHOLD`.
+    """
+
+    def __init__(self, slow_threshold=None):
+        """
+        Initialize a :class:`CommandStatistics` object.
+
+        :param slow_threshold: Used to set :attr:`slow_threshold` (optional).
+        """
+        if slow_threshold is None:
+            value = os.environ.get(SLOW_COMMAND_VARIABLE)
+            slow_threshold = parse_timespan(value) if value else DEFAULT_SLOW_THRESHOLD
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def record(self, command, elapsed_time, output=None, failed=False, operation=None):
+        """
+        Record that an external command was run.
+
+        :param command: The command that was run (a shell command given as a
+                        string or a list/tuple of program arguments).
+        :param elapsed_time: The number of seconds the command took (a float).
+        :param output: The output of the command (a string or byte string),
+                       the size of the output in bytes (an integer) or
+                       :data:`None` when the output wasn't captured.
+        :param failed: :data:`True` if the command failed, :data:`False`
+                       otherwise.
+        :param operation: The name of the operation that ran the command (a
+                          string, defaults to the result of
+                          :func:`find_operation()`).
+        :returns: The updated :class:`OperationStatistics` object.
+        """
+        if operation is None:
+            operation = find_operation()
+        kind = get_command_kind(command)
+        if isinstance(output, int):
+            num_bytes = output
+        elif isinstance(output, bytes):
+            num_bytes = len(output)
+        elif isinstance(output, string_types):
+            num_bytes = len(output.encode('UTF-8'))
+        else:
+            num_bytes = 0
+        with self.lock:
+            key = (operation, kind)
+            if key not in self.entries:
+                self.entries[key] = OperationStatistics(operation, kind)
+            entry = self.entries[key]
+            entry.record(elapsed_time, num_bytes, failed)
+        if self.slow_threshold is not None and elapsed_time >= self.slow_threshold:
+            logger.info("Slow command in %s took %s: %s", operation, format_timespan(elapsed_time),
+                        command if isinstance(command, string_types) else ' '.join(command))
+        return entry
+
+    def run(self, function, *command, **options):
+        """
+        Run an external command using a function like :func:`executor.execute()` and record statistics.
+
+        :param function: The function that runs the command.
+        :param command: The positional arguments to `function`.
+        :param options: The keyword arguments to `function`.
+        :returns: The return value of `function`.
+
+        When `function` raises an exception or returns :data:`False` the
+        command is recorded as failed. When the output of the command is
+        captured the size of the output is recorded.
+        """
+        timer = Timer()
+        try:
+            result = function(*command, **options)
+        except Exception:
+            self.record(command[0] if len(command) == 1 else command, timer.elapsed_time, failed=True)
+            raise
+        self.record(command[0] if len(command) == 1 else command, timer.elapsed_time,
+                    output=result if options.get('capture') else None, failed=result is False)
+        return result
+
+    def get_entries(self):
+        """
+        Get the recorded statistics.
+
+        :returns: A list of :class:`OperationStatistics` objects, ordered by
+                  descending :attr:`~OperationStatistics.total_time`.
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+        return sorted(entries, key=lambda e: (-e.total_time, e.operation, e.kind))
+
+    def format_table(self):
+        """
+        Format the recorded statistics as a table.
+
+        :returns: The rendered table (a string) or an empty string when no
+                  commands have been recorded.
+        """
+        from humanfriendly.tables import format_pretty_table
+        entries = self.get_entries()
+        if not entries:
+            return ''
+        column_names = ['Operation', 'Command', 'Count', 'Failures', 'Total time', 'Max time', 'Output']
+        return format_pretty_table([[
+            e.operation, e.kind, e.count, e.failures,
+            format_timespan(e.total_time),
+            format_timespan(e.max_time),
+            format_size(e.output_bytes),
+        ] for e in entries], column_names)
+
+    def reset(self):
+        """Forget the recorded statistics."""
+        with self.lock:
+            self.entries.clear()
+
+    def __repr__(self):
+        """Generate a human readable representation of command statistics."""
+        return "%s(slow_threshold=%r, entries=%i)" % (self.__class__.__name__, self.slow_threshold, len(self.entries))
+
+
+class OperationStatistics(object):
+
+    """
+    Statistics about one kind of external command run by one operation.
+
+    .. py:attribute:: operation
+
+       The name of the :class:`~vcs_repo_mgr.Repository` method that ran the
+       commands (a string, refer to :func:`find_operation()`).
+
+    .. py:attribute:: kind
+
+       The kind of command (a string, refer to :func:`get_command_kind()`).
+
+    .. py:attribute:: count
+
+       The number of commands that were run (an integer).
+
+    .. py:attribute:: failures
+
+       The number of commands that failed (an integer).
+
+    .. py:attribute:: total_time
+
+       The combined number of seconds the commands took (a float).
+
+    .. py:attribute:: max_time
+
+       The number of seconds the slowest command took (a float).
+
+    .. py:attribute:: output_bytes
+
+       The combined size of the captured output of the commands in bytes (an
+       integer).
+    """
+
+    def __init__(self, operation, kind):
+        """
+        Initialize an :class:`OperationStatistics` object.
+
+        :param operation: Used to set :attr:`operation`.
+        :param kind: Used to set :attr:`kind`.
+        """
+        self.operation = operation
+        self.kind = kind
+        self.count = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.output_bytes = 0
+
+    @property
+    def average_time(self):
+        """The average number of seconds the commands took (a float)."""
+        return self.total_time / self.count if self.count else 0.0
+
+    def record(self, elapsed_time, output_bytes, failed):
+        """
+        Record that a command was run.
+
+        :param elapsed_time: The number of seconds the command took (a float).
+        :param output_bytes: The size of the output of the command (an integer).
+        :param failed: :data:`True` if the command failed, :data:`False` otherwise.
+        """
+        self.count += 1
+        self.total_time += elapsed_time
+        self.max_time = max(self.max_time, elapsed_time)
+        self.output_bytes += output_bytes
+        if failed:
+            self.failures += 1
+
+    def __repr__(self):
+        """Generate a human readable representation of operation statistics."""
+        return "%s(operation=%r, kind=%r, count=%i, failures=%i, total_time=%.2f)" % (
+            self.__class__.__name__, self.operation, self.kind, self.count, self.failures, self.total_time,
+        )
+
+
+def find_operation():
+    """
+    Find the repository method that is running an external command.
+
+    :returns: The name of the outermost method of a
+              :class:`~vcs_repo_mgr.Repository` (or
+              :class:`~vcs_repo_mgr.aio.AsyncRepository`) object on the call
+              stack of the current thread (a string) or ``unknown`` when the
+              command wasn't run by a repository method.
+
+    Because the outermost method is used, commands run by internal helper
+    methods are attributed to the method that was called by the caller (for
+    example the ``git fetch`` command run by
+    :func:`~vcs_repo_mgr.Repository.update()`). The frames of decorators
+    like :func:`~vcs_repo_mgr.locked()` (functions named ``wrapper``) are
+    skipped in favor of the frames of the decorated methods.
+    """
+    repository_types = get_repository_types()
+    operation = 'unknown'
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name != 'wrapper' and code.co_varnames[:1] == ('self',):
+            if isinstance(frame.f_locals.get('self'), repository_types):
+                operation = code.co_name
+        frame = frame.f_back
+    return operation
+
+
+def get_repository_types():
+    """
+    Get the classes whose methods are recognized by :func:`find_operation()`.
+
+    :returns: A tuple of classes.
+
+    The :mod:`vcs_repo_mgr.aio` module is only included when it has already
+    been imported (it's never imported by this function).
+    """
+    from vcs_repo_mgr import Repository
+    aio = sys.modules.get('vcs_repo_mgr.aio')
+    return (Repository, aio.AsyncRepository) if aio else (Repository,)
+
+
+def get_command_kind(command):
+    """
+    Get a short description of the kind of an external command.
+
+    :param command: A shell command (a string) or a list/tuple of program
+                    arguments.
+    :returns: The name of the version control program followed by its
+              subcommand (for example ``git rev-list``) or the name of the
+              first program in the command when no version control program
+              is used (a string).
+
+    Shell commands like ``cd /path && git fetch`` are split into their
+    separate commands, global options (like ``hg -R /path``) are skipped.
+    """
+    if isinstance(command, string_types):
+        try:
+            tokens = shlex.split(command)
+        except ValueError:
+            tokens = command.split()
+    else:
+        tokens = list(command)
+    # Find the first version control program.
+    for i, token in enumerate(tokens):
+        program = os.path.basename(token)
+        if program in PROGRAM_OPTIONS and (i == 0 or tokens[i - 1] in SHELL_OPERATORS):
+            skip_value = False
+            for argument in tokens[i + 1:]:
+                if argument in SHELL_OPERATORS:
+                    break
+                elif skip_value:
+                    skip_value = False
+                elif argument in PROGRAM_OPTIONS[program]:
+                    skip_value = True
+                elif not argument.startswith('-'):
+                    return '%s %s' % (program, argument)
+            return program
+    return os.path.basename(tokens[0]) if tokens else 'unknown'
+
+
+def instrument(function):
+    """
+    Wrap a function like :func:`executor.execute()` to record statistics.
+
+    :param function: The function to wrap.
+    :returns: A function that runs `function` using
+              :func:`command_statistics.run() <CommandStatistics.run()>`.
+    """
+    def wrapper(*command, **options):
+        return command_statistics.run(function, *command, **options)
+    return wrapper
+
+
+command_statistics = CommandStatistics()
+"""The statistics about all external commands run by `vcs-repo-mgr` (a :class:`CommandStatistics` object)."""
@@ -1,13 +1,14 @@
 # Version control system repository manager.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: April 3, 2017
+# Last Change: October 16, 2026
 # URL: https://github.com/xolox/python-vcs-repo-mgr
 
 """Automated tests for the `vcs-repo-mgr` package."""
 
 # Standard library modules.
 import hashlib
+import json
 import logging
 import os
 import random
@@ -16,10 +17,14 @@ import shutil
 import string
 import sys
 import tempfile
+import threading
+import time
 import unittest
 
 # External dependencies.
 import coloredlogs
+from executor import ExternalCommandFailed, execute
+from humanfriendly import Timer
 from six.moves import StringIO
 
 # The module we're testing.
@@ -28,19 +33,28 @@ from vcs_repo_mgr import (
     BzrRepo,
     GitRepo,
     HgRepo,
+    KNOWN_RELEASE_ORDERINGS,
     UPDATE_VARIABLE,
     coerce_repository,
     find_configured_repository,
     limit_vcs_updates,
+    load_configuration,
+    map_concurrently,
+    sum_revision_numbers,
 )
 from vcs_repo_mgr.exceptions import (
     AmbiguousRepositoryNameError,
+    LockTimeoutError,
+    MergeConflictError,
     NoMatchingReleasesError,
     NoSuchRepositoryError,
+    RemoteQueryError,
     UnknownRepositoryTypeError,
     WorkingTreeNotCleanError,
 )
+from vcs_repo_mgr.caching import LRUCache
 from vcs_repo_mgr.cli import main
+from vcs_repo_mgr.fleet import find_remote_host, update_repositories
 
 # Initialize a logger.
 logger = logging.getLogger(__name__)
@@ -52,6 +66,9 @@ REMOTE_HG_REPO = 'https://bitbucket.org/ianb/virtualenv'
 OUR_PUBLIC_REPO = 'https://github.com/xolox/python-vcs-repo-mgr.git'
 PIP_ACCEL_REPO = 'https://github.com/paylogic/pip-accel.git'
 
+# The author of commits created by the test suite.
+AUTHOR = "Peter Odding <vcs-repo-mgr@peterodding.com>"
+
 # We need these in multiple places.
 DIGITS_PATTERN = re.compile('^[0-9]+$')
 HEX_SUM_PATTERN = re.compile('^[A-Fa-f0-9]+$')
@@ -85,6 +102,43 @@ def create_local_checkout(remote):
     return LOCAL_CHECKOUTS[key]
 
 
+def create_git_repository(num_commits=3):
+    """
+    Create a local git repository with some history.
+
+    This enables tests that don't depend on network access. Each commit is
+    tagged with a release number (``1.1``, ``1.2``, etc).
+    """
+    directory = create_temporary_directory()
+    execute('git', 'init', '--quiet', directory)
+    execute('git', 'symbolic-ref', 'HEAD', 'refs/heads/master', directory=directory)
+    repository = GitRepo(local=directory, bare=False, author=AUTHOR)
+    for i in range(1, num_commits + 1):
+        with open(os.path.join(directory, 'setup.py'), 'a') as handle:
+            handle.write("# Release 1.%i\n" % i)
+        repository.add_files(all=True)
+        repository.commit(message="Release 1.%i" % i)
+        execute('git', 'tag', '1.%i' % i, directory=directory)
+    return repository
+
+
+def create_hg_repository(num_commits=3):
+    """
+    Create a local Mercurial repository with some history.
+
+    This enables tests that don't depend on network access.
+    """
+    directory = create_temporary_directory()
+    execute('hg', 'init', directory)
+    repository = HgRepo(local=directory, bare=False, author=AUTHOR)
+    for i in range(1, num_commits + 1):
+        with open(os.path.join(directory, 'setup.py'), 'a') as handle:
+            handle.write("# Release 1.%i\n" % i)
+        repository.add_files(all=True)
+        repository.commit(message="Release 1.%i" % i)
+    return repository
+
+
 def tearDownModule():
     """
     Clean up temporary directories.
@@ -310,6 +364,384 @@ class VcsRepoMgrTestCase(unittest.TestCase):
         self.assertTrue(os.path.isfile(os.path.join(export_directory, 'setup.py')))
         self.assertTrue(os.path.isdir(os.path.join(export_directory, 'apt')))
 
+    def test_ref_snapshot(self):
+        """
+        Test that branches and tags are cached until they change.
+        """
+        repository = create_git_repository()
+        assert 'master' in repository.branches
+        assert '1.3' in repository.tags
+        # The snapshot is reused as long as nothing changes.
+        snapshot = repository.ref_snapshot
+        assert repository.ref_snapshot is snapshot
+        # Changes made using the Python API invalidate the snapshot.
+        repository.create_branch('feature')
+        assert repository.ref_snapshot is not snapshot
+        assert 'feature' in repository.branches
+        # Changes made by external commands are detected as well.
+        execute('git', 'tag', 'external', directory=repository.local)
+        assert 'external' in repository.tags
+
+    def test_revision_number_index(self):
+        """
+        Test the persistent index of revision numbers.
+        """
+        source = create_git_repository()
+        repository = GitRepo(local=create_temporary_directory(), remote=source.local)
+        self.assertEqual(repository.find_revision_number('master'), 3)
+        # The revision number should have been stored in the index.
+        revision_id = repository.find_revision_id('master')
+        assert repository.revision_numbers.exists
+        self.assertEqual(repository.revision_numbers.get(revision_id), 3)
+        # Make sure the index is actually used (by lying to it).
+        repository.revision_numbers.set(revision_id, 42)
+        self.assertEqual(repository.find_revision_number('master'), 42)
+        repository.revision_numbers.set(revision_id, 3)
+        # Make sure update() extends the index incrementally.
+        for i in range(2):
+            with open(os.path.join(source.local, 'setup.py'), 'a') as handle:
+                handle.write("# Another change\n")
+            source.commit(message="Another change")
+        repository.update()
+        new_revision_id = repository.find_revision_id('master')
+        self.assertNotEqual(new_revision_id, revision_id)
+        self.assertEqual(repository.revision_numbers.get(new_revision_id), 5)
+        self.assertEqual(repository.find_revision_number('master'), 5)
+
+    def test_batched_revision_resolution(self):
+        """
+        Test resolving multiple revisions at once.
+        """
+        # Test GitRepo.find_revision_ids() and find_revision_numbers().
+        repository = create_git_repository()
+        revisions = ['1.2', '1.1', 'master', '1.1']
+        self.assertEqual(repository.find_revision_ids(revisions),
+                         [repository.find_revision_id(r) for r in revisions])
+        self.assertEqual(repository.find_revision_numbers(revisions), [2, 1, 3, 1])
+        # Complete revision ids are validated (also when using the coprocess).
+        revision_id = repository.find_revision_id('1.2')
+        for coprocess in (False, True):
+            repository.coprocess = coprocess
+            self.assertEqual(repository.find_revision_ids([revision_id, 'master']),
+                             [revision_id, repository.find_revision_id('master')])
+            self.assertRaises(ExternalCommandFailed, repository.find_revision_ids, ['0123456789' * 4, 'master'])
+        repository.coprocess = False
+        # Test that sum_revision_numbers() groups revisions by repository.
+        self.assertEqual(sum_revision_numbers([repository.local, '1.1', repository.local, '1.2']), 3)
+        # Test HgRepo.find_revision_ids() and find_revision_numbers().
+        repository = create_hg_repository()
+        revisions = ['1', '0', 'default']
+        self.assertEqual(repository.find_revision_ids(revisions),
+                         [repository.find_revision_id(r) for r in revisions])
+        self.assertEqual(repository.find_revision_numbers(revisions), [1, 0, 2])
+        # Make sure revisions that resolve to the same revision are supported.
+        self.assertEqual(repository.find_revision_numbers(['tip', 'default', '0']), [2, 2, 0])
+        # Make sure expressions that don't match exactly one revision aren't mixed up.
+        self.assertEqual(repository.find_revision_numbers(['0:1', '2', "'1'"]),
+                         [repository.find_revision_number('0:1'), 2, 1])
+        self.assertRaises(ExternalCommandFailed, repository.find_revision_numbers, ['none()', '0:1'])
+
+    def test_concurrent_revision_sums(self):
+        """
+        Test summing revision numbers of multiple repositories concurrently.
+        """
+        # Test that map_concurrently() preserves the order of the results.
+        self.assertEqual(map_concurrently(lambda n: n * 2, range(20), concurrency=4), list(range(0, 40, 2)))
+        # Test that map_concurrently() propagates exceptions.
+        self.assertRaises(ZeroDivisionError, map_concurrently, lambda n: 1 / n, range(5), concurrency=2)
+        # Test sum_revision_numbers() with more repositories than threads.
+        arguments = []
+        for num_commits in range(1, 5):
+            repository = create_git_repository(num_commits=num_commits)
+            arguments.extend([repository.local, 'master', repository.local, '1.1'])
+        self.assertEqual(sum_revision_numbers(arguments, concurrency=2), (1 + 2 + 3 + 4) + 4)
+
+    def test_fleet_update(self):
+        """
+        Test creating and updating all configured repositories concurrently.
+        """
+        # Test the parsing of remote host names.
+        assert find_remote_host('https://github.com/xolox/python-vcs-repo-mgr.git') == 'github.com'
+        assert find_remote_host('git@github.com:xolox/python-vcs-repo-mgr.git') == 'github.com'
+        assert find_remote_host('ssh://hg@bitbucket.org/ianb/virtualenv') == 'bitbucket.org'
+        assert find_remote_host('/srv/repositories/vcs-repo-mgr') is None
+        assert find_remote_host(None) is None
+        # Create a configuration file that defines several repositories.
+        config_directory = create_temporary_directory()
+        vcs_repo_mgr.USER_CONFIG_FILE = os.path.join(config_directory, 'vcs-repo-mgr.ini')
+        with open(vcs_repo_mgr.USER_CONFIG_FILE, 'w') as handle:
+            for i in range(1, 4):
+                handle.write('[mirror-%i]\n' % i)
+                handle.write('type = git\n')
+                handle.write('local = %s\n' % os.path.join(config_directory, 'mirror-%i' % i))
+                handle.write('remote = %s\n' % create_git_repository(num_commits=i).local)
+            handle.write('[broken]\n')
+            handle.write('type = git\n')
+            handle.write('local = %s\n' % os.path.join(config_directory, 'broken'))
+            handle.write('remote = %s\n' % os.path.join(config_directory, 'non-existing'))
+        # The first run creates the local clones.
+        results = update_repositories(concurrency=2)
+        self.assertEqual([r.name for r in results], ['broken', 'mirror-1', 'mirror-2', 'mirror-3'])
+        self.assertEqual([r.succeeded for r in results], [False, True, True, True])
+        assert all(r.created for r in results[1:])
+        self.assertEqual([r.repository.find_revision_number() for r in results[1:]], [1, 2, 3])
+        # The second run updates the existing local clones.
+        results = update_repositories(concurrency=2)
+        assert not any(r.created for r in results)
+        assert all(r.duration >= 0 for r in results)
+        # The command line interface reports failures.
+        self.assertRaises(SystemExit, call, '--update-all')
+
+    def test_async_repository(self):
+        """
+        Test the asynchronous repository interface.
+        """
+        if sys.version_info[:2] < (3, 5):
+            logger.warning("Skipping test of asynchronous repository interface (requires Python 3.5+).")
+            return
+        import asyncio
+        from vcs_repo_mgr.aio import AsyncGitRepo, AsyncHgRepo, coerce_async_repository
+        from vcs_repo_mgr.statistics import command_statistics
+        git_repository = create_git_repository()
+        hg_repository = create_hg_repository()
+        mirror = GitRepo(local=os.path.join(create_temporary_directory(), 'mirror'), remote=git_repository.local)
+
+        async def run_queries():
+            semaphore = asyncio.Semaphore(2)
+            async_git = coerce_async_repository(git_repository, semaphore=semaphore)
+            async_hg = coerce_async_repository(hg_repository, semaphore=semaphore)
+            async_mirror = coerce_async_repository(mirror, semaphore=semaphore)
+            assert isinstance(async_git, AsyncGitRepo)
+            assert isinstance(async_hg, AsyncHgRepo)
+            # Commands that don't need a shell are run without one.
+            self.assertEqual(async_git.get_program_arguments('find_tags', 'find_tags_command',
+                                                             local=git_repository.local),
+                             (['git', 'show-ref', '--tags'], git_repository.local))
+            self.assertEqual(async_hg.get_program_arguments('find_tags', 'find_tags_command',
+                                                            local=hg_repository.local),
+                             (['hg', '-R', hg_repository.local, 'tags'], None))
+            assert async_hg.get_program_arguments('commit', 'commit_command', local=hg_repository.local,
+                                                  author_combined=AUTHOR, message="Test") is None
+            await async_mirror.update()
+            # Updates are skipped when the remote repository hasn't changed.
+            mirror.check_remote = True
+            command_statistics.reset()
+            await async_mirror.update()
+            self.assertEqual([e.kind for e in command_statistics.get_entries() if e.operation == 'update'],
+                             ['git ls-remote'])
+            return await asyncio.gather(
+                async_git.find_revision_id('1.2'),
+                async_git.find_revision_number('master'),
+                async_git.branches(),
+                async_git.tags(),
+                async_hg.find_revision_id('1'),
+                async_hg.find_revision_number(),
+                async_hg.branches(),
+                async_mirror.find_revision_number('master'),
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(run_queries())
+        finally:
+            loop.close()
+        self.assertEqual(results[0], git_repository.find_revision_id('1.2'))
+        self.assertEqual(results[1], 3)
+        self.assertEqual(sorted(results[2]), ['master'])
+        self.assertEqual(sorted(results[3]), ['1.1', '1.2', '1.3'])
+        self.assertEqual(results[4], hg_repository.find_revision_id('1'))
+        self.assertEqual(results[5], 2)
+        self.assertEqual(sorted(results[6]), ['default'])
+        self.assertEqual(results[7], 3)
+        # Cancelling a task that's waiting for a lock doesn't leak the lock.
+        from vcs_repo_mgr.aio import acquire_lock
+        from vcs_repo_mgr.locking import FileLock
+        filename = os.path.join(create_temporary_directory(), 'test.lock')
+        holder = FileLock(filename)
+        holder.acquire()
+        waiter = FileLock(filename, timeout=10)
+
+        async def cancel_waiter():
+            task = asyncio.ensure_future(acquire_lock(waiter))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            holder.release()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            lock = FileLock(filename, timeout=5)
+            await acquire_lock(lock)
+            lock.release()
+            assert not waiter.is_locked
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(cancel_waiter())
+        finally:
+            loop.close()
+        # Queries take a shared lock on the local clone.
+        async_git = coerce_async_repository(git_repository)
+        git_repository.lock_timeout = 0.2
+        revision_id = git_repository.find_revision_id('master')
+        loop = asyncio.new_event_loop()
+        try:
+            with FileLock(git_repository.lock_file, exclusive=False):
+                self.assertEqual(loop.run_until_complete(async_git.find_revision_id('master')), revision_id)
+            with FileLock(git_repository.lock_file, exclusive=True):
+                for query in (async_git.find_revision_id('master'), async_git.count_revisions(revision_id),
+                              async_git.find_branches(), async_git.find_tags()):
+                    self.assertRaises(LockTimeoutError, loop.run_until_complete, query)
+        finally:
+            loop.close()
+            git_repository.lock_timeout = None
+
+    def test_native_git_refs(self):
+        """
+        Test reading git branches and tags without running git.
+        """
+        repository = create_git_repository()
+        execute('git', '-c', 'user.name=Peter Odding', '-c', 'user.email=vcs-repo-mgr@peterodding.com',
+                'tag', '--annotate', '--message=Annotated', '2.0', directory=repository.local)
+        execute('git', 'branch', 'feature', '1.1', directory=repository.local)
+        # Pack some of the references and create a loose reference that
+        # overrides a packed reference.
+        execute('git', 'pack-refs', '--all', directory=repository.local)
+        execute('git', 'tag', '--force', '1.1', '1.2', directory=repository.local)
+        execute('git', 'tag', '2.1', directory=repository.local)
+        assert repository.ref_reader is not None
+        native_branches = dict((r.branch, r.revision_id) for r in repository.find_branches())
+        native_tags = dict((r.tag, r.revision_id) for r in repository.find_tags())
+        # Compare the results to those reported by git.
+        repository.native_refs = False
+        assert repository.ref_reader is None
+        self.assertEqual(native_tags, dict((r.tag, r.revision_id) for r in repository.find_tags()))
+        self.assertEqual(sorted(native_branches), ['feature', 'master'])
+        for name, revision_id in native_branches.items():
+            self.assertEqual(revision_id, repository.find_revision_id(name))
+        # Make sure unknown repository formats aren't read.
+        repository.native_refs = True
+        execute('git', 'config', 'core.repositoryformatversion', '1', directory=repository.local)
+        execute('git', 'config', 'extensions.refStorage', 'reftable', directory=repository.local)
+        assert repository.ref_reader is None
+
+    def test_native_hg_caches(self):
+        """
+        Test reading Mercurial branches and tags from Mercurial's caches.
+        """
+        repository = create_hg_repository()
+        repository.hg('tag', '--user', AUTHOR, '--rev', '0', '1.0')
+        repository.hg('tag', '--local', 'local-tag')
+        repository.create_branch('feature')
+        repository.commit(message="Start feature branch")
+        assert repository.cache_reader is not None
+        # Get the results of the command line interface (which also refreshes the caches).
+        repository.native_refs = False
+        assert repository.cache_reader is None
+        cli_branches = dict((r.branch, (r.revision_number, r.revision_id)) for r in repository.find_branches())
+        cli_tags = dict((r.tag, (r.revision_number, r.revision_id)) for r in repository.find_tags())
+        self.assertEqual(sorted(cli_branches), ['default', 'feature'])
+        self.assertEqual(sorted(cli_tags), ['1.0', 'local-tag', 'tip'])
+        # Compare the results read from the caches.
+        repository.native_refs = True
+        native_branches = repository.cache_reader.find_branches()
+        native_tags = repository.cache_reader.find_tags()
+        for cli_results, native_results in ((cli_branches, native_branches), (cli_tags, native_tags)):
+            self.assertEqual(sorted(cli_results), [n for n, i, r in native_results])
+            for name, revision_id, revision_number in native_results:
+                self.assertEqual(cli_results[name][0], revision_number)
+                assert revision_id.startswith(cli_results[name][1])
+        # Committing refreshes the branch cache but the tags cache becomes
+        # stale and must not be used.
+        with open(os.path.join(repository.local, 'setup.py'), 'a') as handle:
+            handle.write("# Release 1.4\n")
+        repository.commit(message="Release 1.4")
+        self.assertEqual([r for n, i, r in repository.cache_reader.find_branches()], [3, 5])
+        assert repository.cache_reader.find_tags() is None
+        self.assertEqual(dict((r.tag, r.revision_number) for r in repository.find_tags())['tip'], 5)
+        # The tip and revision numbers match those reported by Mercurial.
+        tip = repository.hg('log', '--rev=tip', '--template={rev} {node}', capture=True).split()
+        self.assertEqual(repository.cache_reader.find_tip(), (int(tip[0]), tip[1]))
+        self.assertEqual(repository.cache_reader.find_revision_numbers([tip[1]]), {tip[1]: int(tip[0])})
+        listing = repository.hg('log', '--template={node} {rev}\\n', capture=True)
+        expected = dict((node, int(rev)) for node, rev in (line.split() for line in listing.splitlines()))
+        self.assertEqual(repository.cache_reader.find_revision_numbers(expected), expected)
+        # Unknown revision ids and expensive lookups are left to Mercurial.
+        assert repository.cache_reader.find_revision_numbers([tip[1], 'f' * 40]) is None
+        from vcs_repo_mgr import native
+        saved_limit = native.MAX_INDEX_SCANS
+        try:
+            native.MAX_INDEX_SCANS = 0
+            assert repository.cache_reader.find_revision_numbers([tip[1]]) is None
+        finally:
+            native.MAX_INDEX_SCANS = saved_limit
+
+    def test_git_coprocess(self):
+        """
+        Test resolving git revisions using a long running ``git cat-file`` process.
+        """
+        repository = create_git_repository()
+        revisions = ['1.1', 'master', 'master~1']
+        expected_ids = repository.find_revision_ids(revisions)
+        repository.coprocess = True
+        self.assertEqual(repository.find_revision_ids(revisions), expected_ids)
+        assert repository.cat_file.is_running
+        # Unknown revisions should still raise the expected exception.
+        self.assertRaises(ExternalCommandFailed, repository.find_revision_id, 'non-existing')
+        # Test that the process can be terminated explicitly.
+        repository.close()
+        assert not repository.cat_file.is_running
+        # Test that idle processes are terminated automatically.
+        repository.cat_file.idle_timeout = 0.1
+        self.assertEqual(repository.find_revision_numbers(revisions), [1, 3, 2])
+        time.sleep(1)
+        assert not repository.cat_file.is_running
+
+    def test_hg_command_server(self):
+        """
+        Test running Mercurial commands using a long running command server.
+        """
+        repository = create_hg_repository()
+        repository.coprocess = True
+        try:
+            self.assertEqual(repository.find_revision_numbers(['0', 'default']), [0, 2])
+            assert repository.command_server.is_running
+            assert repository.is_clean
+            assert repository.current_branch == 'default'
+            # Create a feature branch and merge it back into the default branch.
+            repository.create_branch('feature')
+            with open(os.path.join(repository.local, 'feature.txt'), 'w') as handle:
+                handle.write("New feature\n")
+            repository.add_files('feature.txt')
+            repository.commit(message="Implemented feature")
+            assert 'feature' in repository.branches
+            repository.checkout()
+            repository.merge(revision='feature')
+            repository.commit(message="Merged feature")
+            assert repository.find_revision_number() == 4
+            assert os.path.isfile(os.path.join(repository.local, 'feature.txt'))
+            # Failing commands should still raise the expected exceptions.
+            self.assertRaises(ExternalCommandFailed, repository.find_revision_id, 'non-existing')
+            # Conflicting changes should be reported as merge conflicts (we
+            # make sure that no interactive merge tool is started).
+            with open(os.path.join(repository.vcs_directory, 'hgrc'), 'a') as handle:
+                handle.write("[ui]\nmerge = internal:merge\n")
+            repository.close()
+            repository.create_branch('conflict')
+            with open(os.path.join(repository.local, 'setup.py'), 'w') as handle:
+                handle.write("# Conflicting change\n")
+            repository.commit(message="Conflicting change")
+            repository.checkout()
+            with open(os.path.join(repository.local, 'setup.py'), 'w') as handle:
+                handle.write("# Another conflicting change\n")
+            repository.commit(message="Another conflicting change")
+            repository.merge_conflict_handler = lambda e: False
+            self.assertRaises(MergeConflictError, repository.merge, revision='conflict')
+            self.assertEqual(repository.merge_conflicts, ['setup.py'])
+        finally:
+            repository.close()
+        assert not repository.command_server.is_running
+
     def check_working_tree_support(self, source_repo, file_to_change='setup.py'):
         """Shared logic to check working tree support."""
         # Make sure the source repository contains a bare checkout.
@@ -593,6 +1025,191 @@ class VcsRepoMgrTestCase(unittest.TestCase):
         release = repository.select_release('0.2')
         self.assertTrue(isinstance(repr(release), str))
 
+    def test_batch_mode(self):
+        """
+        Test answering queries read from standard input using ``vcs-tool --batch``.
+        """
+        repository = create_git_repository()
+        queries = [
+            dict(id=1, repository=repository.local, action='find-revision-id', revision='1.2'),
+            dict(id=2, repository=repository.local, action='find-revision-number', release='1.3'),
+            dict(repository=repository.local, action='list-releases'),
+            dict(repository=repository.local, action='select-release', release='1.9'),
+            dict(action='sum-revisions', arguments=[repository.local, '1.1', repository.local, '1.2']),
+            dict(id='unknown', repository=repository.local, action='unknown'),
+        ]
+        lines = [json.dumps(q) for q in queries] + ['', 'this is not JSON']
+        saved_stdin = sys.stdin
+        try:
+            sys.stdin = StringIO('\n'.join(lines) + '\n')
+            responses = [json.loads(line) for line in call('--batch').splitlines()]
+        finally:
+            sys.stdin = saved_stdin
+        self.assertEqual(len(responses), 7)
+        self.assertEqual(responses[0], dict(id=1, result=repository.find_revision_id('1.2')))
+        self.assertEqual(responses[1], dict(id=2, result=3))
+        self.assertEqual(responses[2], dict(result=['1.1', '1.2', '1.3']))
+        self.assertEqual(responses[3], dict(result='1.3'))
+        self.assertEqual(responses[4], dict(result=3))
+        self.assertEqual(responses[5]['id'], 'unknown')
+        assert 'error' in responses[5] and 'result' not in responses[5]
+        assert 'error' in responses[6]
+        # The output of external commands doesn't end up in the responses.
+        source = create_hg_repository()
+        home = create_temporary_directory()
+        clone = HgRepo(local=os.path.join(home, 'clone'), remote=source.local)
+        clone.create()
+        with open(os.path.join(home, '.vcs-repo-mgr.ini'), 'w') as handle:
+            handle.write("[batch-test]\ntype = hg\nlocal = %s\nremote = %s\n" % (clone.local, source.local))
+        with open(os.path.join(source.local, 'setup.py'), 'a') as handle:
+            handle.write("# Release 1.4\n")
+        source.commit(message="Release 1.4")
+        output = execute(sys.executable, '-c', 'from vcs_repo_mgr.cli import main; main()', '--batch',
+                         input=json.dumps(dict(action='update', repository='batch-test')) + '\n',
+                         capture=True, environment=dict(HOME=home))
+        self.assertEqual([json.loads(line) for line in output.splitlines()], [dict(result=True)])
+        self.assertEqual(clone.find_revision_id('default'), source.find_revision_id('default'))
+
+    def test_daemon(self):
+        """
+        Test answering queries using the daemon started by ``vcs-tool --serve``.
+        """
+        from vcs_repo_mgr.server import SOCKET_VARIABLE, RepositoryClient, RepositoryServer
+        repository = create_git_repository()
+        socket_path = os.path.join(create_temporary_directory(), 'vcs-repo-mgr.sock')
+        server = RepositoryServer(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        saved_socket = os.environ.get(SOCKET_VARIABLE)
+        os.environ[SOCKET_VARIABLE] = socket_path
+        try:
+            # Test the Python client.
+            client = RepositoryClient(fallback=False)
+            self.assertEqual(client.query('find-revision-number', repository=repository.local, revision='1.2'), 2)
+            self.assertEqual(client.query('list-releases', repository=repository.local), ['1.1', '1.2', '1.3'])
+            self.assertRaises(RemoteQueryError, client.query, 'unknown', repository=repository.local)
+            self.assertEqual(client.query('update', repository=repository.local), True)
+            client.close()
+            # Test the command line interface.
+            self.assertEqual(call('--client', '--repository=%s' % repository.local,
+                                  '--release=1.1', '--find-revision-id').strip(),
+                             repository.find_revision_id('1.1'))
+            # Relative pathnames are resolved in the working directory of the client.
+            parent, name = os.path.split(repository.local)
+            python_path = os.path.dirname(os.path.dirname(os.path.abspath(vcs_repo_mgr.__file__)))
+            for arguments in (['--repository=%s' % name, '--find-revision-number'],
+                              ['--sum-revisions', name, '1.1', 'git+%s' % name, '1.2']):
+                output = execute(sys.executable, '-c', 'from vcs_repo_mgr.cli import main; main()',
+                                 '--client', *arguments, capture=True, directory=parent,
+                                 environment=dict(PYTHONPATH=python_path))
+                # Both queries answer 3: master is the third commit and 1 + 2 = 3.
+                self.assertEqual(output.strip(), '3')
+            # Changes to the same repository share a lock.
+            assert server.get_lock(repository.local) is server.get_lock(repository.local + '/')
+            # A second daemon can't use the same socket.
+            self.assertRaises(EnvironmentError, RepositoryServer, socket_path)
+        finally:
+            server.shutdown()
+            server.server_close()
+            if saved_socket is None:
+                os.environ.pop(SOCKET_VARIABLE)
+            else:
+                os.environ[SOCKET_VARIABLE] = saved_socket
+        assert not os.path.exists(socket_path)
+        # Queries are answered in-process when the daemon isn't running.
+        client = RepositoryClient(socket_path)
+        self.assertEqual(client.query('find-revision-number', repository=repository.local, revision='1.3'), 3)
+
+    def test_startup_imports(self):
+        """
+        Test that ``vcs-tool`` doesn't import modules that most code paths don't need.
+
+        Importing the command line interface in a fresh Python interpreter
+        also serves as a benchmark of the startup time of ``vcs-tool``.
+        """
+        timer = Timer()
+        output = execute(sys.executable, '-c', 'import sys, vcs_repo_mgr.cli; print("\\n".join(sys.modules))',
+                         capture=True)
+        logger.info("Imported command line interface in fresh Python interpreter in %s.", timer)
+        imported_modules = set(output.splitlines())
+        assert 'vcs_repo_mgr.cli' in imported_modules
+        for name in ('coloredlogs', 'configparser', 'ConfigParser', 'humanfriendly.prompts', 'natsort',
+                     'sqlite3', 'vcs_repo_mgr.coprocesses', 'vcs_repo_mgr.fleet', 'vcs_repo_mgr.native',
+                     'vcs_repo_mgr.ordering'):
+            assert name not in imported_modules, "Module %s shouldn't be imported on startup!" % name
+
+    def test_configuration_cache(self):
+        """
+        Test the caching of configuration files and the configuration directory.
+        """
+        config_directory = create_temporary_directory()
+        saved_directory = vcs_repo_mgr.SYSTEM_CONFIG_DIRECTORY
+        vcs_repo_mgr.SYSTEM_CONFIG_DIRECTORY = os.path.join(config_directory, 'vcs-repo-mgr.d')
+        vcs_repo_mgr.USER_CONFIG_FILE = os.path.join(config_directory, 'vcs-repo-mgr.ini')
+        try:
+            os.mkdir(vcs_repo_mgr.SYSTEM_CONFIG_DIRECTORY)
+            for i in range(1, 3):
+                with open(os.path.join(vcs_repo_mgr.SYSTEM_CONFIG_DIRECTORY, '%i.ini' % i), 'w') as handle:
+                    handle.write('[Drop-In %i]\ntype = git\nremote = /srv/drop-in-%i.git\n' % (i, i))
+            with open(os.path.join(vcs_repo_mgr.SYSTEM_CONFIG_DIRECTORY, 'ignored.txt'), 'w') as handle:
+                handle.write('[ignored]\ntype = git\nremote = /srv/ignored.git\n')
+            with open(vcs_repo_mgr.USER_CONFIG_FILE, 'w') as handle:
+                handle.write('[drop-in 2]\nremote = /srv/override.git\n')
+            configuration = load_configuration()
+            # The configuration files are only parsed once.
+            assert load_configuration() is configuration
+            self.assertEqual(sorted(configuration.sections), ['Drop-In 1', 'Drop-In 2', 'drop-in 2'])
+            self.assertEqual(configuration.index['dropin2'], ['Drop-In 2', 'drop-in 2'])
+            self.assertEqual(find_configured_repository('drop_in_1').remote, '/srv/drop-in-1.git')
+            self.assertRaises(NoSuchRepositoryError, find_configured_repository, 'ignored')
+            self.assertRaises(AmbiguousRepositoryNameError, find_configured_repository, 'drop-in-2')
+            # Changes to the configuration files are picked up.
+            with open(vcs_repo_mgr.USER_CONFIG_FILE, 'w') as handle:
+                handle.write('[Drop-In 2]\nremote = /srv/drop-in-2-override.git\n')
+            assert load_configuration() is not configuration
+            self.assertEqual(find_configured_repository('drop-in-2').remote, '/srv/drop-in-2-override.git')
+        finally:
+            vcs_repo_mgr.SYSTEM_CONFIG_DIRECTORY = saved_directory
+
+    def test_release_index(self):
+        """
+        Test the sorted release index and the supported release orderings.
+        """
+        from vcs_repo_mgr.ordering import RELEASE_ORDERINGS
+        self.assertEqual(sorted(KNOWN_RELEASE_ORDERINGS), sorted(RELEASE_ORDERINGS))
+        repository = create_git_repository(num_commits=2)
+        for tag in ('1.10', '2.0rc1', '2.0.0-rc.1', '2.0.0'):
+            execute('git', 'tag', tag, directory=repository.local)
+        # Test the default (natural) ordering.
+        index = repository.release_index
+        assert repository.release_index is index
+        self.assertEqual(repository.select_release('1.9').identifier, '1.2')
+        self.assertEqual(repository.select_release('1.10').identifier, '1.10')
+        self.assertRaises(NoMatchingReleasesError, repository.select_release, '1.0')
+        self.assertEqual([r.identifier for r in index.between('1.2', '1.10')], ['1.2', '1.10'])
+        # Natural order sorting doesn't understand pre-releases.
+        self.assertEqual([r.identifier for r in index.latest(2)], ['2.0.0-rc.1', '2.0rc1'])
+        # The index is rebuilt when the tags change.
+        execute('git', 'tag', '1.5', directory=repository.local)
+        repository.invalidate_ref_snapshot()
+        assert repository.release_index is not index
+        self.assertEqual(repository.select_release('1.9').identifier, '1.5')
+        # Test the PEP 440 ordering (where 2.0.0-rc.1 is the same as 2.0rc1).
+        repository.release_ordering = 'pep440'
+        latest_releases = [r.identifier for r in repository.release_index.latest(4)]
+        self.assertEqual(latest_releases[0], '1.10')
+        self.assertEqual(sorted(latest_releases[1:3]), ['2.0.0-rc.1', '2.0rc1'])
+        self.assertEqual(latest_releases[3], '2.0.0')
+        self.assertEqual(repository.select_release('2.0').identifier, '2.0.0')
+        self.assertEqual(repository.select_release('1.99').identifier, '1.10')
+        # Test the semantic versioning ordering (which ignores other identifiers).
+        repository.release_ordering = 'semver'
+        self.assertEqual([r.identifier for r in repository.ordered_releases], ['2.0.0-rc.1', '2.0.0'])
+        self.assertEqual(repository.select_release('2.0.0-rc.2').identifier, '2.0.0-rc.1')
+        # Unknown orderings are rejected.
+        self.assertRaises(ValueError, GitRepo, local=repository.local, release_ordering='unknown')
+
     def test_factory_deduplication(self):
         """
         Test caching of previously loaded repository objects.
@@ -609,6 +1226,511 @@ class VcsRepoMgrTestCase(unittest.TestCase):
         self.assertTrue(a is not c)
         self.assertTrue(b is not c)
 
+    def test_repository_cache(self):
+        """Test the thread safe LRU cache used by :func:`~vcs_repo_mgr.repository_factory()`."""
+        cache = LRUCache(capacity=2)
+        cache.get_or_create('a', lambda: [1])
+        cache.get_or_create('b', lambda: [2])
+        # Using `a' makes `b' the least recently used object.
+        self.assertEqual(cache.get_or_create('a', lambda: [3]), [1])
+        cache.get_or_create('c', lambda: [4])
+        self.assertTrue('a' in cache and 'c' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.stats, dict(capacity=2, evictions=1, hits=1, misses=3, size=2))
+        # Failed constructions aren't cached.
+        self.assertRaises(ValueError, cache.get_or_create, 'd', lambda: int('x'))
+        self.assertFalse('d' in cache)
+        # Including constructions interrupted by exceptions that aren't errors.
+        self.assertRaises(SystemExit, cache.get_or_create, 'g', sys.exit)
+        self.assertFalse('g' in cache.pending)
+        self.assertEqual(cache.get_or_create('g', lambda: [5]), [5])
+        # Concurrent lookups of the same key wait for a single construction.
+        constructed = []
+
+        def slow_constructor():
+            time.sleep(0.2)
+            constructed.append(object())
+            return constructed[-1]
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_create('e', slow_constructor)))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(constructed), 1)
+        self.assertTrue(all(r is constructed[0] for r in results) and len(results) == 5)
+        # Weak references don't keep objects alive.
+        weak_cache = LRUCache(weak=True)
+        value = weak_cache.get_or_create('f', set)
+        self.assertTrue(weak_cache.get('f') is value)
+        del value
+        self.assertTrue(weak_cache.get('f') is None)
+        self.assertEqual(weak_cache.evictions, 1)
+        # The repository factory uses the cache.
+        misses = vcs_repo_mgr.loaded_repositories.misses
+        a = create_git_repository()
+        b = vcs_repo_mgr.repository_factory('git', local=a.local)
+        c = vcs_repo_mgr.repository_factory('git', local=a.local)
+        self.assertTrue(b is c and a is not b)
+        self.assertEqual(vcs_repo_mgr.loaded_repositories.misses, misses + 1)
+
+    def test_remote_change_detection(self):
+        """Test that :func:`~vcs_repo_mgr.Repository.update()` skips pulls when the remote hasn't changed."""
+        for create_source, repository_type in ((create_git_repository, GitRepo), (create_hg_repository, HgRepo)):
+            source = create_source()
+            mirror = repository_type(local=os.path.join(create_temporary_directory(), 'mirror'),
+                                     remote=source.local, bare=True, check_remote=True)
+            mirror.create()
+            self.assertFalse(mirror.has_remote_changes())
+            # Make sure the pull is skipped by making it fail when it's not.
+            mirror.update_command = 'false'
+            mirror.update()
+            # New commits in the remote repository are detected.
+            with open(os.path.join(source.local, 'setup.py'), 'a') as handle:
+                handle.write("# Release 1.4\n")
+            source.commit(message="Release 1.4")
+            self.assertTrue(mirror.has_remote_changes())
+            self.assertRaises(ExternalCommandFailed, mirror.update)
+            del mirror.update_command
+            mirror.update()
+            self.assertFalse(mirror.has_remote_changes())
+            # Remote repositories that can't be queried are assumed to have changes.
+            self.assertTrue(mirror.has_remote_changes(remote=os.path.join(source.local, 'nonexistent')))
+
+    def test_clone_strategies(self):
+        """Test the clone strategies that don't clone the complete repository."""
+        source = create_git_repository(num_commits=5)
+        # Tag a release and a non-release on a branch that isn't tracked.
+        execute('git', 'checkout', '--quiet', '-b', 'feature', '1.2', directory=source.local)
+        with open(os.path.join(source.local, 'setup.py'), 'a') as handle:
+            handle.write("# Release 1.2.1\n")
+        source.commit(message="Release 1.2.1")
+        feature_commit = source.find_revision_id('feature')
+        execute('git', 'tag', '1.2.1', directory=source.local)
+        with open(os.path.join(source.local, 'setup.py'), 'a') as handle:
+            handle.write("# Experiment\n")
+        source.commit(message="Experiment")
+        experiment_commit = source.find_revision_id('feature')
+        execute('git', 'tag', 'experiment', directory=source.local)
+        execute('git', 'checkout', '--quiet', 'master', directory=source.local)
+        # Git ignores --depth for local clones unless a file:// URL is used.
+        remote = 'file://%s' % source.local
+        shallow = GitRepo(local=os.path.join(create_temporary_directory(), 'shallow'),
+                          remote=remote, clone_strategy='shallow', release_filter=r'^\d+(?:\.\d+)+$')
+        shallow.create()
+        self.assertTrue(shallow.is_shallow)
+        self.assertEqual(shallow.tracked_branches, ['master'])
+        # Release tags are fetched, other tags outside the tracked branches aren't.
+        self.assertEqual(sorted(shallow.tags), ['1.1', '1.2', '1.2.1', '1.3', '1.4', '1.5'])
+        self.assertEqual(shallow.ordered_releases[-1].identifier, '1.5')
+        self.assertFalse(shallow.has_remote_changes())
+        # New release tags are fetched by updates.
+        execute('git', 'tag', '1.2.2', feature_commit, directory=source.local)
+        self.assertTrue(shallow.has_remote_changes())
+        shallow.update()
+        self.assertTrue(shallow.is_shallow)
+        self.assertIn('1.2.2', shallow.tags)
+        self.assertFalse(shallow.has_remote_changes())
+        # Fetching missing revisions requires an exclusive lock.
+        from vcs_repo_mgr.locking import FileLock
+        shallow.lock_timeout = 0.2
+        with FileLock(shallow.lock_file, exclusive=False):
+            self.assertRaises(LockTimeoutError, shallow.find_revision_id, 'experiment')
+        shallow.lock_timeout = None
+        # Missing revisions are fetched on demand.
+        self.assertEqual(shallow.find_missing_revisions(['1.2', 'experiment', 'master']), ['experiment'])
+        self.assertEqual(shallow.find_revision_id('experiment'), experiment_commit)
+        self.assertFalse(shallow.find_missing_revisions(['experiment']))
+        directory = create_temporary_directory()
+        shallow.export(directory, revision='1.2')
+        with open(os.path.join(directory, 'setup.py')) as handle:
+            self.assertEqual(handle.read().splitlines()[-1], "# Release 1.2")
+        # Updates fetch new commits of the tracked branches only.
+        with open(os.path.join(source.local, 'setup.py'), 'a') as handle:
+            handle.write("# Release 1.6\n")
+        source.commit(message="Release 1.6")
+        shallow.update()
+        self.assertTrue(shallow.is_shallow)
+        self.assertEqual(shallow.tracked_branches, ['master'])
+        self.assertEqual(shallow.find_revision_id('master'), source.find_revision_id('master'))
+        # Revision numbers require (and trigger) fetching the complete history,
+        # which happens before the query takes its shared lock (converting
+        # a shared lock to an exclusive lock temporarily releases the lock).
+        original_convert = FileLock.convert
+        try:
+            FileLock.convert = lambda *args, **kw: self.fail("Unexpected lock conversion!")
+            self.assertEqual(shallow.find_revision_number('master'), 6)
+        finally:
+            FileLock.convert = original_convert
+        self.assertFalse(shallow.is_shallow)
+        # Single branch and partial clones.
+        single = GitRepo(local=os.path.join(create_temporary_directory(), 'single'),
+                         remote=remote, clone_strategy='single-branch')
+        self.assertEqual(single.find_revision_number('master'), 6)
+        self.assertEqual(single.tracked_branches, ['master'])
+        self.assertIn('experiment', single.tags)
+        self.assertEqual(single.find_revision_id('feature'), source.find_revision_id('feature'))
+        self.assertEqual(single.tracked_branches, ['feature', 'master'])
+        partial = GitRepo(local=os.path.join(create_temporary_directory(), 'partial'),
+                          remote=remote, clone_strategy='partial')
+        self.assertEqual(partial.clone_options, ['--filter=blob:none'])
+        self.assertEqual(partial.find_revision_number('1.3'), 3)
+        # Mercurial supports stream clones.
+        hg_source = create_hg_repository()
+        stream = HgRepo(local=os.path.join(create_temporary_directory(), 'stream'),
+                        remote=hg_source.local, clone_strategy='stream')
+        self.assertEqual(stream.find_revision_number('default'), hg_source.find_revision_number('default'))
+        # Unsupported clone strategies are rejected.
+        self.assertRaises(ValueError, HgRepo, remote=hg_source.local, clone_strategy='shallow')
+
+    def test_shared_store(self):
+        """Test that clones of related repositories can share a store."""
+        for create_source, repository_type, revision_numbers in ((create_git_repository, GitRepo, (3, 4)),
+                                                                 (create_hg_repository, HgRepo, (2, 3))):
+            source = create_source()
+            # Create a fork of the source repository with an additional commit.
+            fork = repository_type(local=os.path.join(create_temporary_directory(), 'fork'),
+                                   remote=source.local, bare=False, author=AUTHOR)
+            fork.create()
+            with open(os.path.join(fork.local, 'setup.py'), 'a') as handle:
+                handle.write("# Release 1.4\n")
+            fork.commit(message="Release 1.4")
+            store = os.path.join(create_temporary_directory(), 'store')
+            clones = [repository_type(local=os.path.join(create_temporary_directory(), 'clone'),
+                                      remote=remote, shared_store=store)
+                      for remote in (source.local, fork.local)]
+            for clone, remote, revision_number in zip(clones, (source, fork), revision_numbers):
+                clone.create()
+                self.assertEqual(clone.find_revision_id(), remote.find_revision_id())
+                self.assertEqual(clone.find_revision_number(), revision_number)
+            # The history of the fork doesn't leak into the clone of the source.
+            clones[0].invalidate_ref_snapshot()
+            self.assertEqual(clones[0].find_revision_id(), source.find_revision_id())
+            self.assertEqual(clones[0].find_revision_number(), revision_numbers[0])
+            if repository_type is GitRepo:
+                for clone in clones:
+                    with open(os.path.join(clone.vcs_directory, 'objects', 'info', 'alternates')) as handle:
+                        self.assertEqual(handle.read().strip(), os.path.join(store, 'objects'))
+            else:
+                for clone, remote in zip(clones, (source, fork)):
+                    self.assertEqual(execute('hg', '-R', clone.local, 'paths', 'default', capture=True), remote.local)
+                self.assertFalse(execute('hg', '-R', clones[0].local, 'log', '--rev=%s' % fork.find_revision_id(),
+                                         check=False, silent=True))
+
+    def test_update_coalescing(self):
+        """Test the update freshness policy and coalescing of concurrent updates."""
+        source = create_git_repository()
+        clone = GitRepo(local=os.path.join(create_temporary_directory(), 'clone'), remote=source.local)
+        clone.create()
+        # Count the pulls and make them slow enough to overlap.
+        counter = os.path.join(create_temporary_directory(), 'pulls')
+        clone.update_command = 'echo pull >> %s && sleep 1 && %s' % (counter, GitRepo.update_command)
+        # Fresh clones aren't updated.
+        clone.max_age = 300
+        self.assertTrue(clone.is_fresh)
+        clone.update()
+        self.assertFalse(os.path.exists(counter))
+        # Concurrent updates result in a single pull.
+        clone.max_age = None
+        self.assertFalse(clone.is_fresh)
+        threads = [threading.Thread(target=clone.update) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(counter) as handle:
+            self.assertEqual(len(handle.read().splitlines()), 1)
+        # Updates that don't overlap aren't coalesced.
+        clone.update()
+        with open(counter) as handle:
+            self.assertEqual(len(handle.read().splitlines()), 2)
+        # Updates made while holding an exclusive lock (like merge_up() does)
+        # don't deadlock with concurrent updates.
+        clone.lock_timeout = 10
+        errors = []
+
+        def update_while_locked():
+            try:
+                with clone.lock(exclusive=True):
+                    time.sleep(1)
+                    clone.update()
+            except Exception as e:
+                errors.append(e)
+
+        def update():
+            try:
+                clone.update()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=update_while_locked), threading.Thread(target=update)]
+        threads[0].start()
+        time.sleep(0.5)
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_repository_locking(self):
+        """Test reader/writer locking of local clones and atomic creation of local clones."""
+        from vcs_repo_mgr.locking import FileLock
+        repository = create_git_repository()
+        repository.lock_timeout = 0.2
+        # Queries wait for exclusive locks held by other processes.
+        with FileLock(repository.lock_file, exclusive=True):
+            self.assertRaises(LockTimeoutError, repository.find_revision_id, 'master')
+        self.assertEqual(repository.lock_statistics.timeouts, 1)
+        # Queries can run concurrently, changes wait for queries to finish.
+        with FileLock(repository.lock_file, exclusive=False):
+            self.assertTrue(HEX_SUM_PATTERN.match(repository.find_revision_id('master')))
+            self.assertTrue('1.3' in repository.tags)
+            with open(os.path.join(repository.local, 'setup.py'), 'a') as handle:
+                handle.write("# Release 1.4\n")
+            self.assertRaises(LockTimeoutError, repository.commit, message="Release 1.4")
+        self.assertEqual(repository.lock_statistics.timeouts, 2)
+        # Locks are re-entrant (shared locks are converted to exclusive locks when needed).
+        with repository.lock():
+            repository.commit(message="Release 1.4")
+            self.assertEqual(repository.find_revision_number('master'), 4)
+        self.assertTrue(repository.lock_statistics.acquisitions > 0)
+        # A failed conversion restores the original lock without changing its timeout.
+        with FileLock(repository.lock_file, exclusive=False) as lock:
+            with FileLock(repository.lock_file, exclusive=False):
+                self.assertRaises(LockTimeoutError, lock.convert, exclusive=True, timeout=0.2)
+            self.assertTrue(lock.is_locked)
+            self.assertFalse(lock.exclusive)
+            self.assertEqual(lock.timeout, None)
+            other = FileLock(repository.lock_file, exclusive=True, timeout=0.2)
+            self.assertRaises(LockTimeoutError, other.acquire)
+        # Concurrent creation of a local clone results in a single clone.
+        local = os.path.join(create_temporary_directory(), 'clone')
+        results = []
+        clones = [GitRepo(local=local, remote=repository.local) for i in range(3)]
+        threads = [threading.Thread(target=lambda clone=clone: results.append(clone.create())) for clone in clones]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [False, False, True])
+        self.assertEqual(clones[0].find_revision_number('master'), 4)
+        self.assertEqual([e for e in os.listdir(os.path.dirname(local)) if e != 'clone'], [])
+
+    def test_read_only_locking(self):
+        """Test that queries don't need write access to the directory of the lock file."""
+        from vcs_repo_mgr.locking import FileLock
+        from vcs_repo_mgr.native import GitRefReader
+        source = create_git_repository()
+        mirror = GitRepo(local=os.path.join(create_temporary_directory(), 'mirror'), remote=source.local)
+        mirror.create()
+        assert GitRefReader(mirror.vcs_directory).is_supported
+        assert not os.path.exists(mirror.lock_file)
+        revision_id = source.find_revision_id('master')
+        existing_file = os.path.join(mirror.vcs_directory, 'existing.lock')
+        open(existing_file, 'w').close()
+        os.chmod(existing_file, 0o444)
+        os.chmod(os.path.dirname(mirror.local), 0o755)
+        os.chmod(mirror.vcs_directory, 0o555)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    if os.geteuid() == 0:
+                        # The superuser ignores file permissions.
+                        os.setgid(65534)
+                        os.setuid(65534)
+                        os.environ.update(GIT_CONFIG_COUNT='1',
+                                          GIT_CONFIG_KEY_0='safe.directory',
+                                          GIT_CONFIG_VALUE_0='*')
+                    # Existing lock files are opened read-only.
+                    with FileLock(existing_file, exclusive=False) as lock:
+                        assert lock.is_locked
+                    # Missing lock files that can't be created are skipped.
+                    assert mirror.find_revision_id('master') == revision_id
+                    assert '1.3' in mirror.tags
+                    assert not os.path.exists(mirror.lock_file)
+                    status = 0
+                except Exception:
+                    logger.exception("Read-only locking failed!")
+                finally:
+                    os._exit(status)
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        finally:
+            os.chmod(mirror.vcs_directory, 0o755)
+
+    def test_export_archive(self):
+        """Test exporting trees to archives without extracting them."""
+        import io
+        import tarfile
+        import zipfile
+        for repository, revision in (create_git_repository(), '1.2'), (create_hg_repository(), '1'):
+            directory = create_temporary_directory()
+            for filename in 'release.tar', 'release.tar.gz', 'release.tar.xz', 'release.zip':
+                if filename.endswith('.xz') and sys.version_info[0] == 2:
+                    # Python 2 doesn't include the lzma module.
+                    self.assertRaises(ValueError, repository.export_archive,
+                                      os.path.join(directory, filename), revision=revision)
+                    continue
+                pathname = os.path.join(directory, filename)
+                self.assertEqual(repository.export_archive(pathname, revision=revision), os.path.getsize(pathname))
+                if filename.endswith('.zip'):
+                    with zipfile.ZipFile(pathname) as archive:
+                        contents = archive.read('setup.py')
+                else:
+                    with tarfile.open(pathname) as archive:
+                        contents = archive.extractfile('setup.py').read()
+                self.assertEqual(contents.decode('UTF-8').splitlines()[-1], "# Release 1.2")
+            # Archives can be written to file objects.
+            buffer = io.BytesIO()
+            repository.export_archive(buffer)
+            buffer.seek(0)
+            with tarfile.open(fileobj=buffer) as archive:
+                self.assertTrue('setup.py' in archive.getnames())
+            # Archives can be generated in chunks (and generation can be aborted).
+            chunks = repository.generate_archive(chunk_size=512)
+            self.assertEqual(len(next(chunks)), 512)
+            chunks.close()
+            # Failed exports don't leave incomplete archives behind.
+            pathname = os.path.join(directory, 'nonexistent.tar')
+            self.assertRaises(ExternalCommandFailed, repository.export_archive, pathname, revision='nonexistent')
+            self.assertFalse(os.path.exists(pathname))
+            self.assertRaises(ValueError, repository.export_archive, os.path.join(directory, 'release.rar'))
+            # Existing files are left alone when the export fails.
+            for filename, exception in (('notes.txt', ValueError), ('release.tar', ExternalCommandFailed)):
+                pathname = os.path.join(directory, filename)
+                with open(pathname, 'w') as handle:
+                    handle.write("Don't touch me!\n")
+                self.assertRaises(exception, repository.export_archive, pathname, revision='nonexistent')
+                with open(pathname) as handle:
+                    self.assertEqual(handle.read(), "Don't touch me!\n")
+            self.assertEqual(sorted(f for f in os.listdir(directory) if f.endswith('.tmp')), [])
+
+    def test_export_cache(self):
+        """Test that exports of the same tree are served from the export cache."""
+        from vcs_repo_mgr.exports import ExportCache
+        for repository, revisions in ((create_git_repository(), ('1.1', '1.2', '1.3')),
+                                      (create_hg_repository(), ('0', '1', '2'))):
+            cache_directory = create_temporary_directory()
+            repository.export_cache = cache_directory
+            repository.export(create_temporary_directory(), revision=revisions[0])
+            tree_id = repository.find_tree_id(revisions[1])
+            self.assertTrue(HEX_SUM_PATTERN.match(tree_id))
+            # Cached trees don't require the export command.
+            repository.export(create_temporary_directory(), revision=revisions[1])
+            repository.export_command = 'false'
+            try:
+                for method in 'copy', 'hardlink':
+                    repository.export_cache_method = method
+                    directory = create_temporary_directory()
+                    repository.export(directory, revision=revisions[1])
+                    with open(os.path.join(directory, 'setup.py')) as handle:
+                        self.assertEqual(handle.read().splitlines()[-1], "# Release 1.2")
+                    cached_file = os.path.join(cache_directory, tree_id, 'setup.py')
+                    self.assertEqual(os.path.samefile(cached_file, os.path.join(directory, 'setup.py')),
+                                     method == 'hardlink')
+                self.assertRaises(ExternalCommandFailed, repository.export, create_temporary_directory(), revisions[2])
+            finally:
+                del repository.export_command
+            # The least recently used trees are evicted.
+            self.assertEqual(ExportCache(cache_directory, max_size=1).evict(keep=tree_id), 1)
+            self.assertEqual(sorted(e for e in os.listdir(cache_directory) if not e.startswith('.')),
+                             [tree_id, '%s.size' % tree_id])
+
+    def test_incremental_export(self):
+        """Test that exports are updated by exporting only the files that changed."""
+        for repository in create_git_repository(), create_hg_repository():
+            os.mkdir(os.path.join(repository.local, 'docs'))
+            for filename in 'README.txt', 'docs/notes.txt':
+                with open(os.path.join(repository.local, filename), 'w') as handle:
+                    handle.write("%s\n" % filename)
+            repository.add_files(all=True)
+            repository.commit(message="Add documentation")
+            old_revision = repository.find_revision_id()
+            os.unlink(os.path.join(repository.local, 'docs', 'notes.txt'))
+            with open(os.path.join(repository.local, 'setup.py'), 'a') as handle:
+                handle.write("# Release 1.4\n")
+            repository.add_files(all=True)
+            repository.commit(message="Release 1.4")
+            new_revision = repository.find_revision_id()
+            # Create the initial export.
+            repository.incremental_export = True
+            directory = create_temporary_directory()
+            repository.export(directory, revision=old_revision)
+            self.assertEqual(repository.find_exported_revision(directory), old_revision)
+            self.assertTrue(os.path.isfile(os.path.join(directory, 'docs', 'notes.txt')))
+            unchanged_file = os.stat(os.path.join(directory, 'README.txt'))
+            # Update the export to the new revision.
+            repository.export(directory, revision=new_revision)
+            self.assertEqual(repository.find_exported_revision(directory), new_revision)
+            self.assertFalse(os.path.exists(os.path.join(directory, 'docs')))
+            with open(os.path.join(directory, 'setup.py')) as handle:
+                self.assertEqual(handle.read().splitlines()[-1], "# Release 1.4")
+            self.assertEqual(os.stat(os.path.join(directory, 'README.txt')).st_ino, unchanged_file.st_ino)
+            # Incremental exports also work backwards.
+            repository.export(directory, revision=old_revision)
+            self.assertTrue(os.path.isfile(os.path.join(directory, 'docs', 'notes.txt')))
+            with open(os.path.join(directory, 'setup.py')) as handle:
+                self.assertEqual(handle.read().splitlines()[-1], "# Release 1.3")
+            # Unknown revisions leave the export alone.
+            self.assertRaises(ExternalCommandFailed, repository.export, directory, revision='nonexistent')
+            self.assertEqual(repository.find_exported_revision(directory), old_revision)
+        # Exports by other repositories invalidate the record of the previous export.
+        repository = create_git_repository()
+        other = create_git_repository()
+        with open(os.path.join(other.local, 'README.txt'), 'w') as handle:
+            handle.write("Other repository\n")
+        other.add_files(all=True)
+        other.commit(message="Add README")
+        for incremental in True, False:
+            repository.incremental_export = True
+            other.incremental_export = incremental
+            directory = create_temporary_directory()
+            repository.export(directory, revision='1.2')
+            self.assertEqual(repository.find_exported_revision(directory), repository.find_revision_id('1.2'))
+            other.export(directory)
+            self.assertEqual(repository.find_exported_revision(directory), None)
+            # The next export is a complete export instead of an update.
+            repository.export(directory, revision='1.3')
+            self.assertEqual(repository.find_exported_revision(directory), repository.find_revision_id('1.3'))
+            self.assertEqual(other.find_exported_revision(directory), None)
+            with open(os.path.join(directory, 'setup.py')) as handle:
+                self.assertEqual(handle.read().splitlines()[-1], "# Release 1.3")
+
+    def test_command_statistics(self):
+        """Test the statistics about external commands per repository operation."""
+        from vcs_repo_mgr.statistics import command_statistics, get_command_kind
+        self.assertEqual(get_command_kind('cd /tmp && git rev-list --count master'), 'git rev-list')
+        self.assertEqual(get_command_kind(['hg', '-R', '/tmp', 'log', '--rev=tip']), 'hg log')
+        self.assertEqual(get_command_kind('cp --archive a b'), 'cp')
+        repository = create_git_repository()
+        command_statistics.reset()
+        self.assertEqual(repository.find_revision_number('master'), 3)
+        self.assertRaises(ExternalCommandFailed, repository.find_revision_id, 'nonexistent')
+        entries = dict(((e.operation, e.kind), e) for e in command_statistics.get_entries())
+        self.assertEqual(entries[('find_revision_number', 'git rev-list')].count, 1)
+        self.assertEqual(entries[('find_revision_number', 'git rev-list')].output_bytes, 1)
+        self.assertEqual(entries[('find_revision_id', 'git rev-parse')].failures, 1)
+        self.assertTrue('git rev-list' in command_statistics.format_table())
+        # Queries answered by the git cat-file coprocess are recorded as well.
+        repository.coprocess = True
+        try:
+            self.assertEqual(repository.find_revision_ids(['1.1', '1.2']),
+                             [repository.find_revision_id('1.1'), repository.find_revision_id('1.2')])
+        finally:
+            repository.coprocess = False
+        entries = dict(((e.operation, e.kind), e) for e in command_statistics.get_entries())
+        self.assertEqual(entries[('find_revision_ids', 'git cat-file')].count, 1)
+        self.assertTrue(entries[('find_revision_ids', 'git cat-file')].output_bytes > 0)
+        # The statistics are reported by vcs-tool --stats.
+        saved_stderr = sys.stderr
+        try:
+            sys.stderr = StringIO()
+            call('--repository=%s' % repository.local, '--revision=1.2', '--find-revision-id', '--stats')
+            self.assertTrue('find_revision_id' in sys.stderr.getvalue())
+        finally:
+            sys.stderr = saved_stderr
+
     def create_repo_using_config(self, repository_type, remote_location,
                                  second_repository_type=None,
                                  second_remote_location=None):